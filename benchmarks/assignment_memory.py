@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Measures the memory needed to keep all the assignments of an InterPro
+domain assignment file in memory, with and without string interning in
+`gfam.interpro.AssignmentReader`, and with the array-backed
+`gfam.assignment.CompactSequenceWithAssignments` container.
+
+Usage: python benchmarks/assignment_memory.py [options] assignment_file
+
+The assignments are loaded into a dict of `SequenceWithAssignments`
+objects (or `CompactSequenceWithAssignments` objects in the ``compact``
+mode), just like ``find_unassigned`` does it. Each mode is measured in
+a fresh interpreter and the increase of the peak resident set size (RSS)
+during loading is reported.
+"""
+
+from common import format_bytes, get_peak_rss, print_table, timed
+
+import os
+import subprocess
+import sys
+
+from gfam.assignment import CompactSequenceWithAssignments, \
+        SequenceWithAssignments
+from gfam.interpro import AssignmentReader
+from optparse import OptionParser
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+
+#: Measured modes: string interning and the sequence class used
+MODES = [("off", False, SequenceWithAssignments),
+         ("on", True, SequenceWithAssignments),
+         ("compact", True, CompactSequenceWithAssignments)]
+
+
+def load_assignments(fname, intern_strings, seq_class):
+    """Loads all the assignments from the given file into a dict mapping
+    sequence IDs to instances of `seq_class`."""
+    seqcat = {}
+    for assignment in AssignmentReader(fname, intern_strings=intern_strings):
+        try:
+            seq = seqcat[assignment.id]
+        except KeyError:
+            seq = seq_class(assignment.id, assignment.length)
+            seqcat[assignment.id] = seq
+        seq.assign(assignment, overlap_check=False)
+    return seqcat
+
+
+def measure(fname, intern_strings, seq_class):
+    """Loads the given file and prints the number of sequences, the load
+    time and the increase of the peak RSS, separated by spaces."""
+    before = get_peak_rss()
+    seqcat, elapsed = timed(load_assignments, fname, intern_strings,
+                            seq_class)
+    after = get_peak_rss()
+    print len(seqcat), elapsed, after - before
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("--measure", dest="measure",
+            choices=[mode[0] for mode in MODES],
+            help="internal use only: measure the given mode in this process")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("exactly one assignment file must be given")
+
+    if options.measure:
+        for mode, intern_strings, seq_class in MODES:
+            if mode == options.measure:
+                return measure(args[0], intern_strings, seq_class)
+
+    if get_peak_rss() is None:
+        parser.error("peak RSS cannot be measured on this platform")
+
+    rows, results = [], {}
+    for mode, _, _ in MODES:
+        output = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   "--measure", mode, args[0]],
+                                  stdout=subprocess.PIPE).communicate()[0]
+        num_seqs, elapsed, rss = output.split()
+        results[mode] = int(rss)
+        rows.append([mode, num_seqs, "%.2f" % float(elapsed),
+                     format_bytes(int(rss))])
+    print_table(["mode", "sequences", "load time (s)", "RSS increase"],
+                rows)
+    if results["off"]:
+        print
+        for mode, _, _ in MODES[1:]:
+            print "RSS reduction (%s): %.1f%%" % (mode,
+                100.0 * (results["off"] - results[mode]) / results["off"])
+
+
+if __name__ == "__main__":
+    main()
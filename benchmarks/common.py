@@ -0,0 +1,60 @@
+"""Helper routines shared by the GFam benchmark scripts.
+
+The benchmark scripts in this directory are not installed with GFam; they
+are meant to be run from the root of the source tree, e.g.::
+
+    $ python benchmarks/mapping_memory.py --help
+"""
+
+import os
+import sys
+
+from time import time
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+# Make sure that the benchmarks use the GFam source tree they are in
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gfam.instrumentation import format_bytes, get_peak_rss, print_table
+
+
+def deep_getsizeof(obj, seen=None):
+    """Returns the approximate number of bytes used by `obj` and all the
+    objects reachable from it via containers and instance attributes.
+    Objects shared between several containers are counted only once.
+    Classes, modules and functions are not followed."""
+    if seen is None:
+        seen = set()
+
+    total, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(sys))) or \
+                callable(obj):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return total
+
+
+def timed(func, *args, **kwds):
+    """Calls `func` with the given arguments and returns the result and the
+    elapsed wall clock time in seconds."""
+    start = time()
+    result = func(*args, **kwds)
+    return result, time() - start
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Measures the throughput of reading compressed files line by line with
+``gzip.GzipFile`` / ``bz2.BZ2File`` and with
+`gfam.utils.BackgroundDecompressor`, which `gfam.utils.open_anything`
+uses for compressed files.
+
+Usage: python benchmarks/decompression.py [options] [compressed_file]...
+
+Each file is read twice with each reader: once by simply iterating over
+its lines and once by also splitting each line at the tab characters, which
+mimics the parsing done by the GFam scripts. If no file is given, a
+synthetic IPRScan-like file is generated and compressed with both gzip and
+bzip2.
+"""
+
+from __future__ import with_statement
+
+from common import format_bytes, print_table, timed
+
+import bz2
+import gzip
+import os
+import random
+
+from gfam.utils import BackgroundDecompressor, temporary_dir
+from optparse import OptionParser
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+
+def generate_files(dirname, num_lines, seed):
+    """Generates a synthetic IPRScan-like file with the given number of
+    lines in the given directory, compresses it with gzip and bzip2 and
+    returns the names of the compressed files."""
+    rng = random.Random(seed)
+    sources = ["HMMPfam", "HMMSmart", "HMMPanther", "Gene3D", "superfamily"]
+    fnames = [os.path.join(dirname, "iprscan.tsv.gz"),
+              os.path.join(dirname, "iprscan.tsv.bz2")]
+    outfiles = [gzip.GzipFile(fnames[0], "wb"), bz2.BZ2File(fnames[1], "wb")]
+    for i in xrange(num_lines):
+        start = rng.randint(1, 400)
+        line = "S%06d\t%s\t%d\t%s\tD%05d\tdomain\t%d\t%d\t%.1e\tT\t"\
+               "01-Jan-2010\tIPR%06d\tname\tGO:0005515\n" % \
+               (i // 6, "0" * 32, 500, rng.choice(sources),
+                rng.randint(1, 20000), start, start + rng.randint(20, 100),
+                10 ** rng.uniform(-30, 0), rng.randint(1, 20000))
+        for outfile in outfiles:
+            outfile.write(line)
+    for outfile in outfiles:
+        outfile.close()
+    return fnames
+
+
+def stdlib_reader(fname):
+    """Opens the given file with ``gzip.GzipFile`` or ``bz2.BZ2File``"""
+    if fname.endswith(".bz2"):
+        return bz2.BZ2File(fname)
+    return gzip.GzipFile(fname)
+
+
+def count_lines(infile):
+    """Iterates over the lines of the given file and returns the number of
+    bytes read"""
+    total = 0
+    for line in infile:
+        total += len(line)
+    infile.close()
+    return total
+
+
+def split_lines(infile):
+    """Iterates over the lines of the given file, splits them at tab
+    characters and returns the number of bytes read"""
+    total = 0
+    for line in infile:
+        line.rstrip("\n").split("\t")
+        total += len(line)
+    infile.close()
+    return total
+
+
+def benchmark(fnames):
+    """Reads the given compressed files with both readers and prints the
+    results"""
+    rows = []
+    for fname in fnames:
+        for workload in (count_lines, split_lines):
+            for name, reader in [("stdlib", stdlib_reader),
+                                 ("background", BackgroundDecompressor)]:
+                size, elapsed = timed(workload, reader(fname))
+                rows.append([os.path.basename(fname), workload.__name__,
+                             name, format_bytes(size), "%.2f" % elapsed,
+                             "%s/s" % format_bytes(size / elapsed)])
+    print_table(["file", "workload", "reader", "data", "time (s)",
+                 "throughput"], rows)
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("-n", "--num-lines", dest="num_lines", type=int,
+            default=500000, metavar="N",
+            help="number of lines in the generated file (default: %default)")
+    parser.add_option("--seed", dest="seed", type=int, default=42,
+            help="random seed (default: %default)")
+    options, args = parser.parse_args()
+
+    if args:
+        benchmark(args)
+    else:
+        with temporary_dir() as dirname:
+            benchmark(generate_files(dirname, options.num_lines,
+                                     options.seed))
+
+
+if __name__ == "__main__":
+    main()
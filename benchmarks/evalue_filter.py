@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Compares the speed of the different ways of E-value gating: the
+original `gfam.assignment.EValueFilter`, its compiled variant
+(`gfam.assignment.CompiledEValueFilter`) and the batch evaluation of the
+compiled filter on arrays of E-values and source codes.
+
+Usage: python benchmarks/evalue_filter.py [options]
+
+The assignments are generated randomly with the data sources found in a
+typical IPRScan output; roughly one tenth of them have no E-value.
+"""
+
+from common import print_table, timed
+
+import random
+
+from array import array
+from gfam.assignment import Assignment, CompactSequenceWithAssignments, \
+                            EValueFilter
+from optparse import OptionParser
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+#: Data sources used when generating assignments
+SOURCES = ["HMMPfam", "HMMSmart", "HMMPanther", "Gene3D", "superfamily",
+           "ProfileScan", "Coil", "Seg"]
+
+
+def random_assignments(num_assignments, seed):
+    """Generates the given number of random assignments"""
+    rng = random.Random(seed)
+    result = []
+    for _ in xrange(num_assignments):
+        if rng.random() < 0.1:
+            evalue = None
+        else:
+            evalue = 10 ** rng.uniform(-30, 1)
+        source = intern(rng.choice(SOURCES))
+        result.append(Assignment("S1", 500, 1, 100, source, "D1", evalue,
+                                 None, None))
+    return result
+
+
+def gate_original(evalue_filter, assignments):
+    """Counts the acceptable assignments with `EValueFilter.is_acceptable`,
+    the way ``assignment_source_filter`` used to do it."""
+    is_acceptable = evalue_filter.is_acceptable
+    return sum(1 for assignment in assignments
+               if assignment.evalue is None or is_acceptable(assignment))
+
+
+def gate_compiled(compiled, assignments):
+    """Counts the acceptable assignments using the threshold table of a
+    compiled filter, the way ``assignment_source_filter`` does it."""
+    thresholds = compiled.thresholds
+    count = 0
+    for assignment in assignments:
+        evalue = assignment.evalue
+        if evalue is None or evalue <= thresholds[assignment.source]:
+            count += 1
+    return count
+
+
+def gate_many(compiled, evalues, sources):
+    """Counts the acceptable assignments using `filter_many`"""
+    accepted = compiled.filter_many(evalues, sources)
+    if hasattr(accepted, "sum"):
+        return int(accepted.sum())
+    return sum(accepted)
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("-n", "--num-assignments", dest="num_assignments",
+            type=int, default=1000000, metavar="N",
+            help="generate N assignments (default: %default)")
+    parser.add_option("-e", "--e-value", dest="max_e", metavar="THRESHOLD",
+            default="HMMPfam=1e-5;HMMSmart=1e-3;superfamily=1e-10;0.01",
+            help="E-value THRESHOLD description (default: %default)")
+    parser.add_option("--seed", dest="seed", type=int, default=42,
+            help="random seed (default: %default)")
+    options, args = parser.parse_args()
+    if args:
+        parser.error("no positional arguments are expected")
+
+    assignments = random_assignments(options.num_assignments, options.seed)
+    evalue_filter = EValueFilter.FromString(options.max_e)
+    compiled = evalue_filter.compile()
+
+    code = CompactSequenceWithAssignments.string_table.code
+    evalues = array("d", (assignment.evalue if assignment.evalue is not None
+                          else float("nan") for assignment in assignments))
+    sources = array("i", (code(assignment.source)
+                          for assignment in assignments))
+
+    rows, expected = [], None
+    for name, func, args in [
+            ("EValueFilter", gate_original, (evalue_filter, assignments)),
+            ("compiled", gate_compiled, (compiled, assignments)),
+            ("filter_many", gate_many, (compiled, evalues, sources))]:
+        count, elapsed = timed(func, *args)
+        if expected is None:
+            expected = count
+        elif count != expected:
+            raise AssertionError("%s accepted %d assignments instead of %d"
+                                 % (name, count, expected))
+        rows.append([name, count, "%.3f" % elapsed,
+                     "%.1f" % (1e9 * elapsed / len(assignments))])
+    print_table(["method", "accepted", "time (s)", "ns/assignment"], rows)
+
+
+if __name__ == "__main__":
+    main()
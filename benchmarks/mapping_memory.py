@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Compares the memory usage and the lookup speed of `gfam.utils.bidict`
+and `gfam.utils.compactbidict` on a propagated entity-GO term mapping.
+
+Usage: python benchmarks/mapping_memory.py [options]
+
+The mapping is either loaded from a Gene Ontology tree and an InterPro-GO
+mapping file (``--go`` and ``--interpro2go``) and propagated to all the
+ancestor terms just like `OverrepresentationAnalyser` does it, or it is
+generated randomly (the default).
+"""
+
+from common import deep_getsizeof, format_bytes, print_table, timed
+
+import random
+
+from bisect import bisect_left
+from gfam.utils import bidict, compactbidict
+from optparse import OptionParser
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+
+def random_mapping(num_entities, num_terms, avg_degree, seed):
+    """Generates a random mapping from `num_entities` entities to
+    `num_terms` terms where each entity is associated to `avg_degree`
+    terms on average. Term popularities are skewed to mimic the GO."""
+    rng = random.Random(seed)
+    terms = ["GO:%07d" % i for i in xrange(num_terms)]
+    weights = [1.0 / (i+1) for i in xrange(num_terms)]
+    cumulative, total = [], 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    mapping = bidict()
+    for i in xrange(num_entities):
+        entity = "IPR%06d" % i
+        degree = max(1, int(rng.expovariate(1.0 / avg_degree)))
+        mapping.add_left_multi(entity, set(
+            terms[bisect_left(cumulative, rng.random() * total)]
+            for _ in xrange(degree)))
+    return mapping
+
+
+def propagated_mapping(go_file, interpro2go_file):
+    """Loads the given GO tree and InterPro-GO mapping and returns the
+    mapping propagated to all ancestor terms as a `bidict`."""
+    from gfam.go import Tree as GOTree
+    from gfam.interpro import InterPro2GOMapping
+
+    tree = GOTree.from_obo(go_file)
+    mapping = InterPro2GOMapping.from_file(interpro2go_file, tree)
+    result = bidict()
+    for entity, terms in mapping.iteritems_left():
+        result.add_left_multi(entity, tree.ancestors(*terms))
+    return result
+
+
+def lookup_sizes(mapping):
+    """Looks up the number of entities of every term in `mapping`."""
+    right = mapping.right
+    return sum(len(right[term]) for term in right)
+
+
+def count_terms(mapping):
+    """Counts the terms of every entity in `mapping` by iterating over the
+    left rows, the same way `OverrepresentationAnalyser` counts them."""
+    left, total = mapping.left, 0
+    for entity in left:
+        for _ in left.get(entity, []):
+            total += 1
+    return total
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("--go", dest="go_file", metavar="FILE",
+            help="load the Gene Ontology tree from the given OBO FILE")
+    parser.add_option("--interpro2go", dest="interpro2go_file",
+            metavar="FILE", help="load the InterPro-GO mapping from FILE")
+    parser.add_option("-n", "--entities", dest="num_entities", type=int,
+            default=20000, help="number of random entities. "
+                                "Default: %default")
+    parser.add_option("-t", "--terms", dest="num_terms", type=int,
+            default=10000, help="number of random terms. Default: %default")
+    parser.add_option("-k", "--degree", dest="avg_degree", type=float,
+            default=20.0, help="average number of terms per entity. "
+                               "Default: %default")
+    parser.add_option("--seed", dest="seed", type=int, default=42,
+            help="random seed. Default: %default")
+    options, args = parser.parse_args()
+
+    if options.go_file and options.interpro2go_file:
+        mapping = propagated_mapping(options.go_file,
+                                     options.interpro2go_file)
+    elif options.go_file or options.interpro2go_file:
+        parser.error("--go and --interpro2go must be given together")
+    else:
+        mapping = random_mapping(options.num_entities, options.num_terms,
+                                 options.avg_degree, options.seed)
+
+    compact, build_time = timed(compactbidict, mapping)
+    num_pairs = sum(len(terms) for _, terms in mapping.iteritems_left())
+    print "%d entities, %d terms, %d pairs" % (mapping.len_left(),
+            mapping.len_right(), num_pairs)
+    print "compactbidict built in %.3f s" % build_time
+    print
+
+    rows = []
+    for name, obj in (("bidict", mapping), ("compactbidict", compact)):
+        size = deep_getsizeof(obj)
+        _, lookup_time = timed(lookup_sizes, obj)
+        _, count_time = timed(count_terms, obj)
+        rows.append([name, format_bytes(size),
+                     "%.1f" % (size / float(max(num_pairs, 1))),
+                     "%.4f" % lookup_time, "%.4f" % count_time])
+    print_table(["class", "memory", "bytes/pair", "term sizes (s)",
+                 "term counts (s)"], rows)
+
+
+if __name__ == "__main__":
+    main()
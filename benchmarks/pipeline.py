@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""Runs the whole GFam pipeline and each of its steps in isolation on
+synthetic datasets of increasing size, records the running time and the
+peak memory usage of every step and compares them to a baseline.
+
+Usage: python benchmarks/pipeline.py [options]
+
+The datasets are generated by `gfam.synthetic.SyntheticDataset`. By default,
+the pipeline uses the stub ``formatdb`` and ``blastall`` tools in
+``benchmarks/stubs``, so no BLAST installation is needed; the running time
+of ``blast_all`` is meaningless in this case. For each dataset, the whole
+pipeline is run first in a fresh interpreter, then every step is re-run
+alone in a fresh interpreter, so its peak memory usage is not masked by
+the steps before it. The measurements are taken from the run reports of
+the master script and saved as JSON into the results file.
+
+If a baseline (a results file of an earlier run) is given, the running
+time and the peak memory usage of every step are compared to it, and the
+script exits with a non-zero exit code if any of them grew by more than
+the given tolerance. Differences smaller than ``--min-time`` seconds or
+``--min-memory`` MiB are considered noise.
+"""
+
+from __future__ import with_statement
+
+from common import format_bytes, print_table
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+
+from gfam.instrumentation import RunReport
+from gfam.scripts.master import GFamCalculation, GFamMasterScript
+from gfam.synthetic import SyntheticDataset
+from gfam.utils import temporary_dir
+from optparse import OptionParser
+from time import time
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+
+
+class MeasuredMasterScript(GFamMasterScript):
+    """Master script that saves its run report into a given file and can
+    run a single step of the pipeline."""
+
+    __doc__ = GFamMasterScript.__doc__
+
+    def __init__(self, report_file, step=None):
+        super(MeasuredMasterScript, self).__init__()
+        self.report_file = report_file
+        self.step = step
+
+    def start_run_report(self):
+        GFamCalculation.run_report = RunReport(self.report_file,
+                                               " ".join(sys.argv))
+
+    def do_step(self):
+        """Runs the given step of the pipeline only"""
+        self.start_run_report()
+        try:
+            self.modula.run(self.step, force=True)
+        finally:
+            self.finish_run_report()
+
+
+def measure(config_file, report_file, step):
+    """Runs the given step of the pipeline (or the whole pipeline if `step`
+    is ``all``) with the given configuration file in this process and
+    saves the run report into `report_file`."""
+    if step == "all":
+        script = MeasuredMasterScript(report_file)
+        return script.run(["-c", config_file, "run"])
+    script = MeasuredMasterScript(report_file, step)
+    return script.run(["-c", config_file, "step"])
+
+
+def run_measured(config_file, step, log_file):
+    """Runs the given step of the pipeline (or the whole pipeline if `step`
+    is ``all``) in a fresh interpreter and returns the loaded run report
+    and the elapsed wall clock time. The log of the pipeline is appended
+    to `log_file`."""
+    report_file = os.path.join(os.path.dirname(config_file),
+                               "benchmark-%s.json" % step)
+    if os.path.exists(report_file):
+        os.unlink(report_file)
+
+    log = open(log_file, "a")
+    start = time()
+    retcode = subprocess.call([sys.executable, os.path.abspath(__file__),
+                               "--measure", step, "--report", report_file,
+                               config_file], stdout=log, stderr=log)
+    elapsed = time() - start
+    log.close()
+    if retcode:
+        raise RuntimeError("%s failed with exit code %d, see %s" %
+                           (step, retcode, log_file))
+    return RunReport.FromFile(report_file), elapsed
+
+
+def summarize_step(steps):
+    """Summarizes the measurements of the executions of a single step in a
+    run report. The wall clock and CPU times are summed, the peak memory
+    usage is the maximum for the process and its children."""
+    result = dict(wall_time=0.0, cpu_time=0.0, peak_rss=0)
+    for step in steps:
+        result["wall_time"] += step["wall_time"]
+        result["cpu_time"] += step["cpu_time"] + step["children_cpu_time"]
+        result["peak_rss"] = max(result["peak_rss"], step["peak_rss"],
+                                 step["children_peak_rss"] or 0)
+    return result
+
+
+def prepare_dataset(data_dir, num_sequences, seed, blast_dir):
+    """Generates the dataset with the given size in a subfolder of
+    `data_dir` unless it exists already, and returns the name of its
+    configuration file. The work and output folders of the dataset are
+    cleared so the pipeline starts from scratch."""
+    dirname = os.path.join(data_dir, "n%d-seed%d" % (num_sequences, seed))
+    config_file = os.path.join(dirname, "gfam.cfg")
+    if os.path.exists(config_file):
+        print "Reusing dataset in %s" % dirname
+    else:
+        print "Generating %d sequences into %s..." % (num_sequences, dirname)
+        dataset = SyntheticDataset(num_sequences, seed=seed)
+        dataset.generate(dirname, overrides=[("folder.blast", blast_dir)])
+
+    for name in ("work", "output"):
+        if os.path.isdir(os.path.join(dirname, name)):
+            shutil.rmtree(os.path.join(dirname, name))
+    for name in os.listdir(dirname):
+        if name.startswith("benchmark-"):
+            os.unlink(os.path.join(dirname, name))
+    return config_file
+
+
+def benchmark_dataset(config_file, isolated=True):
+    """Runs the pipeline on the dataset with the given configuration file
+    and returns the results."""
+    log_file = os.path.join(os.path.dirname(config_file), "benchmark-log.txt")
+
+    print "Running the whole pipeline..."
+    report, elapsed = run_measured(config_file, "all", log_file)
+    names, steps = [], {}
+    for step in report.steps:
+        if step["name"] not in steps:
+            names.append(step["name"])
+            steps[step["name"]] = []
+        steps[step["name"]].append(step)
+
+    pipeline = summarize_step(report.steps)
+    pipeline.update(wall_time=elapsed, steps={})
+    for name in names:
+        pipeline["steps"][name] = summarize_step(steps[name])
+    result = dict(order=names, pipeline=pipeline, isolated={})
+
+    if isolated:
+        for name in names:
+            print "Running %s alone..." % name
+            report, _ = run_measured(config_file, name, log_file)
+            result["isolated"][name] = summarize_step(report.steps)
+
+    return result
+
+
+def print_results(results):
+    """Prints the results of the benchmark in a table"""
+    rows = []
+    for size in sorted(results["datasets"], key=int):
+        dataset = results["datasets"][size]
+        for name in dataset["order"]:
+            row = [size, name,
+                   "%.2f" % dataset["pipeline"]["steps"][name]["wall_time"]]
+            isolated = dataset["isolated"].get(name)
+            if isolated:
+                row.extend(["%.2f" % isolated["wall_time"],
+                            format_bytes(isolated["peak_rss"])])
+            else:
+                row.extend(["-", "-"])
+            rows.append(row)
+        rows.append([size, "(total)",
+                     "%.2f" % dataset["pipeline"]["wall_time"], "-",
+                     format_bytes(dataset["pipeline"]["peak_rss"])])
+    print_table(["sequences", "step", "pipeline (s)", "alone (s)",
+                 "alone peak RSS"], rows)
+
+
+def compare_results(results, baseline, tolerance, min_time, min_memory):
+    """Compares the results to the baseline, prints the differences and
+    returns the number of regressions."""
+    def compare(size, name, metric, old, new, slack, formatter):
+        if old is None:
+            return 0
+        regression = new > old * (1 + tolerance) and new - old > slack
+        if old:
+            change = "%+.1f%%" % (100.0 * (new - old) / old)
+        else:
+            change = "-"
+        rows.append([size, name, metric, formatter(old), formatter(new),
+                     change, regression and "REGRESSION" or "ok"])
+        return int(regression)
+
+    format_time = lambda value: "%.2f s" % value
+    rows, regressions = [], 0
+    for size in sorted(results["datasets"], key=int):
+        if size not in baseline["datasets"]:
+            continue
+        dataset = results["datasets"][size]
+        old_dataset = baseline["datasets"][size]
+
+        items = [("(total)", dataset["pipeline"],
+                  old_dataset["pipeline"])]
+        for name in dataset["order"]:
+            if name in dataset["isolated"]:
+                items.append((name, dataset["isolated"][name],
+                              old_dataset["isolated"].get(name)))
+
+        for name, new, old in items:
+            if old is None:
+                continue
+            regressions += compare(size, name, "time", old["wall_time"],
+                                   new["wall_time"], min_time, format_time)
+            regressions += compare(size, name, "memory", old["peak_rss"],
+                                   new["peak_rss"], min_memory, format_bytes)
+
+    if not rows:
+        print "The baseline has no datasets in common with this run."
+        return 0
+    print_table(["sequences", "step", "metric", "baseline", "current",
+                 "change", "status"], rows)
+    return regressions
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("-n", "--sizes", dest="sizes",
+            default="10000,100000,1000000", metavar="N1,N2,...",
+            help="comma-separated list of dataset sizes in sequences "
+                 "(default: %default)")
+    parser.add_option("--seed", dest="seed", type=int, default=42,
+            help="random seed of the datasets (default: %default)")
+    parser.add_option("-d", "--data-dir", dest="data_dir", metavar="DIR",
+            help="keep the generated datasets in DIR and reuse the ones "
+                 "already there. A temporary folder is used by default.")
+    parser.add_option("--blast-dir", dest="blast_dir", default=STUBS_DIR,
+            metavar="DIR", help="folder containing formatdb and blastall "
+                 "for newly generated datasets (default: the stubs)")
+    parser.add_option("--no-isolated", dest="isolated", default=True,
+            action="store_false",
+            help="do not run the steps of the pipeline in isolation")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+            default="pipeline-results.json",
+            help="save the results into FILE (default: %default)")
+    parser.add_option("-b", "--baseline", dest="baseline", metavar="FILE",
+            help="compare the results to the results file FILE")
+    parser.add_option("-t", "--tolerance", dest="tolerance", type=float,
+            default=0.2, help="largest allowed relative increase of the "
+                 "time or memory usage of a step (default: %default)")
+    parser.add_option("--min-time", dest="min_time", type=float,
+            default=1.0, metavar="SECONDS",
+            help="ignore time differences smaller than this "
+                 "(default: %default)")
+    parser.add_option("--min-memory", dest="min_memory", type=float,
+            default=16, metavar="MIB",
+            help="ignore memory differences smaller than this "
+                 "(default: %default)")
+    parser.add_option("--measure", dest="measure", metavar="STEP",
+            help="internal use only: run the given step in this process")
+    parser.add_option("--report", dest="report", metavar="FILE",
+            help="internal use only: save the run report into FILE")
+    options, args = parser.parse_args()
+
+    if options.measure:
+        return measure(args[0], options.report, options.measure)
+
+    if args:
+        parser.error("no positional arguments are allowed")
+
+    try:
+        sizes = [int(size) for size in options.sizes.split(",")]
+    except ValueError:
+        parser.error("invalid dataset sizes: %s" % options.sizes)
+
+    baseline = None
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+
+    results = dict(started_at=time(), hostname=platform.node(),
+                   python=platform.python_version(), seed=options.seed,
+                   datasets={})
+
+    def run_all(data_dir):
+        for size in sizes:
+            config_file = prepare_dataset(data_dir, size, options.seed,
+                                          os.path.abspath(options.blast_dir))
+            results["datasets"][str(size)] = \
+                benchmark_dataset(config_file, options.isolated)
+
+    if options.data_dir:
+        run_all(os.path.abspath(options.data_dir))
+    else:
+        with temporary_dir() as data_dir:
+            run_all(data_dir)
+
+    with open(options.output, "w") as fp:
+        json.dump(results, fp, indent=2, sort_keys=True)
+
+    print
+    print_results(results)
+    print
+    print "Results saved to %s." % options.output
+
+    if baseline is not None:
+        print
+        regressions = compare_results(results, baseline, options.tolerance,
+                options.min_time, options.min_memory * 1024 * 1024)
+        if regressions:
+            print
+            print "%d regression(s) found." % regressions
+            return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""Measures how the running time of the core data structures of GFam grows
+with the size of their input.
+
+Usage: python benchmarks/scaling.py [options] [case]...
+
+Every benchmark case is run on inputs of geometrically increasing size and
+a power law ``time = c * n ** slope`` is fitted to the measured times on a
+log-log scale. A slope close to 1 means linear scaling, a slope close to 2
+means quadratic scaling; the latter is worth investigating before it hits
+production-sized inputs. Only the given cases are run if any are given on
+the command line; use ``--list`` to see them.
+"""
+
+from common import print_table
+
+import math
+import random
+import sys
+
+from cStringIO import StringIO
+from gfam.assignment import Assignment, AssignmentOverlapChecker, \
+                            SequenceWithAssignments
+from gfam.fasta import Parser
+from gfam.utils import bidict, complementerset, Histogram, RunningMean, \
+                       UniqueIdGenerator
+from optparse import OptionParser
+from time import time
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+#: Data sources used when generating assignments
+SOURCES = ["HMMPfam", "HMMSmart", "HMMPanther", "Gene3D", "superfamily"]
+
+
+def random_assignments(rng, seq_length, num_assignments, max_length=100):
+    """Generates the given number of random assignments on a sequence with
+    the given length."""
+    result = []
+    for _ in xrange(num_assignments):
+        length = rng.randint(20, max_length)
+        start = rng.randint(1, max(1, seq_length - length))
+        result.append(Assignment("S1", seq_length, start, start + length - 1,
+                                 rng.choice(SOURCES), "D1", None, None,
+                                 None))
+    return result
+
+
+def random_fasta(rng, num_sequences, seq_length):
+    """Generates a FASTA file with the given number of sequences of the given
+    length and returns its contents."""
+    lines = []
+    for i in xrange(num_sequences):
+        seq = "".join([rng.choice("ACDEFGHIKLMNPQRSTVWY")
+                       for _ in xrange(seq_length)])
+        lines.append(">S%07d some description" % i)
+        lines.extend(seq[j:j+60] for j in xrange(0, seq_length, 60))
+    return "\n".join(lines) + "\n"
+
+
+def case_assign(n, rng):
+    """SequenceWithAssignments.assign, n non-overlapping domains on a single
+    sequence"""
+    assignments = [Assignment("S1", 100 * n, 100 * i + 1, 100 * i + 80,
+                              rng.choice(SOURCES), "D1", None, None, None)
+                   for i in xrange(n)]
+    rng.shuffle(assignments)
+
+    def func():
+        seq = SequenceWithAssignments("S1", 100 * n)
+        for assignment in assignments:
+            seq.assign(assignment)
+    return func
+
+
+def case_coverage(n, rng):
+    """SequenceWithAssignments.coverage, sequence of length n with n/100
+    domains"""
+    seq = SequenceWithAssignments("S1", n)
+    for assignment in random_assignments(rng, n, n // 100):
+        seq.assign(assignment, overlap_check=False)
+    return seq.coverage
+
+
+def case_unassigned_regions(n, rng):
+    """SequenceWithAssignments.unassigned_regions, sequence of length n with
+    n/100 domains"""
+    seq = SequenceWithAssignments("S1", n)
+    for assignment in random_assignments(rng, n, n // 100):
+        seq.assign(assignment, overlap_check=False)
+    return lambda: list(seq.unassigned_regions())
+
+
+def case_check_single(n, rng):
+    """AssignmentOverlapChecker.check_single, n pairs of assignments"""
+    assignments = random_assignments(rng, 1000, 2 * n)
+    pairs = zip(assignments[::2], assignments[1::2])
+    check_single = AssignmentOverlapChecker.check_single
+
+    def func():
+        for assignment, other in pairs:
+            check_single(assignment, other)
+    return func
+
+
+def case_bidict(n, rng):
+    """bidict.add_left and lookups, n pairs between n/4 items on each
+    side"""
+    pairs = [("L%d" % rng.randrange(n // 4 + 1),
+              "R%d" % rng.randrange(n // 4 + 1)) for _ in xrange(n)]
+
+    def func():
+        mapping = bidict()
+        for left, right in pairs:
+            mapping.add_left(left, right)
+        for left, right in pairs:
+            mapping.get_left(left)
+            mapping.get_right(right)
+    return func
+
+
+def case_complementerset(n, rng):
+    """complementerset discard, membership, intersection and union with n
+    items"""
+    items = [rng.randrange(2 * n) for _ in xrange(n)]
+    other = set(rng.randrange(2 * n) for _ in xrange(n))
+
+    def func():
+        cset = complementerset()
+        for item in items:
+            cset.discard(item)
+        for item in other:
+            item in cset
+        cset & other
+        cset | other
+    return func
+
+
+def case_unique_id_generator(n, rng):
+    """UniqueIdGenerator lookups, n lookups of n/2 distinct items"""
+    items = ["item%d" % rng.randrange(n // 2 + 1) for _ in xrange(n)]
+
+    def func():
+        generator = UniqueIdGenerator()
+        for item in items:
+            generator[item]
+    return func
+
+
+def case_histogram_add(n, rng):
+    """Histogram.add, n values in random order from a range of size n"""
+    values = [rng.uniform(0, n) for _ in xrange(n)]
+
+    def func():
+        histogram = Histogram()
+        for value in values:
+            histogram.add(value)
+    return func
+
+
+def case_histogram_add_descending(n, rng):
+    """Histogram.add, n values in descending order, each in a new bin"""
+    values = range(n, 0, -1)
+
+    def func():
+        histogram = Histogram()
+        for value in values:
+            histogram.add(value)
+    return func
+
+
+def case_running_mean(n, rng):
+    """RunningMean.add_many, n values"""
+    values = [rng.gauss(0, 1) for _ in xrange(n)]
+    return lambda: RunningMean().add_many(values)
+
+
+def case_fasta_parser(n, rng):
+    """fasta.Parser, n sequences of 300 residues"""
+    data = random_fasta(rng, n, 300)
+    return lambda: list(Parser(StringIO(data)))
+
+
+def case_fasta_long_sequence(n, rng):
+    """fasta.Parser, a single sequence of n residues"""
+    data = random_fasta(rng, 1, n)
+    return lambda: list(Parser(StringIO(data)))
+
+
+#: The benchmark cases: their names, the functions that prepare the input
+#: of size n and return a function to be timed, and the smallest size
+CASES = [
+    ("assign", case_assign, 50),
+    ("coverage", case_coverage, 20000),
+    ("unassigned_regions", case_unassigned_regions, 20000),
+    ("check_single", case_check_single, 10000),
+    ("bidict", case_bidict, 10000),
+    ("complementerset", case_complementerset, 10000),
+    ("unique_id_generator", case_unique_id_generator, 20000),
+    ("histogram_add", case_histogram_add, 10000),
+    ("histogram_add_descending", case_histogram_add_descending, 2000),
+    ("running_mean", case_running_mean, 20000),
+    ("fasta_parser", case_fasta_parser, 500),
+    ("fasta_long_sequence", case_fasta_long_sequence, 100000),
+]
+
+
+def measure(func, repeat, min_time=0.05):
+    """Returns the shortest time in seconds needed to call `func` once, out
+    of `repeat` measurements. Each measurement calls `func` as many times
+    as needed to take at least `min_time` seconds."""
+    number = 1
+    while True:
+        start = time()
+        for _ in xrange(number):
+            func()
+        elapsed = time() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        start = time()
+        for _ in xrange(number):
+            func()
+        best = min(best, time() - start)
+    return best / number
+
+
+def fit_slope(sizes, times):
+    """Fits a line to the given sizes and times on a log-log scale using
+    least squares and returns its slope."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return sxy / sxx
+
+
+def describe_slope(slope):
+    """Returns a rough description of the growth rate with the given
+    slope."""
+    if slope < 0.8:
+        return "sublinear"
+    if slope < 1.3:
+        return "linear"
+    if slope < 1.8:
+        return "superlinear"
+    if slope < 2.5:
+        return "quadratic"
+    return "worse than quadratic"
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("--steps", dest="steps", type=int, default=5,
+            help="number of input sizes per case, each twice as large as "
+                 "the previous one (default: %default)")
+    parser.add_option("--scale", dest="scale", type=float, default=1.0,
+            help="multiply the input sizes by this factor "
+                 "(default: %default)")
+    parser.add_option("-r", "--repeat", dest="repeat", type=int, default=3,
+            help="number of measurements per size; the fastest one is "
+                 "used (default: %default)")
+    parser.add_option("--seed", dest="seed", type=int, default=42,
+            help="random seed (default: %default)")
+    parser.add_option("--max-slope", dest="max_slope", type=float,
+            metavar="SLOPE", help="exit with a non-zero exit code if the "
+                 "slope of any case is larger than SLOPE")
+    parser.add_option("-l", "--list", dest="list", action="store_true",
+            default=False, help="list the benchmark cases and exit")
+    options, args = parser.parse_args()
+
+    if options.steps < 2:
+        parser.error("at least two steps are needed to fit a slope")
+
+    if options.list:
+        print_table(["case", "description"],
+                    [[name, " ".join(func.__doc__.split())]
+                     for name, func, _ in CASES])
+        return
+
+    names = [name for name, _, _ in CASES]
+    for name in args:
+        if name not in names:
+            parser.error("no such benchmark case: %s" % name)
+
+    summary, too_steep = [], []
+    for name, func, base in CASES:
+        if args and name not in args:
+            continue
+
+        rows, sizes, times = [], [], []
+        for step in xrange(options.steps):
+            size = max(1, int(base * options.scale)) * 2 ** step
+            elapsed = measure(func(size, random.Random(options.seed)),
+                              options.repeat)
+            sizes.append(size)
+            times.append(elapsed)
+            rows.append([size, "%.3f" % (elapsed * 1000),
+                         "%.3f" % (elapsed * 1e6 / size)])
+
+        slope = fit_slope(sizes, times)
+        print "%s: %s" % (name, " ".join(func.__doc__.split()))
+        print_table(["n", "time (ms)", "time / n (us)"], rows)
+        print "slope: %.2f (%s)" % (slope, describe_slope(slope))
+        print
+        sys.stdout.flush()
+
+        summary.append([name, "%.2f" % slope, describe_slope(slope)])
+        if options.max_slope is not None and slope > options.max_slope:
+            too_steep.append(name)
+
+    print_table(["case", "slope", "scaling"], summary)
+    if too_steep:
+        print
+        print "Cases scaling worse than n ** %.2f: %s" % \
+              (options.max_slope, ", ".join(too_steep))
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Measures the startup time of the GFam command line entry points.
+
+Usage: python benchmarks/startup.py [options]
+
+Every Python script in the ``bin/`` directory of the source tree is run
+with ``--help`` several times in a fresh interpreter, and the fastest and
+the median wall clock times are reported along with the startup time of
+a bare interpreter. With ``--modules``, the import time of each module in
+``gfam.scripts`` is measured as well; the master script imports all of
+them when it runs the pipeline.
+"""
+
+from common import print_table
+
+import os
+import subprocess
+import sys
+
+from optparse import OptionParser
+from time import time
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def find_entry_points(bin_dir):
+    """Returns the paths of the Python scripts in `bin_dir`, sorted by
+    name. A file is a Python script if its first line mentions Python."""
+    result = []
+    for name in sorted(os.listdir(bin_dir)):
+        path = os.path.join(bin_dir, name)
+        if not os.path.isfile(path):
+            continue
+        first_line = open(path).readline()
+        if first_line.startswith("#!") and "python" in first_line:
+            result.append(path)
+    return result
+
+
+def find_script_modules():
+    """Returns the names of the modules in ``gfam.scripts``."""
+    scripts_dir = os.path.join(ROOT_DIR, "gfam", "scripts")
+    return ["gfam.scripts.%s" % name[:-3] \
+            for name in sorted(os.listdir(scripts_dir)) \
+            if name.endswith(".py") and name != "__init__.py"]
+
+
+def measure(args, repeat, env):
+    """Runs the command given by `args` `repeat` times and returns the
+    list of wall clock times in seconds. Raises `RuntimeError` if the
+    command fails."""
+    times = []
+    devnull = open(os.devnull, "w")
+    try:
+        for _ in xrange(repeat):
+            start = time()
+            retcode = subprocess.call(args, stdout=devnull, stderr=devnull,
+                                      env=env, cwd=ROOT_DIR)
+            times.append(time() - start)
+            if retcode:
+                raise RuntimeError("%s exited with code %d" % \
+                                   (" ".join(args), retcode))
+    finally:
+        devnull.close()
+    return times
+
+
+def median(values):
+    """Returns the median of the given list of values"""
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid-1] + values[mid]) / 2.0
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().split("\n\n")[1])
+    parser.add_option("-n", "--repeat", dest="repeat", type=int, default=5,
+            help="run each command this many times. Default: %default")
+    parser.add_option("-m", "--modules", dest="modules",
+            action="store_true",
+            help="measure the import time of the gfam.scripts modules too")
+    parser.add_option("--python", dest="python", metavar="EXECUTABLE",
+            default=sys.executable,
+            help="use the given Python interpreter. Default: %default")
+    options, args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT_DIR] + filter(None, [env.get("PYTHONPATH")]))
+
+    commands = [("python -c pass", [options.python, "-c", "pass"])]
+    for path in find_entry_points(os.path.join(ROOT_DIR, "bin")):
+        name = os.path.relpath(path, ROOT_DIR)
+        commands.append(("%s --help" % name, [options.python, path, "--help"]))
+    if options.modules:
+        for module in find_script_modules():
+            commands.append(("import %s" % module,
+                             [options.python, "-c", "import %s" % module]))
+
+    rows = []
+    for label, args in commands:
+        try:
+            times = measure(args, options.repeat, env)
+        except RuntimeError, ex:
+            rows.append([label, "failed", str(ex)])
+            continue
+        rows.append([label, "%.3f" % min(times), "%.3f" % median(times)])
+    print_table(["command", "min (s)", "median (s)"], rows)
+
+
+if __name__ == "__main__":
+    main()
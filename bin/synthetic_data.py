@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+from gfam.scripts.synthetic_data import SyntheticDataApp
+import sys
+
+if __name__ == "__main__":
+    sys.exit(SyntheticDataApp().run())
@@ -8,7 +8,8 @@ __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "GPL"
 
 __all__ = ["Assignment", "AssignmentOverlapChecker", "OverlapType",
-           "SequenceWithAssignments", "EValueFilter"]
+           "SequenceWithAssignments", "CompactSequenceWithAssignments",
+           "EValueFilter", "CompiledEValueFilter", "union_lengths"]
 
 try:
     from collections import namedtuple
@@ -16,10 +17,15 @@ except ImportError:
     # For Python 2.5 and older
     from gfam.compat import namedtuple
 
+from array import array
 from gfam.enum import Enum
+from itertools import izip
 
 import operator
 
+#: Placeholder for missing E-values in `CompactSequenceWithAssignments`
+_NAN = float("nan")
+
 # pylint: disable-msg=C0103,E1101
 # C0103: invalid name
 # E1101: instance has no 'foo' member. Pylint does not know namedtuple
@@ -59,12 +65,15 @@ class Assignment(namedtuple("Assignment", \
         an InterPro ID yet, this method tries to look it up.
         
         Returns a new tuple which might or might not be equal to this one.
+        The domain of the returned tuple is always an interned string, so
+        assignments resolved to the same domain share the same string.
         """
         if self.interpro_id:
             anc = interpro.tree.get_most_remote_ancestor(self.interpro_id)
         else:
             anc = interpro.mapping.get(self.domain)
-        if self.domain == anc:
+        anc = intern(anc)
+        if self.domain is anc:
             return self
         return self._replace(domain=anc)
 
@@ -141,29 +150,40 @@ class AssignmentOverlapChecker(object):
           the overlap is larger than the maximum allowed overlap specified
           in `AssignmentOverlapChecker.max_overlap`.
         """
-        start, end = assignment.start, assignment.end
-        other_start, other_end = other_assignment.start, other_assignment.end
+        return cls.check_positions(assignment.start, assignment.end,
+                assignment.source, other_assignment.start,
+                other_assignment.end, other_assignment.source)
 
+    @classmethod
+    def check_positions(cls, start, end, source, other_start, other_end,
+                        other_source):
+        """Same as `check_single`, but the two assignments are given by
+        their starting positions, ending positions and data sources only.
+        This is used by `CompactSequenceWithAssignments`, which does not
+        store `Assignment` instances. Data sources are only compared for
+        equality, so they may be replaced by any other objects (e.g.,
+        integer codes) that preserve equality.
+        """
         if other_start == start and other_end == end:
             # This is a duplicate assignment, so we must skip it
             return OverlapType.DUPLICATE
 
         if other_start <= start and other_end >= end:
-            if other_assignment.source == assignment.source:
+            if other_source == source:
                 # This is a valid domain insertion, assignment is inserted
                 # into other_assignment
                 return OverlapType.INSERTION
             return OverlapType.INSERTION_DIFFERENT
 
         if other_start >= start and other_end <= end:
-            if other_assignment.source == assignment.source:
+            if other_source == source:
                 # This is a valid domain insertion, other_assignment is
                 # inserted into assignment
                 return OverlapType.INSERTION
             return OverlapType.INSERTION_DIFFERENT
 
         if other_start <= start and other_end <= end and other_end >= start:
-            if other_assignment.source == assignment.source:
+            if other_source == source:
                 # This is a partial overlap
                 overlap_size = other_end-start+1
                 if overlap_size > cls.max_overlap:
@@ -172,7 +192,7 @@ class AssignmentOverlapChecker(object):
                 return OverlapType.DIFFERENT
 
         if other_start >= start and other_end >= end and other_start <= end:
-            if other_assignment.source == assignment.source:
+            if other_source == source:
                 # This is a partial overlap
                 overlap_size = end-other_start+1
                 if overlap_size > cls.max_overlap:
@@ -205,6 +225,36 @@ class AssignmentOverlapChecker(object):
 
         return 0
 
+    @classmethod
+    def overlapping_pairs(cls, assignments):
+        """Finds all the pairs of overlapping assignments in the given list
+        of `assignments`. It is assumed (and not checked) that all the
+        assignments refer to the same sequence. Yields triples of the form
+        ``(i, j, size)`` where ``i < j`` are indices into `assignments` and
+        ``size`` is the size of the overlap as returned by
+        `get_overlap_size`.
+
+        The assignments are processed in the order of their starting
+        positions while keeping track of the assignments that are still
+        open, therefore only the pairs that actually overlap are compared.
+        The running time is O(k log k + p) for k assignments and p
+        overlapping pairs instead of O(k^2).
+        """
+        order = sorted(xrange(len(assignments)),
+                       key=lambda idx: assignments[idx].start)
+        active = []
+        for idx in order:
+            start, end = assignments[idx].start, assignments[idx].end
+            active = [other for other in active \
+                      if assignments[other].end >= start]
+            for other in active:
+                size = min(end, assignments[other].end) - start + 1
+                if other < idx:
+                    yield other, idx, size
+                else:
+                    yield idx, other, size
+            active.append(idx)
+
 
 class SequenceWithAssignments(object):
     """Class representing a sequence for which some parts are assigned to
@@ -341,6 +391,259 @@ class SequenceWithAssignments(object):
             yield start, i - 1
 
 
+class _StringTable(object):
+    """Assigns consecutive integer codes to strings and looks up strings
+    by their codes. ``None`` always has code zero.
+    """
+
+    __slots__ = ("codes", "strings")
+
+    def __init__(self):
+        self.codes = {None: 0}
+        self.strings = [None]
+
+    def code(self, value):
+        """Returns the code of the given string, assigning a new code if
+        the string has not been seen before."""
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+            return code
+
+
+class CompactSequenceWithAssignments(SequenceWithAssignments):
+    """Memory-efficient variant of `SequenceWithAssignments` that stores
+    the assignments of the sequence in typed arrays instead of a list of
+    `Assignment` instances.
+
+    Data sources, domain IDs, InterPro IDs and comments are replaced by
+    integer codes pointing into a string table shared by all the instances
+    of the class. The starting and ending positions and the codes of each
+    assignment are stored in six consecutive items of a single integer
+    array (``fields``), the E-values are stored in a double array
+    (``evalues``, ``NaN`` standing for ``None``). Most sequences have only
+    a handful of assignments, so two arrays per sequence are considerably
+    cheaper than one array per field. The columns are available as the
+    ``starts``, ``ends``, ``sources``, ``domains``, ``interpro_ids`` and
+    ``comments`` properties; each of them returns a new array.
+
+    `assign`, `coverage`, `domain_architecture`, `unassigned_regions` and
+    the other query methods work directly on the arrays. The
+    ``assignments`` property still returns a list of `Assignment` instances,
+    but these are constructed on the fly, so modifying the list does not
+    modify the sequence; assign a new list to ``assignments`` instead.
+    """
+
+    __slots__ = ("fields", "evalues")
+
+    #: Number of items in ``fields`` per assignment
+    num_fields = 6
+
+    #: String table used to encode the string fields of the assignments
+    string_table = _StringTable()
+
+    def __init__(self, name, length):
+        # pylint: disable-msg=W0231
+        # W0231: __init__ method from base class is not called
+        self.name = name
+        self.length = length
+        self._clear()
+
+    def _append(self, start, end, source, domain, evalue, interpro_id,
+                comment):
+        """Appends a new assignment to the arrays without any checks."""
+        code = self.string_table.code
+        self.fields.extend((start, end, code(source), code(domain),
+                            code(interpro_id), code(comment)))
+        if evalue is None:
+            evalue = _NAN
+        self.evalues.append(evalue)
+
+    def _clear(self):
+        """Removes all the assignments of the sequence."""
+        self.fields, self.evalues = array("i"), array("d")
+
+    def _column(index):
+        """Creates a read-only property that returns the given column of
+        ``fields`` as a new array."""
+        def getter(self):
+            return self.fields[index::self.num_fields]
+        return property(getter)
+
+    starts, ends = _column(0), _column(1)
+    sources, domains = _column(2), _column(3)
+    interpro_ids, comments = _column(4), _column(5)
+    del _column
+
+    def _accepted_sources(self, sources):
+        """Returns the set of source codes of this sequence that correspond
+        to one of the given `sources`. `sources` may be a single source
+        name or any object that supports membership tests."""
+        if isinstance(sources, basestring):
+            sources = [sources]
+        strings = self.string_table.strings
+        return set(code for code in set(self.sources)
+                   if strings[code] in sources)
+
+    def _covered_blocks(self):
+        """Returns the sorted list of maximal blocks of positions between
+        1 and the length of the sequence that are covered by at least one
+        assignment. Each block is a tuple containing its starting and ending
+        position (both inclusive)."""
+        length = self.length
+        intervals = sorted((max(start, 1), min(end, length))
+                           for start, end in izip(self.starts, self.ends))
+        blocks = []
+        for start, end in intervals:
+            if start > end:
+                continue
+            if blocks and start <= blocks[-1][1] + 1:
+                if end > blocks[-1][1]:
+                    blocks[-1] = (blocks[-1][0], end)
+            else:
+                blocks.append((start, end))
+        return blocks
+
+    def _get_assignments(self):
+        strings = self.string_table.strings
+        name, length = self.name, self.length
+        return [Assignment(name, length, start, end, strings[source],
+                           strings[domain],
+                           None if evalue != evalue else evalue,
+                           strings[interpro_id], strings[comment])
+                for start, end, source, domain, interpro_id, comment, evalue
+                in izip(self.starts, self.ends, self.sources, self.domains,
+                        self.interpro_ids, self.comments, self.evalues)]
+
+    def _set_assignments(self, assignments):
+        self._clear()
+        for assignment in assignments:
+            self._append(*assignment[2:])
+
+    assignments = property(_get_assignments, _set_assignments,
+            doc="""The assignments of the sequence as a list of `Assignment`
+            instances""")
+
+    def __len__(self):
+        return self.length
+
+    def assign(self, assignment, overlap_check=True):
+        """Assigns a fragment of this sequence using the given assignment.
+        If `overlap_check` is ``False``, we will not check for overlaps or
+        conflicts with existing assignments.
+
+        Returns ``True`` if the assignment was added, ``False`` if it
+        wasn't due to an overlap conflict.
+        """
+        domain = assignment.domain
+        if ":SF" in domain:
+            # Remove subfamily info from domain
+            domain = domain[0:domain.index(":SF")]
+
+        start, end = assignment.start, assignment.end
+        if overlap_check:
+            source = self.string_table.code(assignment.source)
+            check = self.overlap_checker.check_positions
+            overlap_state = OverlapType.NO_OVERLAP
+            for other_start, other_end, other_source in \
+                    izip(self.starts, self.ends, self.sources):
+                overlap_state = check(start, end, source,
+                                      other_start, other_end, other_source)
+                if overlap_state != OverlapType.NO_OVERLAP:
+                    break
+            if overlap_state not in self.acceptable_overlaps:
+                return False
+
+        self._append(start, end, assignment.source, domain,
+                     assignment.evalue, assignment.interpro_id,
+                     assignment.comment)
+        return True
+
+    def coverage(self, sources=None):
+        """Returns the coverage of the sequence, i.e. the fraction of residues
+        covered by at least one assignment.
+        
+        `sources` specifies the data sources to be included in the coverage
+        calculation. If `None`, all the data sources will be considered; otherwise
+        it must be a set containing the accepted sources."""
+        if sources is None:
+            intervals = zip(self.starts, self.ends)
+        else:
+            codes = self._accepted_sources(sources)
+            intervals = [(start, end) for start, end, source
+                         in izip(self.starts, self.ends, self.sources)
+                         if source in codes]
+        return _union_length(intervals) / float(self.length)
+
+    def data_sources(self):
+        """Returns the list of data sources that were used in this assignment."""
+        strings = self.string_table.strings
+        return sorted(strings[source] for source in set(self.sources))
+
+    def domain_architecture(self, sources=None):
+        """Returns the domain architecture of the assignment.
+
+        The domain architecture is a list which contains the IDs of the assigned
+        regions (domains) in ascending order of their starting positions. If
+        `sources` is ``None``, all data sources will be considered; otherwise it
+        must be a set or iterable which specifies the data sources to be
+        included in the result.
+        """
+        strings, domains = self.string_table.strings, self.domains
+        order = sorted(xrange(len(self.starts)), key=self.starts.__getitem__)
+        if sources is None:
+            return [strings[domains[i]] for i in order]
+        codes, all_sources = self._accepted_sources(sources), self.sources
+        return [strings[domains[i]] for i in order if all_sources[i] in codes]
+
+    def is_completely_unassigned(self, start, end):
+        """Checks whether the given region is completely unassigned.
+        start and end positions are both inclusive"""
+        for other_start, other_end in izip(self.starts, self.ends):
+            if other_end >= start and other_start <= end:
+                return False
+        return True
+
+    def resolve_interpro_ids(self, interpro):
+        """Replaces the domain IDs of the assignments of this sequence with
+        the most remote InterPro ancestors, just like
+        `Assignment.resolve_interpro_ids` does."""
+        strings, code = self.string_table.strings, self.string_table.code
+        fields, resolved = self.fields, {}
+        for i in xrange(3, len(fields), self.num_fields):
+            key = fields[i+1], fields[i]
+            if key not in resolved:
+                if key[0]:
+                    anc = interpro.tree.get_most_remote_ancestor(strings[key[0]])
+                else:
+                    anc = interpro.mapping.get(strings[key[1]])
+                resolved[key] = code(anc)
+            fields[i] = resolved[key]
+
+    def unassigned_regions(self):
+        """Returns a generator that iterates over the unassigned regions
+        of the sequence. Each entry yielded by the generator is a tuple
+        containing the start and end positions"""
+        # This follows SequenceWithAssignments.unassigned_regions() step by
+        # step, but jumps over whole blocks instead of single residues
+        length, blocks = self.length, self._covered_blocks()
+        i, next_block = 1, 0
+        while i <= length:
+            if next_block < len(blocks) and blocks[next_block][0] == i:
+                i = blocks[next_block][1] + 1
+                next_block += 1
+            start = i
+            if start == length:
+                break
+            if next_block < len(blocks):
+                i = blocks[next_block][0]
+            else:
+                i = length + 1
+            yield start, i - 1
+
+
 class EValueFilter(object):
     """Given an `Assignment`, this filter tells whether the assignment's
     E-value is satisfactory to accept it.
@@ -367,6 +670,12 @@ class EValueFilter(object):
         threshold = self.thresholds.get(assignment.source, self.default_e_value)
         return assignment.evalue <= threshold
 
+    def compile(self, string_table=None):
+        """Returns a `CompiledEValueFilter` that is equivalent to this filter
+        but faster to evaluate. Changes made to this filter afterwards are
+        not reflected in the compiled filter."""
+        return CompiledEValueFilter(self, string_table)
+
     @classmethod
     def FromString(cls, description):
         """Constructs an E-value filter from a string description that
@@ -395,3 +704,197 @@ class EValueFilter(object):
                 result.default_e_value = float(part)
         return result
 
+
+class _ThresholdTable(dict):
+    """Dict mapping data sources to E-value thresholds. Sources that are
+    not in the dict yet are resolved using the given function and the
+    result is stored, so each source is resolved only once."""
+
+    __slots__ = ("resolver", )
+
+    def __init__(self, resolver):
+        dict.__init__(self)
+        self.resolver = resolver
+
+    def __missing__(self, key):
+        value = self[key] = self.resolver(key)
+        return value
+
+
+class CompiledEValueFilter(object):
+    """Faster, read-only variant of `EValueFilter`, constructed by
+    `EValueFilter.compile`.
+
+    The threshold of each data source is resolved only once; later lookups
+    are plain dict lookups without any fallback to the default threshold.
+    The ``thresholds`` attribute can be indexed directly by data source
+    names in tight loops::
+
+        >>> evalue_filter = EValueFilter.FromString("HMMPfam=0.001;0.1")
+        >>> compiled = evalue_filter.compile()
+        >>> compiled.thresholds["HMMPfam"], compiled.thresholds["HMMSmart"]
+        (0.001, 0.1)
+
+    `filter_many` evaluates the filter on arrays of E-values and source
+    codes at once, where the source codes refer to the given string table
+    (the string table of `CompactSequenceWithAssignments` by default).
+    """
+
+    def __init__(self, evalue_filter, string_table=None):
+        self.default_e_value = evalue_filter.default_e_value
+        self.thresholds = _ThresholdTable(self._resolve)
+        self.thresholds.update(evalue_filter.thresholds)
+        if string_table is None:
+            string_table = CompactSequenceWithAssignments.string_table
+        self.string_table = string_table
+        self._code_thresholds = array("d")
+        self._code_thresholds_numpy = None
+
+    def _resolve(self, source):
+        """Returns the default threshold; used for sources without an
+        explicit threshold"""
+        # pylint: disable-msg=W0613
+        # W0613: unused argument
+        return self.default_e_value
+
+    def _get_code_thresholds(self):
+        """Returns the thresholds indexed by source codes, extending them
+        first if new strings were added to the string table."""
+        strings, thresholds = self.string_table.strings, self._code_thresholds
+        if len(thresholds) < len(strings):
+            thresholds.extend(self.thresholds[strings[code]]
+                              for code in xrange(len(thresholds), len(strings)))
+            self._code_thresholds_numpy = None
+        return thresholds
+
+    def is_acceptable(self, assignment):
+        """Checks whether the given assignment is acceptable; see
+        `EValueFilter.is_acceptable`."""
+        return assignment.evalue <= self.thresholds[assignment.source]
+
+    def filter_many(self, evalues, sources):
+        """Evaluates the filter on many assignments at once.
+
+        `evalues` and `sources` must be sequences of the same length;
+        `evalues` contains the E-values of the assignments (``NaN`` standing
+        for a missing E-value) and `sources` contains the codes of their
+        data sources in the string table of the filter. Returns a sequence
+        of booleans (a NumPy array if NumPy is available) that tells for
+        each assignment whether it is acceptable. Assignments without an
+        E-value are always acceptable.
+
+        Example::
+
+            >>> table = CompactSequenceWithAssignments.string_table
+            >>> compiled = EValueFilter.FromString("HMMPfam=0.001").compile()
+            >>> codes = [table.code("HMMPfam"), table.code("HMMSmart")] * 2
+            >>> evalues = [0.01, 0.01, 0.0001, float("nan")]
+            >>> [bool(x) for x in compiled.filter_many(evalues, codes)]
+            [False, True, True, True]
+        """
+        thresholds = self._get_code_thresholds()
+
+        try:
+            import numpy
+        except ImportError:
+            return [not evalue > thresholds[source]
+                    for evalue, source in izip(evalues, sources)]
+
+        def as_numpy_array(values):
+            # array.array does not support the new buffer protocol in
+            # Python 2, so numpy.asarray() would convert it item by item
+            if isinstance(values, array):
+                return numpy.frombuffer(values, dtype=values.typecode)
+            return numpy.asarray(values)
+
+        if self._code_thresholds_numpy is None:
+            self._code_thresholds_numpy = as_numpy_array(thresholds).copy()
+        evalues = as_numpy_array(evalues)
+        sources = as_numpy_array(sources)
+        errstate = numpy.seterr(invalid="ignore")
+        try:
+            return ~(evalues > self._code_thresholds_numpy[sources])
+        finally:
+            numpy.seterr(**errstate)
+
+
+
+def _union_length(intervals):
+    """Returns the number of positions covered by at least one of the given
+    ``(start, end)`` intervals (both ends inclusive). The list of intervals
+    is sorted in place.
+
+    Example::
+
+        >>> _union_length([(5, 12), (1, 10), (20, 20)])
+        13
+    """
+    intervals.sort()
+    total, covered_until = 0, None
+    for start, end in intervals:
+        if covered_until is None or covered_until < start - 1:
+            covered_until = start - 1
+        if end > covered_until:
+            total += end - covered_until
+            covered_until = end
+    return total
+
+
+def union_lengths(groups, starts, ends, num_groups):
+    """Calculates the total length of the union of intervals in each group
+    of intervals.
+
+    `groups`, `starts` and `ends` must be sequences of the same length; the
+    ``i``th interval spans the positions from ``starts[i]`` to ``ends[i]``
+    (both inclusive) and it belongs to the group with index ``groups[i]``.
+    Group indices must be between zero and `num_groups` - 1. Returns a
+    list of length `num_groups` that contains the number of positions
+    covered by at least one interval for each group.
+
+    When NumPy is available, all the groups are processed in a single
+    pass: the intervals of different groups are moved apart by adding a
+    group-dependent offset to their positions, the intervals are sorted by
+    their starting positions, and each interval contributes the part that
+    extends beyond the cumulative maximum of the preceding ending
+    positions.
+
+    Example::
+
+        >>> union_lengths([0, 0, 1, 0, 1], [1, 5, 3, 20, 10], \\
+        ...               [10, 12, 5, 20, 9], 3)
+        [13, 3, 0]
+    """
+    if not len(groups):
+        return [0] * num_groups
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is None:
+        intervals = [[] for _ in xrange(num_groups)]
+        for group, start, end in zip(groups, starts, ends):
+            intervals[group].append((start, end))
+        return [_union_length(group_intervals)
+                for group_intervals in intervals]
+
+    groups = numpy.asarray(groups, dtype=numpy.int64)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+
+    lowest = min(starts.min(), ends.min())
+    span = max(starts.max(), ends.max()) - lowest + 2
+    starts = starts - lowest + groups * span
+    ends = ends - lowest + groups * span
+
+    order = numpy.argsort(starts, kind="mergesort")
+    groups, starts, ends = groups[order], starts[order], ends[order]
+    covered_until = numpy.maximum.accumulate(ends)
+    covered_until = numpy.concatenate(([starts[0] - 1], covered_until[:-1]))
+    new_positions = ends - numpy.maximum(starts - 1, covered_until)
+    new_positions = numpy.maximum(new_positions, 0)
+
+    result = numpy.bincount(groups, weights=new_positions,
+                            minlength=num_groups)
+    return [int(value) for value in result.round()]
@@ -0,0 +1,281 @@
+"""Routines for writing and reading block-compressed gzip files.
+
+Block-compressed gzip files (BGZF_) consist of a series of independent
+gzip members, each of them holding at most 64 KiB of uncompressed data,
+followed by an empty member that marks the end of the file. Such files are
+valid gzip files, so they can be read by `gfam.utils.open_anything` or any
+other gzip reader, but since the members are independent, one can also
+start decompressing the file at any member boundary. The positions of the
+member boundaries are stored in a separate block index file (with ``.gzi``
+extension) in the same format as the one used by ``bgzip`` from htslib.
+
+`BlockGzipWriter` also makes sure that each block ends at a line boundary
+unless a single line is longer than the block size. Therefore, a file can
+be split into chunks of complete lines at block boundaries using
+`split_blocks`, and the chunks can be decompressed and processed in parallel
+using `read_blocks`.
+
+.. _BGZF: http://samtools.github.io/hts-specs/SAMv1.pdf
+"""
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+__all__ = ["BlockGzipWriter", "index_filename", "read_block_index",
+           "read_blocks", "split_blocks", "uncompressed_size"]
+
+import os
+import struct
+import zlib
+
+#: Header of a BGZF block; the last field is the total block size minus 1
+_BLOCK_HEADER = struct.Struct("<4BI2BH2BHH")
+
+#: Footer of a BGZF block: CRC32 and the size of the uncompressed data
+_BLOCK_FOOTER = struct.Struct("<II")
+
+#: The empty block that marks the end of a BGZF file
+_EOF_BLOCK = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43" \
+             "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+#: The maximum size of a BGZF block, including the header and the footer
+_MAX_BLOCK_SIZE = 65536
+
+
+def index_filename(fname):
+    """Returns the name of the block index file corresponding to the
+    block-compressed gzip file with the given name."""
+    return fname + ".gzi"
+
+
+class BlockGzipWriter(object):
+    """Write-only file-like object that writes a block-compressed gzip file
+    and the corresponding block index.
+
+    Usage example::
+
+        writer = BlockGzipWriter("results.txt.gz")
+        print >>writer, "some text"
+        writer.close()
+    """
+
+    def __init__(self, fname, compresslevel=6, block_size=65280,
+                 index=True):
+        """Opens the given file for writing.
+
+        `compresslevel` is passed on to ``zlib``. `block_size` is the
+        maximum number of uncompressed bytes in a block; it must not be
+        larger than 65536. If `index` is ``True``, the block index is written
+        to the file returned by `index_filename` when the writer is closed.
+        """
+        if block_size < 1 or block_size > 65536:
+            raise ValueError("block size must be between 1 and 65536")
+
+        self.name = fname
+        self.mode = "wb"
+        self.closed = False
+        self.softspace = 0
+
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.index = index
+
+        self._fp = open(fname, "wb")
+        self._buffer, self._buffered_bytes = [], 0
+        self._compressed_offset, self._uncompressed_offset = 0, 0
+        self._offsets = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _compress_block(self, data):
+        """Compresses the given data into one or more BGZF blocks, writes
+        them into the file and records their offsets."""
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = _BLOCK_HEADER.size + len(compressed) + \
+                     _BLOCK_FOOTER.size
+        if block_size > _MAX_BLOCK_SIZE:
+            # Incompressible data; split it in halves
+            half = len(data) // 2
+            self._compress_block(data[:half])
+            self._compress_block(data[half:])
+            return
+
+        self._offsets.append((self._compressed_offset,
+                              self._uncompressed_offset))
+        self._fp.write(_BLOCK_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6,
+                                          66, 67, 2, block_size - 1))
+        self._fp.write(compressed)
+        self._fp.write(_BLOCK_FOOTER.pack(zlib.crc32(data) & 0xffffffff,
+                                          len(data)))
+        self._compressed_offset += block_size
+        self._uncompressed_offset += len(data)
+
+    def _write_blocks(self, final=False):
+        """Writes the buffered data into blocks that end at line boundaries
+        where possible. If `final` is ``False``, the data after the last
+        block boundary remains in the buffer."""
+        data = "".join(self._buffer)
+        start = 0
+        while len(data) - start >= self.block_size:
+            end = data.rfind("\n", start, start + self.block_size) + 1
+            if end <= start:
+                end = start + self.block_size
+            self._compress_block(data[start:end])
+            start = end
+        if final and start < len(data):
+            self._compress_block(data[start:])
+            start = len(data)
+        data = data[start:]
+        self._buffer, self._buffered_bytes = [data], len(data)
+
+    def close(self):
+        """Writes the remaining data, the end-of-file marker and the block
+        index, and closes the file."""
+        if self.closed:
+            return
+        self._write_blocks(final=True)
+        self._fp.write(_EOF_BLOCK)
+        self._fp.close()
+        self.closed = True
+
+        if self.index:
+            # The first block always starts at zero; bgzip omits it
+            offsets = self._offsets[1:]
+            index_file = open(index_filename(self.name), "wb")
+            index_file.write(struct.pack("<Q", len(offsets)))
+            for offset in offsets:
+                index_file.write(struct.pack("<QQ", *offset))
+            index_file.close()
+
+    def flush(self):
+        """Writes all the complete blocks into the file and flushes it."""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._write_blocks()
+        self._fp.flush()
+
+    def write(self, data):
+        """Writes the given string to the file."""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        if self._buffered_bytes >= self.block_size:
+            self._write_blocks()
+
+    def writelines(self, lines):
+        """Writes the given strings to the file."""
+        for line in lines:
+            self.write(line)
+
+
+def read_block_index(fname):
+    """Reads the block index of the given block-compressed gzip file.
+
+    Returns a list of pairs, one for each block; the first element of each
+    pair is the offset of the block in the compressed file, the second is
+    the offset of the data of the block in the uncompressed data. The first
+    pair is always ``(0, 0)``.
+    """
+    index_file = open(index_filename(fname), "rb")
+    try:
+        data = index_file.read()
+    finally:
+        index_file.close()
+
+    num_blocks = struct.unpack("<Q", data[:8])[0]
+    offsets = struct.unpack("<%dQ" % (2 * num_blocks), data[8:])
+    result = [(0, 0)]
+    result.extend(zip(offsets[::2], offsets[1::2]))
+    return result
+
+
+def read_blocks(fname, start=0, end=None):
+    """Reads and decompresses the blocks of the given block-compressed gzip
+    file starting at the compressed offset `start` and ending before the
+    compressed offset `end` (or at the end of the file if `end` is
+    ``None``). Both offsets must be block boundaries. Returns the
+    decompressed data as a string."""
+    infile = open(fname, "rb")
+    try:
+        infile.seek(start)
+        if end is None:
+            data = infile.read()
+        else:
+            data = infile.read(end - start)
+    finally:
+        infile.close()
+
+    result = []
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return "".join(result)
+
+
+def split_blocks(fname, num_chunks):
+    """Splits the given block-compressed gzip file into at most `num_chunks`
+    chunks at block boundaries such that the chunks contain roughly the same
+    amount of uncompressed data.
+
+    Returns a list of ``(start, end)`` pairs of compressed offsets that can
+    be passed on to `read_blocks`; `end` is ``None`` for the last chunk.
+    If the file was written by `BlockGzipWriter`, each chunk contains
+    complete lines only, unless the file has lines longer than the block
+    size.
+    """
+    offsets = read_block_index(fname)
+    total_size = os.path.getsize(fname)
+    num_chunks = max(1, min(num_chunks, len(offsets)))
+
+    # Estimate the uncompressed size from the offset of the last block;
+    # this is good enough for balancing the chunks
+    uncompressed_size = max(offsets[-1][1], 1)
+    result, start_index = [], 0
+    for i in xrange(1, num_chunks):
+        target = uncompressed_size * i / float(num_chunks)
+        end_index = start_index + 1
+        while end_index < len(offsets) and offsets[end_index][1] < target:
+            end_index += 1
+        if end_index >= len(offsets):
+            break
+        result.append((offsets[start_index][0], offsets[end_index][0]))
+        start_index = end_index
+    result.append((offsets[start_index][0], None))
+
+    # Guard against a stale index that points beyond the end of the file
+    if result[-1][0] >= total_size:
+        raise ValueError("block index of %s does not match the file" % fname)
+    return result
+
+
+def uncompressed_size(fname):
+    """Returns the size of the uncompressed data in the given
+    block-compressed gzip file, using the block index and the footer of the
+    last block only. Returns ``None`` if the file has no block index."""
+    if not os.path.exists(index_filename(fname)):
+        return None
+
+    offsets = read_block_index(fname)
+    total_size = os.path.getsize(fname)
+    if total_size <= len(_EOF_BLOCK):
+        return 0
+
+    # The last four bytes of the last data block contain the size of its
+    # uncompressed data
+    infile = open(fname, "rb")
+    try:
+        infile.seek(total_size - len(_EOF_BLOCK) - 4)
+        last_block_size = struct.unpack("<I", infile.read(4))[0]
+    finally:
+        infile.close()
+    return offsets[-1][1] + last_block_size
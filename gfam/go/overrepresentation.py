@@ -7,16 +7,22 @@ __email__   = "tamas@cs.rhul.ac.uk"
 __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "MIT"
 
-__all__ = ["OverrepresentationAnalyser"]
+__all__ = ["HypergeometricTail", "OverrepresentationAnalyser"]
 
 from collections import defaultdict
-from gfam.utils import bidict
+from gfam.utils import compactbidict, LRUCache
 from math import exp, log
 from operator import itemgetter
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     from scipy.special import gammaln
 except ImportError:
+    gammaln_many = None
     def gammaln(n):
         """Logarithm of Euler's gamma function for discrete values."""
         if n < 1:
@@ -34,7 +40,9 @@ except ImportError:
             y += 1.0
             se += c[j] / y
         return -tm + log(2.5066282746310005 * se / x)
-        
+else:
+    gammaln_many = gammaln
+
 def logchoose(n, k):
     """Calculates the logarithm of n-choose-k"""
     lgn1 = gammaln(n+1)
@@ -61,19 +69,135 @@ def hypergeom_sf(k, M, n, N):
         result += a
     return result
 
+def log_factorial_table(n):
+    """Returns a table of the logarithms of the factorials of all the integers
+    from zero to `n` (inclusive). The result is a NumPy array if NumPy is
+    available, a list otherwise. The values are calculated with `gammaln`,
+    so they are identical to the ones used by `logchoose`."""
+    if numpy is None:
+        return [gammaln(k+1) for k in xrange(n+1)]
+    if gammaln_many is None:
+        return numpy.array([gammaln(k+1) for k in xrange(n+1)], dtype=float)
+    return gammaln_many(numpy.arange(1, n+2, dtype=float))
+
+class HypergeometricTail(object):
+    """Calculates the tails of hypergeometric distributions with a fixed
+    population size in batches.
+
+    This class is the workhorse of the overrepresentation analysis. It is
+    equivalent to calling `hypergeom_sf` for each term separately, but it
+    precomputes a table of log-factorials for the whole population, so
+    no logarithms of the gamma function have to be evaluated later. When
+    NumPy is available, `sf_many` calculates the tails of many distributions
+    in a single vectorised pass.
+
+    Usage example::
+
+        >>> tail = HypergeometricTail(100)
+        >>> abs(tail.sf(2, 10, 5) - hypergeom_sf(2, 100, 10, 5)) < 1e-12
+        True
+    """
+
+    #: Maximum number of cells in the temporary matrices used by `sf_many`.
+    #: Larger batches are split into chunks of at most this size.
+    max_chunk_size = 1048576
+
+    def __init__(self, population_size):
+        """Creates a calculator for hypergeometric distributions where the
+        total number of objects is given by `population_size`."""
+        self.population_size = int(population_size)
+        self._logfact = log_factorial_table(self.population_size)
+
+    def sf(self, k, n, N):
+        """Returns the probability of drawing at least `k` good objects
+        when `N` objects are drawn out of the population and the population
+        contains `n` good objects."""
+        lf, M = self._logfact, self.population_size
+        bad = M - n
+        if N > M:
+            return 0.
+        den = lf[M] - (lf[M-N] + lf[N])
+        result = 0.
+        for x in xrange(max(k, N-bad, 0), min(n, N)+1):
+            result += exp((lf[n] - (lf[n-x] + lf[x])) + \
+                          (lf[bad] - (lf[bad-N+x] + lf[N-x])) - den)
+        return result
+
+    def sf_many(self, ks, ns, Ns):
+        """Vectorised variant of `sf`. `ks` and `ns` must be sequences of
+        equal length, `Ns` may be a single group size or a sequence of group
+        sizes with the same length as `ks`. Returns a list of tail
+        probabilities (or a NumPy array if NumPy is available)."""
+        if numpy is None:
+            if not hasattr(Ns, "__iter__"):
+                Ns = [Ns] * len(ks)
+            return [self.sf(k, n, N) for k, n, N in zip(ks, ns, Ns)]
+
+        ks = numpy.asarray(ks, dtype=int)
+        ns = numpy.asarray(ns, dtype=int)
+        Ns = numpy.asarray(Ns, dtype=int) + numpy.zeros_like(ks)
+        result = numpy.zeros(len(ks), dtype=float)
+        if len(ks) == 0:
+            return result
+
+        # Each row of the matrices below corresponds to a term, each column
+        # to an offset in the tail of its distribution
+        widths = numpy.maximum(Ns - ks + 1, 0)
+        width = max(int(widths.max()), 1)
+        chunk = max(self.max_chunk_size // width, 1)
+        for start in xrange(0, len(ks), chunk):
+            end = start + chunk
+            result[start:end] = self._sf_chunk(ks[start:end], ns[start:end],
+                                               Ns[start:end], width)
+        return result
+
+    def _sf_chunk(self, ks, ns, Ns, width):
+        """Calculates the tails for a chunk of `sf_many` where the longest
+        tail has at most `width` terms."""
+        lf, M = self._logfact, self.population_size
+        ns, Ns = ns[:, None], Ns[:, None]
+        bads = M - ns
+        xs = ks[:, None] + numpy.arange(width)[None, :]
+        valid = (xs <= Ns) & (xs <= ns) & (xs >= Ns - bads) & (xs >= 0) & \
+                (Ns <= M)
+
+        def masked(indices):
+            """Replaces the invalid indices in the log-factorial table with
+            zeros to avoid out-of-bounds indexing."""
+            return numpy.where(valid, indices, 0)
+
+        # The order of operations mirrors `hypergeom_sf` to ensure that
+        # the results are the same up to rounding errors in the summation
+        Ns = numpy.minimum(Ns, M)
+        den = lf[M] - (lf[M - Ns] + lf[Ns])
+        logp = (lf[ns] - (lf[masked(ns - xs)] + lf[masked(xs)])) + \
+               (lf[bads] - (lf[masked(bads - Ns + xs)] +
+                            lf[masked(Ns - xs)])) - den
+        logp[~valid] = -numpy.inf
+        probs = numpy.exp(logp)
+
+        # Sum the columns one by one instead of calling probs.sum(axis=1);
+        # this makes the result independent of the width of the chunk, so
+        # the same tail is always calculated to exactly the same value
+        result = numpy.zeros(len(probs), dtype=float)
+        for column in probs.T:
+            result += column
+        return result
+
 class OverrepresentationAnalyser(object):
     """Performs overrepresentation analysis of Gene Ontology
     terms on sets of entities that are annotated by some
     GO terms."""
 
     def __init__(self, tree, mapping, confidence=0.05, min_count=5, \
-            correction="fdr"):
+            correction="fdr", cache_size=65536):
         """Initializes the overrepresentation analysis algorithm by associating
         it to a given Gene Ontology tree and a given mapping from entities to
         their respective GO terms.
 
         `tree` must be an instance of `gfam.go.Tree`. `mapping` must be
-        a bidirectional dictionary object (`gfam.utils.bidict`) that
+        a bidirectional dictionary object (`gfam.utils.bidict` or
+        `gfam.utils.compactbidict`) that
         maps entities to GO terms and vice versa. For `mapping`, if an entity
         is annotated by a GO term, it is not necessary to list all the
         ancestors of that GO term for that entity, this will be taken care of
@@ -98,23 +222,34 @@ class OverrepresentationAnalyser(object):
           error rate
 
         - ``"sidak"``: Sidak correction of the family-wise error rate
+
+        `cache_size` is the maximum number of p-values kept in
+        `p_value_cache`. The p-value of a term depends only on its count in
+        the group, the number of entities annotated by the term and the size
+        of the group, so the same p-values are requested over and over again
+        when many groups are tested with the same analyser.
         """
         self.tree = tree
         self.mapping = self._propagate_go_term_ancestors(mapping)
         self.confidence = float(confidence)
         self.min_count = max(1, int(min_count))
         self.correction = correction
+        self.tail = HypergeometricTail(self.mapping.len_left())
+        self.p_value_cache = LRUCache(cache_size)
 
     def _propagate_go_term_ancestors(self, mapping):
         """Given a mapping object which maps entities to GO terms, this
         method ensures that all the ancestor terms of each GO term
         appear at the respective entities. Returns a copy of the mapping
-        which contains these modifications."""
-        result = bidict(mapping)
-        for entity, terms in result.iteritems_left():
-            ancestors = self.tree.ancestors(*terms)
-            result.add_left_multi(entity, ancestors)
-        return result
+        which contains these modifications.
+
+        The copy is a `gfam.utils.compactbidict` because the analyser never
+        modifies the propagated mapping; the compact representation needs
+        only a fraction of the memory of a `bidict` of Python sets, and it
+        is built directly from the propagated annotations without copying
+        `mapping` first."""
+        return compactbidict((entity, self.tree.ancestors(*terms))
+                             for entity, terms in mapping.iteritems_left())
 
     def enrichment_p(self, term_or_id, count, group_size):
         """Calculates the enrichment p-score of the given GO term or ID
@@ -122,9 +257,13 @@ class OverrepresentationAnalyser(object):
         `group_size`.
         """
         term = self.tree.ensure_term(term_or_id)
-        objs = self.mapping.right[term]
-        return hypergeom_sf(count, self.mapping.len_left(), \
-                            len(objs), group_size)
+        key = (count, len(self.mapping.right[term]), group_size)
+        try:
+            return self.p_value_cache[key]
+        except KeyError:
+            p = self.tail.sf(*key)
+            self.p_value_cache[key] = p
+            return p
 
     def test_counts(self, counts, group_size):
         """Given a dict that maps Gene Ontology terms to their
@@ -151,13 +290,28 @@ class OverrepresentationAnalyser(object):
         elif correction == "sidak":
             confidence = 1 - (1. - confidence) ** (1. / num_tests)
 
-        # Do the testing
-        result = []
+        # Do the testing. p-values are looked up from the cache first; the
+        # missing ones are calculated in a single pass
+        cache = self.p_value_cache
+        result, missing = [], []
         for term, count in counts.iteritems():
-            if len(self.mapping.right[term]) < min_count:
+            term_size = len(self.mapping.right[term])
+            if term_size < min_count:
                 continue
-            p = self.enrichment_p(term, count, group_size)
-            result.append((term, p))
+            key = (count, term_size, group_size)
+            try:
+                result.append((term, cache[key]))
+            except KeyError:
+                missing.append((len(result), term, key))
+                result.append(None)
+
+        if missing:
+            keys = [key for _, _, key in missing]
+            p_values = self.tail.sf_many(*zip(*keys))
+            for (idx, term, key), p in zip(missing, p_values):
+                p = float(p)
+                cache[key] = p
+                result[idx] = (term, p)
 
         # Filter the results
         if correction == "fdr":
@@ -168,7 +322,7 @@ class OverrepresentationAnalyser(object):
                     result = result[0:k]
                     break
         else:
-            result = [item for item in result if r[1] <= confidence]
+            result = [item for item in result if item[1] <= confidence]
             result.sort(key = itemgetter(1))
             if correction == "bonferroni":
                 result = [(c, p * num_tests) for c, p in result]
@@ -177,11 +331,10 @@ class OverrepresentationAnalyser(object):
 
         return result
 
-    def test_group(self, group):
-        """Overrepresentation analysis of the given group of objects.
-        `group` must be an iterable yielding objects that are in
-        `self.mapping.left`.
-        """
+    def _count_terms(self, group):
+        """Counts the occurrences of each GO term in the given group of
+        objects. Returns a dict mapping GO terms to their counts and the
+        size of the group."""
         counts = defaultdict(int)
         group_size = 0
         for item in group:
@@ -189,4 +342,139 @@ class OverrepresentationAnalyser(object):
             for go_term in terms:
                 counts[go_term] += 1
             group_size += 1
-        return self.test_counts(counts, group_size)
+        return counts, group_size
+
+    def test_group(self, group):
+        """Overrepresentation analysis of the given group of objects.
+        `group` must be an iterable yielding objects that are in
+        `self.mapping.left`.
+        """
+        return self.test_counts(*self._count_terms(group))
+
+    def test_groups(self, groups):
+        """Overrepresentation analysis of many groups of objects at once.
+        `groups` must be an iterable yielding groups that are accepted by
+        `test_group`. Returns a list that contains the result of `test_group`
+        for each group, in the order the groups were given.
+
+        The term counts of all the groups are collected into a sparse
+        group-term count matrix first, and the p-values and the corrections
+        are then calculated for all the groups at the same time using NumPy.
+        If NumPy is not available, this method simply calls `test_group`
+        for each group.
+        """
+        if numpy is None:
+            return [self.test_group(group) for group in groups]
+
+        min_count = self.min_count
+
+        # Build the sparse count matrix in coordinate format: row indices
+        # are groups, column indices are terms. Terms that are too small
+        # to be tested are mapped to None
+        result, rows, cols, counts, group_sizes = [], [], [], [], []
+        terms, term_sizes, term_indices = [], [], {}
+        for row, group in enumerate(groups):
+            result.append([])
+            term_counts, group_size = self._count_terms(group)
+            group_sizes.append(group_size)
+            for term, count in term_counts.iteritems():
+                try:
+                    col = term_indices[term]
+                except KeyError:
+                    term_size = len(self.mapping.right[term])
+                    if term_size < min_count:
+                        col = None
+                    else:
+                        col = len(terms)
+                        terms.append(term)
+                        term_sizes.append(term_size)
+                    term_indices[term] = col
+                if col is None:
+                    continue
+                rows.append(row)
+                cols.append(col)
+                counts.append(count)
+
+        if not rows:
+            return result
+
+        rows = numpy.array(rows, dtype=int)
+        cols = numpy.array(cols, dtype=int)
+        counts = numpy.array(counts, dtype=int)
+        sizes = numpy.array(term_sizes, dtype=int)[cols]
+        group_sizes = numpy.array(group_sizes, dtype=int)[rows]
+
+        # Calculate the p-values for the unique (count, term size, group
+        # size) triples only
+        p_values = self._p_values_for_triples(counts, sizes, group_sizes)
+
+        # Sort the entries by group and then by p-value; ties are broken
+        # by the order of the entries, just like in `test_counts`
+        order = numpy.lexsort((p_values, rows))
+        rows, cols, p_values = rows[order], cols[order], p_values[order]
+        num_tests = numpy.bincount(rows, minlength=len(result))
+        row_starts = numpy.cumsum(num_tests) - num_tests
+        num_tests = num_tests[rows].astype(float)
+
+        confidence, correction = self.confidence, self.correction
+        if correction == "fdr":
+            ranks = numpy.arange(len(rows)) - row_starts[rows] + 1
+            failed = numpy.cumsum(p_values > confidence * ranks / num_tests)
+            # Keep the entries that precede the first failed test in their
+            # own group
+            failed_before = numpy.concatenate(([0], failed))[row_starts[rows]]
+            keep = failed == failed_before
+        else:
+            if correction == "bonferroni":
+                keep = p_values <= confidence / num_tests
+                p_values = p_values * num_tests
+            elif correction == "sidak":
+                keep = p_values <= 1 - (1. - confidence) ** (1. / num_tests)
+                p_values = 1 - (1 - p_values) ** num_tests
+            else:
+                keep = p_values <= confidence
+
+        for row, col, p_value in zip(rows[keep], cols[keep], p_values[keep]):
+            result[row].append((terms[col], float(p_value)))
+        return result
+
+    def _p_values_for_triples(self, counts, sizes, group_sizes):
+        """Given NumPy arrays of term counts, term sizes and group sizes,
+        returns a NumPy array of the corresponding enrichment p-values.
+        Each unique triple is looked up in or added to `p_value_cache`."""
+        triples = numpy.column_stack((counts, sizes, group_sizes))
+        triples, inverse = unique_rows(triples)
+
+        cache = self.p_value_cache
+        unique_p_values = numpy.zeros(len(triples), dtype=float)
+        missing = []
+        for idx, key in enumerate(map(tuple, triples.tolist())):
+            try:
+                unique_p_values[idx] = cache[key]
+            except KeyError:
+                missing.append(idx)
+
+        if missing:
+            missing = numpy.array(missing, dtype=int)
+            keys = triples[missing]
+            unique_p_values[missing] = self.tail.sf_many(keys[:, 0],
+                    keys[:, 1], keys[:, 2])
+            for key, p in zip(map(tuple, keys.tolist()),
+                              unique_p_values[missing].tolist()):
+                cache[key] = p
+
+        return unique_p_values[inverse]
+
+
+def unique_rows(matrix):
+    """Returns the unique rows of the given two-dimensional NumPy array of
+    integers and an index array that reconstructs the original array from the
+    unique rows. This is equivalent to ``numpy.unique(matrix, axis=0,
+    return_inverse=True)`` but it works with older NumPy versions as well."""
+    order = numpy.lexsort(matrix.T[::-1])
+    sorted_matrix = matrix[order]
+    is_new = numpy.ones(len(matrix), dtype=bool)
+    is_new[1:] = (sorted_matrix[1:] != sorted_matrix[:-1]).any(axis=1)
+    inverse = numpy.empty(len(matrix), dtype=int)
+    inverse[order] = numpy.cumsum(is_new) - 1
+    return sorted_matrix[is_new], inverse
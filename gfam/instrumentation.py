@@ -0,0 +1,649 @@
+"""Routines for measuring the resource usage of the steps of the GFam
+pipeline.
+
+The master script (see `gfam.scripts.master`) measures the wall clock time,
+the CPU time, the peak memory usage and the amount of data read and written
+by each step it executes, and collects these measurements in a `RunReport`.
+Run reports are saved as JSON files in the ``_reports`` subfolder of the
+work folder, so they can be processed by other tools as well;
+`summarize_reports` aggregates the measurements of several runs per step.
+
+`profile_call` profiles a single function call either with ``cProfile`` or
+with `StackSampler`, a statistical profiler whose output can be turned into
+a flame graph. This is used by the ``--profile`` option of the command line
+scripts (see `gfam.scripts.CommandLineApp`).
+
+`ProgressReporter` logs the progress, the throughput and the estimated
+remaining time of long-running loops at regular intervals.
+"""
+
+from __future__ import with_statement
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+__all__ = ["CountingWriter", "format_bytes", "format_duration",
+           "get_children_peak_rss", "get_peak_rss", "input_size",
+           "is_profiling", "load_reports", "Measurement", "print_table",
+           "profile_call", "PROFILE_FORMATS", "ProgressReporter",
+           "reset_peak_rss", "RunReport", "StackSampler", "summarize_reports"]
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import os
+import signal
+import socket
+import sys
+
+from gfam.bgzf import uncompressed_size
+from glob import glob
+from itertools import imap, islice
+from time import time
+
+#: The output formats supported by `profile_call`
+PROFILE_FORMATS = ("pstats", "collapsed")
+
+
+def _rusage_peak_rss(who):
+    """Returns the peak resident set size reported by ``getrusage`` in
+    bytes, or ``None`` if ``getrusage`` is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        # Mac OS X reports bytes, Linux reports kilobytes
+        return peak
+    return peak * 1024
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of the current process in bytes,
+    or ``None`` if it cannot be determined on this platform.
+
+    On Linux, the peak is read from ``/proc/self/status``, which takes
+    `reset_peak_rss` into account. On other platforms, the peak since the
+    start of the process is returned.
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    return _rusage_peak_rss(resource.RUSAGE_SELF)
+
+
+def get_children_peak_rss():
+    """Returns the largest peak resident set size among the terminated
+    child processes of the current process in bytes, or ``None`` if it
+    cannot be determined on this platform."""
+    if resource is None:
+        return None
+    return _rusage_peak_rss(resource.RUSAGE_CHILDREN)
+
+
+def reset_peak_rss():
+    """Resets the peak resident set size of the current process to the
+    current resident set size, so `get_peak_rss` returns the peak since the
+    reset. This works on Linux 4.0 and later only; returns whether the reset
+    was successful."""
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except (IOError, OSError):
+        return False
+    return True
+
+
+class CountingWriter(object):
+    """Write-only file-like object that forwards everything to another
+    file-like object and counts the number of bytes and lines written.
+
+    Usage example::
+
+        writer = CountingWriter(open("results.txt", "w"))
+        print >>writer, "some text"
+        print writer.bytes_written, writer.lines_written
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.bytes_written = 0
+        self.lines_written = 0
+        self.softspace = 0
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+    def close(self):
+        """Closes the underlying file."""
+        self.fp.close()
+
+    def flush(self):
+        """Flushes the underlying file."""
+        self.fp.flush()
+
+    def write(self, data):
+        """Writes the given string to the underlying file."""
+        self.bytes_written += len(data)
+        self.lines_written += data.count("\n")
+        self.fp.write(data)
+
+    def writelines(self, lines):
+        """Writes the given strings to the underlying file."""
+        for line in lines:
+            self.write(line)
+
+
+def input_size(fname):
+    """Returns the number of bytes that will be read from the given input
+    file when it is opened with `gfam.utils.open_anything`, or ``None`` if
+    it cannot be determined in advance.
+
+    The size is known for uncompressed files and for block-compressed gzip
+    files with a block index (see `gfam.bgzf`), but not for other
+    compressed files, the standard input and remote files.
+    """
+    if not isinstance(fname, basestring) or fname == "-" or \
+            not os.path.isfile(fname):
+        return None
+    if fname[-3:] == ".gz":
+        return uncompressed_size(fname)
+    if fname[-4:] == ".bz2":
+        return None
+    return os.path.getsize(fname)
+
+
+def format_bytes(num_bytes):
+    """Formats the given number of bytes in a human-readable form.
+
+    Example::
+
+        >>> format_bytes(512)
+        '512.0 B'
+        >>> format_bytes(3 * 1024 * 1024)
+        '3.0 MiB'
+        >>> format_bytes(None)
+        '-'
+    """
+    if num_bytes is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(num_bytes) < 1024:
+            return "%.1f %s" % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return "%.1f TiB" % num_bytes
+
+
+def format_duration(seconds):
+    """Formats the given number of seconds as ``H:MM:SS``.
+
+    Example::
+
+        >>> format_duration(3725.4)
+        '1:02:05'
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+def print_table(header, rows, stream=None):
+    """Prints the given rows as a simple left-aligned text table with the
+    given header to the given stream (the standard output by default).
+
+    Example::
+
+        >>> print_table(["name", "size"], [["foo", 1], ["barbaz", 100]])
+        name    size
+        foo     1
+        barbaz  100
+    """
+    stream = stream or sys.stdout
+    rows = [[str(item) for item in row] for row in rows]
+    widths = [max(len(row[i]) for row in [header] + rows)
+              for i in xrange(len(header))]
+    for row in [header] + rows:
+        print >>stream, "  ".join(item.ljust(width)
+                                  for item, width in zip(row, widths)).rstrip()
+
+
+class ProgressReporter(object):
+    """Logs the progress of a long-running loop at regular intervals.
+
+    The reporter counts the records (and optionally the bytes) processed by
+    the loop, and logs the number of records, the throughput and, if the
+    total amount of work is known, the percentage done and the estimated
+    remaining time at most once every `interval` seconds. To keep the
+    overhead low, the clock is checked only after every `check_every`
+    records.
+
+    Usage example::
+
+        progress = ProgressReporter(log, "Reading input.txt",
+                                    total_bytes=input_size("input.txt"))
+        for line in progress.iterate(open("input.txt"), count_bytes=True):
+            process(line)
+        progress.finish()
+    """
+
+    def __init__(self, logger, name, total_records=None, total_bytes=None,
+                 interval=60.0, check_every=10000):
+        """Creates a new progress reporter that logs to the given logger.
+
+        `name` is the description of the task that is printed in front of
+        each message. `total_records` and `total_bytes` are the total number
+        of records and bytes to be processed, respectively, if known. The
+        estimated remaining time is calculated from the number of bytes if
+        `total_bytes` is known, otherwise from the number of records. If
+        `interval` is zero or ``None``, nothing will be logged.
+        """
+        self.log = logger
+        self.name = name
+        self.total_records = total_records
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.check_every = max(1, int(check_every))
+
+        self.records = 0
+        self.bytes = 0
+        self.started_at = time()
+        self._next_check = self.check_every
+        self._next_report_at = self.started_at + (interval or 0)
+
+    def _check(self):
+        """Logs the progress if enough time has passed since the last
+        message."""
+        self._next_check = self.records + self.check_every
+        if not self.interval:
+            return
+        now = time()
+        if now >= self._next_report_at:
+            self.report(now)
+            self._next_report_at = now + self.interval
+
+    def iterate(self, iterable, count_bytes=False):
+        """Iterates over the given iterable and counts its items as records.
+        If `count_bytes` is ``True``, the items must be strings and their
+        lengths are counted as bytes.
+
+        The items are fetched in chunks of `check_every` items, so the
+        counting itself costs almost nothing per item."""
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, self.check_every))
+            if not chunk:
+                break
+            self.records += len(chunk)
+            if count_bytes:
+                self.bytes += sum(imap(len, chunk))
+            self._check()
+            for item in chunk:
+                yield item
+
+    def update(self, records=1, num_bytes=0):
+        """Adds the given number of records and bytes to the counters."""
+        self.records += records
+        self.bytes += num_bytes
+        if self.records >= self._next_check:
+            self._check()
+
+    def report(self, now=None):
+        """Logs the current progress."""
+        if now is None:
+            now = time()
+        elapsed = max(now - self.started_at, 1e-6)
+
+        parts = ["%d records (%.0f records/s)" %
+                 (self.records, self.records / elapsed)]
+        if self.bytes:
+            parts.append("%s (%s/s)" % (format_bytes(self.bytes),
+                                        format_bytes(self.bytes / elapsed)))
+
+        fraction = None
+        if self.total_bytes:
+            fraction = self.bytes / float(self.total_bytes)
+            parts.append("%.1f%% of %s" % (100.0 * fraction,
+                                           format_bytes(self.total_bytes)))
+        elif self.total_records:
+            fraction = self.records / float(self.total_records)
+            parts.append("%.1f%% of %d records" % (100.0 * fraction,
+                                                   self.total_records))
+        if fraction:
+            remaining = elapsed * max(1.0 - fraction, 0.0) / fraction
+            parts.append("ETA %s" % format_duration(remaining))
+
+        self.log.info("%s: %s" % (self.name, ", ".join(parts)))
+
+    def finish(self):
+        """Logs the total number of records processed and the average
+        throughput."""
+        if not self.interval:
+            return
+        elapsed = time() - self.started_at
+        message = "%s: finished, %d records" % (self.name, self.records)
+        if self.bytes:
+            message += " (%s)" % format_bytes(self.bytes)
+        message += " in %s" % format_duration(elapsed)
+        if elapsed > 0:
+            message += " (%.0f records/s)" % (self.records / elapsed)
+        self.log.info(message)
+
+
+class Measurement(object):
+    """Measures the resources used by the current process and its child
+    processes between the construction of the object and the call to
+    `stop()`.
+
+    Usage example::
+
+        measurement = Measurement()
+        do_something()
+        print measurement.stop()["wall_time"]
+    """
+
+    def __init__(self):
+        self.peak_rss_reset = reset_peak_rss()
+        self.start_children_peak_rss = get_children_peak_rss()
+        self.started_at = time()
+        self.start_times = os.times()
+
+    def stop(self):
+        """Stops the measurement and returns a dict with the following
+        keys:
+
+        - ``started_at``: the UNIX timestamp of the start of the measurement
+        - ``wall_time``: the elapsed wall clock time in seconds
+        - ``cpu_time``: the user and system CPU time used by the process
+        - ``children_cpu_time``: the user and system CPU time used by the
+          child processes that terminated during the measurement
+        - ``peak_rss``: the peak resident set size of the process in bytes.
+          If the peak could not be reset at the start of the measurement,
+          this is the peak since the start of the process.
+        - ``peak_rss_since_start``: whether ``peak_rss`` is the peak since
+          the start of the process
+        - ``children_peak_rss``: the largest peak resident set size among
+          the child processes terminated so far if it has grown during the
+          measurement, ``None`` otherwise
+        """
+        end_times = os.times()
+        children_peak_rss = get_children_peak_rss()
+        if children_peak_rss <= self.start_children_peak_rss:
+            children_peak_rss = None
+        wall_time = time() - self.started_at
+        diffs = [end - start for start, end in
+                 zip(self.start_times[:4], end_times[:4])]
+        return dict(started_at=self.started_at, wall_time=wall_time,
+                    cpu_time=diffs[0] + diffs[1],
+                    children_cpu_time=diffs[2] + diffs[3],
+                    peak_rss=get_peak_rss(),
+                    peak_rss_since_start=not self.peak_rss_reset,
+                    children_peak_rss=children_peak_rss)
+
+
+class RunReport(object):
+    """Machine-readable report of a run of the GFam pipeline.
+
+    The report is a dict in `data` that contains some information about the
+    run (``command``, ``hostname``, ``pid``, ``started_at`` and
+    ``finished_at``) and a list of measurements for each step executed
+    during the run in ``steps``. Each step is a dict returned by
+    `Measurement.stop()`, extended with the name of the step (``name``),
+    its exit status (``status``; ``ok`` or ``failed``) and the files it
+    has read (``inputs``) and written (``output``). Files are described by
+    dicts containing their ``name``, their size in ``bytes`` and the
+    number of ``records`` (lines) in them if it is known, otherwise
+    ``None``.
+
+    The report is written to the given file whenever a step is added, so
+    the measurements of completed steps are kept even if the pipeline is
+    interrupted.
+    """
+
+    def __init__(self, fname, command=None, data=None):
+        """Creates a new run report that will be saved into the given file.
+        `command` is the command line of the run. `data` may be used to
+        initialize the report from a loaded JSON file."""
+        self.fname = fname
+        if data is None:
+            data = dict(command=command, hostname=socket.gethostname(),
+                        pid=os.getpid(), started_at=time(),
+                        finished_at=None, steps=[])
+        self.data = data
+
+    @classmethod
+    def FromFile(cls, fname):
+        """Loads a run report from the given file."""
+        with open(fname) as fp:
+            return cls(fname, data=json.load(fp))
+
+    @property
+    def steps(self):
+        """The list of measurements of the steps in the report"""
+        return self.data["steps"]
+
+    def add_step(self, step):
+        """Adds the measurements of a step to the report and saves it."""
+        self.steps.append(step)
+        self.save()
+
+    def find_step(self, name):
+        """Returns the measurements of the last step with the given name,
+        or ``None`` if there is no such step in the report."""
+        for step in reversed(self.steps):
+            if step["name"] == name:
+                return step
+        return None
+
+    def finish(self):
+        """Marks the run as finished and saves the report if it contains
+        at least one step."""
+        self.data["finished_at"] = time()
+        if self.steps:
+            self.save()
+
+    def save(self):
+        """Saves the report into its file. The report is written into a
+        temporary file first, which is then renamed, so the file never
+        contains a partially written report."""
+        dirname = os.path.dirname(self.fname)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_fname = self.fname + ".tmp"
+        with open(tmp_fname, "w") as fp:
+            json.dump(self.data, fp, indent=2, sort_keys=True)
+        os.rename(tmp_fname, self.fname)
+
+
+def load_reports(dirname):
+    """Loads all the run reports from the given folder, ordered by their
+    starting time. Files that cannot be parsed are skipped."""
+    result = []
+    for fname in glob(os.path.join(dirname, "*.json")):
+        try:
+            result.append(RunReport.FromFile(fname))
+        except (IOError, ValueError):
+            continue
+    result.sort(key=lambda report: report.data.get("started_at") or 0)
+    return result
+
+
+def summarize_reports(reports):
+    """Aggregates the measurements of the steps in the given run reports.
+
+    Returns a list of dicts, one for each step name, sorted by the total
+    wall clock time spent in the step, in decreasing order. Each dict
+    contains the ``name`` of the step, the number of times it was executed
+    (``runs``) and failed (``failures``), the ``total_wall_time``, the
+    ``mean_wall_time``, the ``max_wall_time``, the ``total_cpu_time``
+    (including child processes), the maximum ``peak_rss`` (including child
+    processes) and the ``output_bytes`` and ``output_records`` of the last
+    execution.
+    """
+    summary = {}
+    for report in reports:
+        for step in report.steps:
+            name = step["name"]
+            if name not in summary:
+                summary[name] = dict(name=name, runs=0, failures=0,
+                        total_wall_time=0.0, max_wall_time=0.0,
+                        total_cpu_time=0.0, peak_rss=None,
+                        output_bytes=None, output_records=None)
+            item = summary[name]
+            item["runs"] += 1
+            if step.get("status") != "ok":
+                item["failures"] += 1
+            item["total_wall_time"] += step["wall_time"]
+            item["max_wall_time"] = max(item["max_wall_time"],
+                                        step["wall_time"])
+            item["total_cpu_time"] += step["cpu_time"] + \
+                                      step["children_cpu_time"]
+            for key in ("peak_rss", "children_peak_rss"):
+                if step.get(key) is not None:
+                    item["peak_rss"] = max(item["peak_rss"], step[key])
+            output = step.get("output") or {}
+            item["output_bytes"] = output.get("bytes")
+            item["output_records"] = output.get("records")
+
+    result = summary.values()
+    for item in result:
+        item["mean_wall_time"] = item["total_wall_time"] / item["runs"]
+    result.sort(key=lambda item: item["total_wall_time"], reverse=True)
+    return result
+
+
+class StackSampler(object):
+    """Statistical profiler that samples the call stack of the main thread
+    at regular intervals of CPU time and counts how many times each stack
+    was seen.
+
+    The samples are taken from a ``SIGPROF`` signal handler, so the sampler
+    works on Unix-like systems only and must be started from the main
+    thread. The counts can be written in the "collapsed stack" format used
+    by ``flamegraph.pl`` and similar tools, where each line contains the
+    frames of a stack separated by semicolons (outermost frame first),
+    followed by a space and the number of samples.
+
+    Usage example::
+
+        sampler = StackSampler()
+        sampler.start()
+        do_something()
+        sampler.stop()
+        sampler.write("do_something.txt")
+    """
+
+    def __init__(self, interval=0.005):
+        """Creates a sampler that takes a sample after every `interval`
+        seconds of CPU time."""
+        if not hasattr(signal, "setitimer"):
+            raise NotImplementedError("stack sampling needs "
+                                      "signal.setitimer")
+        self.interval = interval
+        self.counts = {}
+        self._old_handler = None
+
+    def _format_frame(self, frame):
+        """Formats a single stack frame for the collapsed stack format."""
+        code = frame.f_code
+        return "%s (%s:%d)" % (code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+    def _sample(self, signum, frame):
+        """Signal handler that records the stack of the given frame."""
+        stack = []
+        while frame is not None:
+            stack.append(self._format_frame(frame))
+            frame = frame.f_back
+        stack.reverse()
+        key = ";".join(stack)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def start(self):
+        """Starts sampling the call stack."""
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stops sampling the call stack."""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+        self._old_handler = None
+
+    def write(self, fname):
+        """Writes the collected samples into the given file in the collapsed
+        stack format."""
+        with open(fname, "w") as fp:
+            for stack, count in sorted(self.counts.iteritems()):
+                fp.write("%s %d\n" % (stack, count))
+
+
+def is_profiling():
+    """Returns whether a profiler is already running in this process, i.e.
+    whether a profile hook is installed (``cProfile``) or the profiling
+    interval timer is armed (`StackSampler`). Profilers do not nest: the
+    inner one would switch off the outer one when it finishes."""
+    if sys.getprofile() is not None:
+        return True
+    if hasattr(signal, "getitimer"):
+        return signal.getitimer(signal.ITIMER_PROF) != (0.0, 0.0)
+    return False
+
+
+def profile_call(func, fname, format="pstats", log=None):
+    """Calls `func` without arguments while profiling it, writes the profile
+    into the given file and returns the result of `func`.
+
+    If `format` is ``pstats``, the call is profiled with ``cProfile`` and
+    the statistics are written in the format understood by the ``pstats``
+    module. If `format` is ``collapsed``, the call is profiled by a
+    `StackSampler` and the file contains collapsed stacks that can be
+    turned into a flame graph.
+
+    The profile is written even if `func` raises an exception.
+
+    If a profiler is already running (see `is_profiling`), `func` is called
+    without profiling, no profile is written and a warning is logged to
+    `log` if it is given, since the profilers cannot be nested.
+    """
+    if format not in PROFILE_FORMATS:
+        raise ValueError("unknown profile format: %r" % format)
+
+    if is_profiling():
+        if log is not None:
+            log.warning("A profiler is already running, not saving "
+                        "profile to %s" % fname)
+        return func()
+
+    if format == "pstats":
+        try:
+            from cProfile import Profile
+        except ImportError:
+            from profile import Profile
+        profiler = Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            profiler.dump_stats(fname)
+    elif format == "collapsed":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return func()
+        finally:
+            sampler.stop()
+            sampler.write(fname)
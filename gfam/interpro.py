@@ -1,6 +1,13 @@
 """Classes related to handling InterPro-related files in HyFam"""
 
+import os
 import re
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from collections import defaultdict
 from gfam.assignment import Assignment
@@ -25,10 +32,25 @@ class AssignmentReader(object):
     
     This reader parses the output of ``iprscan`` and yields appropriate
     `Assignment` instances for each line.
+
+    The string fields of the assignments (sequence ID, source, domain,
+    InterPro ID and comment) are interned by default. There are only a few
+    sources and a few tens of thousands of domains, so interning saves a
+    lot of memory when many assignments are kept in memory, and the
+    interned domain IDs are shared with the ones resolved by
+    `Assignment.resolve_interpro_ids`. Pass ``intern_strings=False`` to
+    the constructor to turn it off.
+
+    Besides filenames and file objects, the reader also accepts any
+    iterable that yields the lines of the assignment file.
     """
 
-    def __init__(self, filename):
-        self._fp = open_anything(filename)
+    def __init__(self, filename, intern_strings=True):
+        if isinstance(filename, (basestring, file)):
+            self._fp = open_anything(filename)
+        else:
+            self._fp = filename
+        self.intern_strings = intern_strings
 
     def assignments(self):
         """A generator that yields the assignments in the InterPro domain
@@ -72,6 +94,15 @@ class AssignmentReader(object):
         if parts[11] == 'NULL' or not parts[11]:
             parts[11] = None
 
+        if self.intern_strings:
+            parts[0] = intern(parts[0])
+            parts[3] = intern(parts[3])
+            parts[4] = intern(parts[4])
+            if parts[11] is not None:
+                parts[11] = intern(parts[11])
+            if parts[14] is not None:
+                parts[14] = intern(parts[14])
+
         assignment = Assignment( \
                 id = parts[0],
                 length = int(parts[2]),
@@ -124,6 +155,7 @@ class InterProTree(Mapping):
 
     def __init__(self):
         self._data = {}
+        self._roots = None
 
     def __contains__(self, item):
         return self._data.__contains__(item)
@@ -135,11 +167,48 @@ class InterProTree(Mapping):
         """Returns the most remote ancestor of the given item.
         
         For family IDs, this returns the ID itself. For subfamily IDs and below,
-        this returns the corresponding family ID."""
-        parent, child = self._data.get(item, item), item
-        while parent != child:
-            parent, child = self._data.get(parent, parent), parent
-        return parent
+        this returns the corresponding family ID.
+
+        The most remote ancestors of all the IDs are calculated at once when
+        this method is called for the first time after the tree was built or
+        modified, so each call is a single dict lookup."""
+        roots = self._roots
+        if roots is None:
+            roots = self._roots = self._build_root_table()
+        return roots.get(item, item)
+
+    def _build_root_table(self):
+        """Calculates the table used by `get_most_remote_ancestor` by walking
+        the parent links from each ID until an ID with a known ancestor or
+        a family ID is found. Each ID is visited only once. The ancestor
+        IDs in the table are interned."""
+        data, roots = self._data, {}
+        for item in data:
+            path, node = [], item
+            while node in data and node not in roots:
+                path.append(node)
+                parent = data[node]
+                if parent == node:
+                    break
+                node = parent
+            root = intern(roots.get(node, node))
+            for node in path:
+                roots[node] = root
+        return roots
+
+    def get_root_table(self):
+        """Returns a dict that maps every ID in the tree that has a parent
+        to its most remote ancestor."""
+        if self._roots is None:
+            self._roots = self._build_root_table()
+        return dict(self._roots)
+
+    def set_root_table(self, roots):
+        """Sets the table used by `get_most_remote_ancestor` to look up the
+        most remote ancestors of IDs. `roots` must be a dict returned by
+        `get_root_table`. The table is discarded when the tree is
+        modified."""
+        self._roots = roots
 
     def __iter__(self):
         return self._data.__iter__()
@@ -149,9 +218,11 @@ class InterProTree(Mapping):
 
     def __setitem__(self, child, parent):
         self._data[child] = parent
+        self._roots = None
 
     def __delitem__(self, child):
         del self._data[child]
+        self._roots = None
 
 
 class InterProIDMapper(object):
@@ -274,10 +345,87 @@ class InterPro(object):
     For usage examples, see `InterProTree` and `InterProIDMapper`.
     """
 
+    #: Version number of the format of the cache files written by
+    #: `FromCachedFile`. Cache files with a different version are ignored.
+    cache_version = 1
+
     def __init__(self):
         self.tree = InterProTree()
         self.mapping = InterProIDMapper()
 
+    @classmethod
+    def FromCachedFile(cls, filename, cache_filename=None):
+        """Constructs this object from an InterPro parent-child mapping file
+        just like `FromFile`, but uses a cache file to avoid parsing the
+        same file over and over again.
+
+        The cache contains the tree, the ID mapper and the table of the
+        most remote ancestors of the tree in a pickled form. It is valid
+        only if its format version is equal to `cache_version` and the
+        absolute path, the modification time and the size of `filename` did
+        not change since the cache was written; otherwise `filename` is parsed and the cache
+        is rewritten. Errors while writing the cache are ignored.
+
+        `cache_filename` is the name of the cache file; its folder is
+        created if needed. ``None`` means that no cache is used and
+        `filename` is simply parsed. The master script keeps the cache in
+        the work folder, since the folder of `filename` may be shared or
+        read-only.
+        """
+        if cache_filename is None:
+            return cls.FromFile(filename)
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return cls.FromFile(filename)
+        key = (cls.cache_version, os.path.abspath(filename), stat.st_mtime,
+               stat.st_size)
+
+        try:
+            fp = open(cache_filename, "rb")
+            try:
+                cache_key, tree, roots, mapping = pickle.load(fp)
+            finally:
+                fp.close()
+        except Exception:
+            cache_key = None
+
+        if cache_key == key:
+            result = cls()
+            result.tree._data = tree
+            result.tree.set_root_table(roots)
+            result.mapping._data = mapping
+            return result
+
+        result = cls.FromFile(filename)
+        roots = result.tree.get_root_table()
+        result.tree.set_root_table(roots)
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_filename))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir)
+        except (IOError, OSError):
+            return result
+        try:
+            fp = os.fdopen(fd, "wb")
+            try:
+                pickle.dump((key, result.tree._data, roots,
+                             result.mapping._data), fp, -1)
+            finally:
+                fp.close()
+            os.chmod(tmp_filename, 0644)
+            os.rename(tmp_filename, cache_filename)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+
+        return result
+
     @classmethod
     def FromFile(cls, filename):
         """Constructs this object from an InterPro parent-child mapping file,
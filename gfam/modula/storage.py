@@ -89,6 +89,13 @@ class AbstractStorageEngine(object):
         responsibility of the module to create it if needed. The entire
         folder will be removed when the execution of the module finishes."""
         raise NotImplementedError
+
+    def get_cache_filename(self, name):
+        """Retrieves the name of a cache file with the given name that the
+        modules may share between executions. The folder of the file is
+        not guaranteed to exist; it is the responsibility of the module to
+        create it if needed."""
+        raise NotImplementedError
     
     def store(self, module, parameters, result):
         """Stores the result of the given module with the given parameter
@@ -155,6 +162,9 @@ class DiskStorageEngine(AbstractStorageEngine):
 
     def get_temporary_folder(self, module):
         return os.path.join(self.storage_dir, "_tmp", module)
+
+    def get_cache_filename(self, name):
+        return os.path.join(self.storage_dir, "_cache", name)
     
     def store(self, module, result):
         """Stores the result of the given module with the given parameter
@@ -12,9 +12,19 @@ implementing functionality common for all the scripts, such as:
 - providing a logger instance
 - defining methods for extending the default option parser and for
   signaling fatal errors to the caller
+- profiling the application when the ``--profile`` option is given
+- creating progress reporters for long-running loops
+- processing chunks of items in parallel worker processes
+
+`read_domain_architectures` reads the domain architectures of the sequences
+from the output of ``find_domain_arch.py``; this is used by the scripts
+that annotate the unique domain architectures with GO terms.
 """
 
 from gfam.config import ConfigurableOptionParser
+from gfam.instrumentation import profile_call, PROFILE_FORMATS, \
+                                 ProgressReporter
+from gfam.utils import fork_map, open_anything
 from textwrap import dedent
 
 import logging
@@ -24,7 +34,7 @@ __email__   = "tamas@cs.rhul.ac.uk"
 __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "GPL"
 
-__all__ = ["CommandLineApp"]
+__all__ = ["CommandLineApp", "read_domain_architectures"]
 
 class CommandLineApp(object):
     """Generic command line application class that provides
@@ -64,7 +74,11 @@ class CommandLineApp(object):
         above or equal to `logging.INFO` are printed. In debug
         mode, all log messages (including debug messages) are
         printed. The default is to print warnings and errors
-        only.
+        only. ``--profile`` and ``--profile-format`` specify where
+        and in which format the profile of `run_real()` should be
+        saved (see `gfam.instrumentation.profile_call`), while
+        ``--progress-interval`` specifies how often the progress reporters
+        created by `create_progress_reporter()` should log the progress.
 
         The created command line parser will be returned to the
         caller.
@@ -75,6 +89,20 @@ class CommandLineApp(object):
                 action="store_true", help="verbose logging")
         parser.add_option("-d", "--debug", dest="debug",
                 action="store_true", help="show debug messages")
+        parser.add_option("--profile", dest="profile_file", metavar="FILE",
+                help="profile the application and save the profile "
+                     "into FILE")
+        parser.add_option("--profile-format", dest="profile_format",
+                metavar="FORMAT", choices=PROFILE_FORMATS,
+                default="pstats",
+                help="format of the profile: pstats (for the pstats "
+                     "module) or collapsed (sampled stacks for flame "
+                     "graphs). Default: %default")
+        parser.add_option("--progress-interval", dest="progress_interval",
+                metavar="SECONDS", type=float, default=60.0,
+                config_key="progress_interval",
+                help="log the progress of long-running steps every SECONDS "
+                     "seconds; zero turns it off. Default: %default")
         return parser
 
     def create_logger(self):
@@ -90,6 +118,27 @@ class CommandLineApp(object):
 
         return log
 
+    def create_progress_reporter(self, name, **kwds):
+        """Creates a `gfam.instrumentation.ProgressReporter` that logs the
+        progress of a long-running loop to the logger of the application
+        at the interval given by the ``--progress-interval`` option.
+        `name` is the description of the loop; the keyword arguments are
+        passed on to the constructor of the reporter."""
+        kwds.setdefault("interval", self.options.progress_interval)
+        return ProgressReporter(self.log, name, **kwds)
+
+    def fork_map_chunks(self, func, items, num_jobs):
+        """Splits `items` into chunks and calls `func` on each chunk in
+        `num_jobs` worker processes using `gfam.utils.fork_map`. Each
+        process gets about four chunks to balance the load. Returns the
+        results of `func` in a list, in the same order as the chunks;
+        concatenating the chunks gives `items` again."""
+        chunk_size = max(1, len(items) // (num_jobs * 4))
+        chunks = [items[i:i+chunk_size]
+                  for i in xrange(0, len(items), chunk_size)]
+        self.log.info("Using %d worker processes" % num_jobs)
+        return fork_map(func, chunks, num_jobs)
+
     def error(self, message):
         """Signals a fatal error and shuts down the application."""
         self.parser.error(message)
@@ -112,9 +161,35 @@ class CommandLineApp(object):
         if self.options.debug:
             self.log.setLevel(logging.DEBUG)
 
+        if self.options.profile_file:
+            self.log.info("Saving profile to %s" % self.options.profile_file)
+            return profile_call(self.run_real, self.options.profile_file,
+                                self.options.profile_format, self.log)
+
         return self.run_real()
 
     def run_real(self):
         self.log.info("Nothing to do.")
         return 0
 
+
+def read_domain_architectures(fname):
+    """Reads the domain architectures of the sequences from the given file,
+    which must be in the output format of ``find_domain_arch.py``: the
+    first tab-separated column contains the sequence ID and the third one
+    the semicolon-separated domain IDs.
+
+    Returns a list of ``(sequence ID, domain architecture)`` pairs in the
+    order of the file, where each domain architecture is a tuple of domain
+    IDs, and the list of unique domain architectures in the order of their
+    first occurrence. Sequences without domains have the architecture
+    ``("NO_ASSIGNMENT", )``, which is not included in the unique ones.
+    """
+    genes, archs = [], {}
+    for line in open_anything(fname):
+        parts = line.strip().split("\t")
+        gene_id, arch = parts[0], tuple(parts[2].split(";"))
+        genes.append((gene_id, arch))
+        if arch != ("NO_ASSIGNMENT", ) and arch not in archs:
+            archs[arch] = len(archs)
+    return genes, sorted(archs, key=archs.__getitem__)
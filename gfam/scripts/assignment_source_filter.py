@@ -6,6 +6,7 @@ import sys
 from collections import defaultdict
 from gfam.assignment import Assignment, AssignmentOverlapChecker, \
                             EValueFilter, SequenceWithAssignments
+from gfam.instrumentation import input_size
 from gfam.interpro import AssignmentReader, InterPro
 from gfam.scripts import CommandLineApp
 from gfam.utils import complementerset, open_anything
@@ -62,6 +63,11 @@ class AssignmentSourceFilterApp(CommandLineApp):
                 help="use the InterPro parent-child FILE to remap IDs",
                 config_key="analysis:iprscan_filter/interpro_parent_child_mapping",
                 default=None)
+        parser.add_option("--interpro-cache", dest="interpro_cache",
+                metavar="FILE",
+                help="cache the parsed InterPro parent-child relationships "
+                     "in FILE to speed up subsequent runs",
+                default=None)
         parser.add_option("-g", "--gene-ids", dest="gene_id_file",
                 metavar="FILE", help="only consider those IDs which "+
                    "are present in the list in the given FILE",
@@ -85,7 +91,8 @@ class AssignmentSourceFilterApp(CommandLineApp):
         if self.options.interpro_file:
             self.log.info("Loading known InterPro IDs from %s..." % \
                     self.options.interpro_file)
-            self.interpro = InterPro.FromFile(self.options.interpro_file)
+            self.interpro = InterPro.FromCachedFile(self.options.interpro_file,
+                    self.options.interpro_cache)
         else:
             self.interpro = InterPro()
 
@@ -122,24 +129,30 @@ class AssignmentSourceFilterApp(CommandLineApp):
 
         current_id, assignments_by_source = None, defaultdict(list)
         valid_ids = self.valid_sequence_ids
+        ignored = self.ignored
         evalue_filter = EValueFilter.FromString(self.options.max_e)
+        thresholds = evalue_filter.compile().thresholds
 
-        reader = AssignmentReader(fname)
+        progress = self.create_progress_reporter("Filtering %s" % fname,
+                total_bytes=input_size(fname))
+        lines = progress.iterate(open_anything(fname), count_bytes=True)
+        reader = AssignmentReader(lines)
         for assignment, line in reader.assignments_and_lines():
             if assignment.id != current_id:
                 self.filter_and_print_assignments(current_id, assignments_by_source)
                 current_id = assignment.id
                 assignments_by_source = defaultdict(list)
 
-            if assignment.source in self.ignored:
+            source, evalue = assignment.source, assignment.evalue
+            if source in ignored:
                 continue
-            if assignment.evalue is not None and \
-                    not evalue_filter.is_acceptable(assignment):
+            if evalue is not None and not evalue <= thresholds[source]:
                 continue
-            assignments_by_source[assignment.source].append((assignment, line))
+            assignments_by_source[source].append((assignment, line))
 
         # ...and the last batch
         self.filter_and_print_assignments(current_id, assignments_by_source)
+        progress.finish()
 
     def filter_assignments(self, name, assignments_by_source):
         """Given a sequence name and its assignments ordered in a dict by
@@ -3,6 +3,7 @@
 import sys
 
 from gfam.blast import BlastFilter
+from gfam.instrumentation import input_size
 from gfam.scripts import CommandLineApp
 from gfam.utils import open_anything
 
@@ -90,8 +91,12 @@ class BlastFilterApp(CommandLineApp):
     def process_file(self, filename, filter):
         """Processes the given file using the given `filter`."""
         self.log.info("Processing %s..." % filename)
-        for line in self.process_lines(open_anything(filename), filter):
+        progress = self.create_progress_reporter("Filtering %s" % filename,
+                total_bytes=input_size(filename))
+        lines = progress.iterate(open_anything(filename), count_bytes=True)
+        for line in self.process_lines(lines, filter):
             sys.stdout.write(line)
+        progress.finish()
 
     def process_lines(self, lines, filter):
         """Processes the lines yielded by the given generator.
@@ -4,6 +4,7 @@
 import sys
 
 from collections import defaultdict, deque
+from gfam.instrumentation import input_size
 from gfam.scripts import CommandLineApp
 from gfam.utils import open_anything, UniqueIdGenerator
 
@@ -75,7 +76,10 @@ class ConnectedComponentAnalysisApp(CommandLineApp):
         idgen = UniqueIdGenerator()
 
         self.log.info("Processing %s..." % filename)
-        for line_no, line in enumerate(open_anything(filename)):
+        progress = self.create_progress_reporter("Reading %s" % filename,
+                total_bytes=input_size(filename))
+        lines = progress.iterate(open_anything(filename), count_bytes=True)
+        for line_no, line in enumerate(lines):
             parts = line.strip().split()
             if not parts:
                 continue
@@ -98,6 +102,7 @@ class ConnectedComponentAnalysisApp(CommandLineApp):
 
             adj_list[id1].add(id2)
             adj_list[id2].add(id1)
+        progress.finish()
 
         names = idgen.values()
 
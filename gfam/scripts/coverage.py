@@ -1,14 +1,16 @@
 #!/usr/bin/env python
 
 import optparse
+import os
 import sys
 
 from collections import defaultdict
 from gfam import fasta
-from gfam.assignment import SequenceWithAssignments
+from gfam.assignment import SequenceWithAssignments, union_lengths
 from gfam.interpro import AssignmentReader
 from gfam.scripts import CommandLineApp
-from gfam.utils import complementerset, open_anything
+from gfam.utils import complementerset, fork_map, open_anything
+from operator import attrgetter
 
 __author__  = "Tamas Nepusz"
 __email__   = "tamas@cs.rhul.ac.uk"
@@ -16,6 +18,39 @@ __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "GPL"
 
 
+def count_covered_residues(seqs):
+    """Counts the residues covered by at least one domain in each of the
+    given sequences (instances of `SequenceWithAssignments`). Returns a list
+    of dicts, one for each sequence, that map the data sources of the
+    sequence to the number of residues covered by that data source. The
+    number of residues covered by any of the data sources is stored with
+    ``None`` as the key.
+
+    The intervals of all the sequences are processed together by
+    `union_lengths()`."""
+    groups, starts, ends, result = [], [], [], []
+    num_groups = 0
+    for seq in seqs:
+        group_of_source = {None: num_groups}
+        for source in seq.data_sources():
+            num_groups += 1
+            group_of_source[source] = num_groups
+        all_group = group_of_source[None]
+        for assignment in seq.assignments:
+            group = group_of_source[assignment.source]
+            groups.extend((group, all_group))
+            starts.extend((assignment.start, assignment.start))
+            ends.extend((assignment.end, assignment.end))
+        num_groups += 1
+        result.append(group_of_source)
+
+    covered = union_lengths(groups, starts, ends, num_groups)
+    for group_of_source in result:
+        for source, group in group_of_source.iteritems():
+            group_of_source[source] = covered[group]
+    return result
+
+
 class SequenceLevelOutputFormatter(object):
     """Output formatter class that prints sequence-level statistics for each
     sequence in the input data file.
@@ -41,11 +76,16 @@ class SequenceLevelOutputFormatter(object):
         self.app = app
 
     def process_assignments(self, seq):
-        for source in seq.data_sources():
-            cov = seq.coverage(sources=[source])
-            print "%s\t%d\t%s\t%d\t%.4f" % (seq.name, len(seq), source, round(len(seq)*cov), cov)
-        cov = seq.coverage()
-        print "%s\t%d\tALL\t%d\t%.4f" % (seq.name, len(seq), round(len(seq)*cov), cov)
+        self.process_batch([seq])
+
+    def process_batch(self, seqs):
+        for seq, covered in zip(seqs, count_covered_residues(seqs)):
+            length = len(seq)
+            for source in seq.data_sources():
+                print "%s\t%d\t%s\t%d\t%.4f" % (seq.name, length, source,
+                        covered[source], covered[source] / float(length))
+            print "%s\t%d\tALL\t%d\t%.4f" % (seq.name, length,
+                    covered[None], covered[None] / float(length))
 
     def finish(self):
         pass
@@ -75,24 +115,42 @@ class GenomeLevelOutputFormatter(object):
         self.total_residues = 0
 
     def process_assignments(self, seq):
-        self.total_residues += len(seq)
-        for source in seq.data_sources():
-            family = tuple(seq.domain_architecture(sources=[source]))
-            self.num_sequences_by_source[source] += 1
-            self.total_covered_by_source[source] += round(len(seq) * seq.coverage(sources=[source]))
-            if family:
-                self.families_by_source[source].add(family)
+        self.process_batch([seq])
+
+    def process_batch(self, seqs):
+        for seq, covered in zip(seqs, count_covered_residues(seqs)):
+            self.total_residues += len(seq)
+
+            # Sort the assignments only once and split the full domain
+            # architecture by data sources
+            family, families = [], defaultdict(list)
+            for assignment in sorted(seq.assignments, key=attrgetter("start")):
+                family.append(assignment.domain)
+                families[assignment.source].append(assignment.domain)
 
-        family = tuple(seq.domain_architecture())
+            for source, source_family in families.iteritems():
+                self.num_sequences_by_source[source] += 1
+                self.total_covered_by_source[source] += covered[source]
+                self.families_by_source[source].add(tuple(source_family))
 
-        self.num_sequences_by_source["ALL"] += 1
-        self.total_covered_by_source["ALL"] += round(len(seq) * seq.coverage())
-        if family:
-            self.families_by_source["ALL"].add(family)
+            family = tuple(family)
+
+            self.num_sequences_by_source["ALL"] += 1
+            self.total_covered_by_source["ALL"] += covered[None]
+            if family:
+                self.families_by_source["ALL"].add(family)
 
     def finish(self):
+        print "Source\t#sequences\t#families\tSequence coverage\tResidue coverage"
+        for row in self.rows():
+            print "%s\t%d\t%d\t%.4f\t%.4f" % row
+
+    def rows(self):
+        """Returns the rows of the output table as tuples containing the
+        name of the data source, the number of sequences, the number of
+        families, the sequence coverage and the residue coverage."""
         sources = set(self.num_sequences_by_source.iterkeys())
-        if self.app.options.sequences_file is not None:
+        if self.app.total_sequence_length is not None:
             total_seqs = len(self.app.valid_sequence_ids)
             total_seq_length = self.app.total_sequence_length
         else:
@@ -102,13 +160,14 @@ class GenomeLevelOutputFormatter(object):
         total_seqs = float(total_seqs)
         total_seq_length = float(total_seq_length)
 
-        print "Source\t#sequences\t#families\tSequence coverage\tResidue coverage"
+        result = []
         for source in sorted(sources):
             num_seqs = self.num_sequences_by_source[source]
             num_families = len(self.families_by_source[source])
-            print "%s\t%d\t%d\t%.4f\t%.4f" % (source, num_seqs, num_families,
+            result.append((source, num_seqs, num_families,
                     self.num_sequences_by_source[source] / total_seqs,
-                    self.total_covered_by_source[source] / total_seq_length)
+                    self.total_covered_by_source[source] / total_seq_length))
+        return result
 
 
 class CoverageApp(CommandLineApp):
@@ -118,10 +177,20 @@ class CoverageApp(CommandLineApp):
     Calculates some coverage statistics in the given InterPro assignment file.
     The output includes one line per sequence with the following information
     in tab-separated columns: sequence ID, sequence length, coverage.
+
+    Genome-level statistics of several genomes can be calculated at once
+    by listing the genomes in a manifest file (see --manifest) or by giving
+    pairs of InterPro assignment files and FASTA files with --pair. In this
+    case, the output is a single table with genome-level statistics where
+    the first column contains the name of the genome. Each FASTA file is
+    read only once, even if it belongs to several genomes.
     """
 
     short_name = "coverage"
 
+    #: Number of sequences passed to the output formatter at once
+    batch_size = 10000
+
     def create_parser(self):
         parser = super(CoverageApp, self).create_parser()
         parser.add_option("-i", "--include", dest="include_sources",
@@ -146,26 +215,69 @@ class CoverageApp(CommandLineApp):
                      "statistics",
                 default=False,
                 config_key="analysis:coverage/print_totals")
+        parser.add_option("-m", "--manifest", dest="manifest_file",
+                metavar="FILE",
+                help="calculate genome-level statistics for the genomes "
+                     "listed in FILE. Each line of FILE must contain the "
+                     "name of a genome, an InterPro assignment file and "
+                     "optionally a FASTA file, separated by tabs. Relative "
+                     "paths are relative to the directory of FILE")
+        parser.add_option("-p", "--pair", dest="pairs", nargs=2,
+                metavar="ASSIGNMENTS SEQUENCES", action="append", default=[],
+                help="calculate genome-level statistics for the genome "
+                     "given by an InterPro assignment file and a FASTA file. "
+                     "May be given multiple times")
+        parser.add_option("-j", "--jobs", dest="num_jobs", metavar="N",
+                default=1, type=int,
+                config_key="analysis:coverage/num_cpu_cores",
+                help="process the genomes given by --manifest or --pair in "
+                     "N parallel processes. Default: %default")
         return parser
 
+    def get_genomes(self):
+        """Returns the list of genomes given by ``--manifest`` and
+        ``--pair``. Each genome is represented by a tuple containing the
+        name of the genome, the name of the InterPro assignment file and
+        the name of the FASTA file (``None`` if not given)."""
+        result = []
+
+        if self.options.manifest_file:
+            base_dir = os.path.dirname(self.options.manifest_file)
+            for line in open_anything(self.options.manifest_file):
+                line = line.strip()
+                if not line or line[0] == "#":
+                    continue
+                parts = line.split("\t")
+                if len(parts) not in (2, 3):
+                    self.error("invalid line in manifest file: %r" % line)
+                files = [os.path.join(base_dir, part) for part in parts[1:]]
+                files.append(None)
+                result.append((parts[0], files[0], files[1]))
+
+        for assignment_file, sequences_file in self.options.pairs:
+            name = os.path.basename(assignment_file)
+            result.append((name, assignment_file, sequences_file))
+
+        return result
+
+    def load_sequences(self, fname):
+        """Loads the sequences from the given FASTA file. Returns the set of
+        sequence IDs (remapped according to ``--seq-id-regexp``) and the
+        total length of the sequences."""
+        self.log.info("Loading sequences from %s..." % fname)
+
+        total_sequence_length = 0
+        valid_sequence_ids = set()
+        parser = fasta.Parser(open_anything(fname))
+        parser = fasta.regexp_remapper(parser, self.options.sequence_id_regexp)
+        for seq in parser:
+            valid_sequence_ids.add(seq.id)
+            total_sequence_length += len(seq.seq)
+        return valid_sequence_ids, total_sequence_length
+
     def run_real(self):
         """Runs the application"""
 
-        # Load valid sequence IDs (if necessary)
-        if self.options.sequences_file:
-            self.log.info("Loading sequences from %s..." % self.options.sequences_file)
-
-            self.total_sequence_length = 0
-            self.valid_sequence_ids = set()
-            parser = fasta.Parser(open_anything(self.options.sequences_file))
-            parser = fasta.regexp_remapper(parser, self.options.sequence_id_regexp)
-            for seq in parser:
-                self.valid_sequence_ids.add(seq.id)
-                self.total_sequence_length += len(seq.seq)
-        else:
-            self.valid_sequence_ids = complementerset()
-            self.total_sequence_length = None
-
         # Find which sources will be allowed
         if not self.options.include_sources:
             self.sources = complementerset()
@@ -177,6 +289,21 @@ class CoverageApp(CommandLineApp):
         else:
             self.log.info("Accepted sources: %s" % ", ".join(self.sources))
 
+        genomes = self.get_genomes()
+        if genomes:
+            if self.args:
+                self.error("input files cannot be given together with "
+                           "--manifest or --pair")
+            return self.process_genomes(genomes)
+
+        # Load valid sequence IDs (if necessary)
+        if self.options.sequences_file:
+            self.valid_sequence_ids, self.total_sequence_length = \
+                    self.load_sequences(self.options.sequences_file)
+        else:
+            self.valid_sequence_ids = complementerset()
+            self.total_sequence_length = None
+
         if not self.args:
             self.args = ["-"]
 
@@ -191,11 +318,49 @@ class CoverageApp(CommandLineApp):
             # Print the results
             self.output_formatter.finish()
 
+    def process_genomes(self, genomes):
+        """Calculates genome-level statistics for each genome in `genomes`
+        and prints them in a single table. `genomes` must be a list
+        returned by `get_genomes()`. The FASTA files and then the genomes
+        are processed in ``--jobs`` parallel processes."""
+        num_jobs = self.options.num_jobs
+
+        sequences_files = sorted(set(sequences_file \
+                for _, _, sequences_file in genomes if sequences_file))
+        self.sequences = dict(zip(sequences_files,
+            fork_map(self.load_sequences, sequences_files, num_jobs)))
+
+        results = fork_map(self.process_genome, genomes, num_jobs)
+
+        print "Genome\tSource\t#sequences\t#families\t"\
+              "Sequence coverage\tResidue coverage"
+        for (name, _, _), rows in zip(genomes, results):
+            for row in rows:
+                print "%s\t%s\t%d\t%d\t%.4f\t%.4f" % ((name, ) + row)
+
+    def process_genome(self, genome):
+        """Calculates the genome-level statistics of a single genome given by
+        a tuple returned by `get_genomes()`. Returns the rows of the table
+        calculated by `GenomeLevelOutputFormatter`."""
+        name, assignment_file, sequences_file = genome
+        self.log.info("Processing genome %s..." % name)
+        if sequences_file:
+            self.valid_sequence_ids, self.total_sequence_length = \
+                    self.sequences[sequences_file]
+        else:
+            self.valid_sequence_ids = complementerset()
+            self.total_sequence_length = None
+
+        self.output_formatter = GenomeLevelOutputFormatter(self)
+        self.process_infile(assignment_file)
+        return self.output_formatter.rows()
+
     def process_infile(self, fname):
         """Processes the given input file `fname`, which must be either a filename
         or a stream. If the filename is ``-``, it is assumed to be the standard
         input."""
         self.log.info("Processing %s..." % fname)
+        self.batch = []
         current_id, assignments = None, []
         valid_ids = self.valid_sequence_ids
         for assignment in AssignmentReader(fname):
@@ -209,16 +374,27 @@ class CoverageApp(CommandLineApp):
                 assignments = list()
             assignments.append(assignment)
         self.process_sequence(current_id, assignments)
+        self.process_batch()
+
+    def process_batch(self):
+        """Passes the sequences collected so far to the output formatter."""
+        if self.batch:
+            self.output_formatter.process_batch(self.batch)
+            self.batch = []
 
     def process_sequence(self, name, assignments):
-        """Processes the given sequence `name` with the given `assignments`."""
+        """Processes the given sequence `name` with the given `assignments`.
+        Sequences are collected and passed to the output formatter in
+        batches of `batch_size` sequences."""
         if not assignments:
             return
 
         seq = SequenceWithAssignments(name, assignments[0].length)
         for assignment in assignments:
             seq.assign(assignment, overlap_check=False)
-        self.output_formatter.process_assignments(seq)
+        self.batch.append(seq)
+        if len(self.batch) >= self.batch_size:
+            self.process_batch()
 
 
 if __name__ == "__main__":
@@ -5,20 +5,103 @@ outputs them in a simple text-based format.
 
 from collections import defaultdict
 
+import marshal
 import operator
 import optparse
+import os
 import sys
 
-from gfam.assignment import AssignmentOverlapChecker, SequenceWithAssignments
-from gfam.interpro import InterPro, InterProNames
+from gfam.assignment import Assignment, AssignmentOverlapChecker, \
+                            CompactSequenceWithAssignments, \
+                            SequenceWithAssignments
+from gfam.interpro import AssignmentReader, InterPro, InterProNames
 from gfam.scripts import CommandLineApp
-from gfam.utils import complementerset, redirected
+from gfam.utils import complementerset, external_sort, open_anything
+from itertools import groupby
+from tempfile import TemporaryFile
 
 __author__  = "Tamas Nepusz"
 __email__   = "tamas@cs.rhul.ac.uk"
 __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "GPL"
 
+
+def exclude_novel_domains(domain_architecture):
+    """Excludes novel domains from a domain architecture and returns
+    the filtered domain architecture as a tuple."""
+    return tuple(a for a in domain_architecture if not a.startswith("NOVEL"))
+
+
+class DomainArchitectureStats(object):
+    """Genome-level statistics about the domain architectures of the
+    sequences, collected one sequence and one family at a time."""
+
+    def __init__(self):
+        self.num_seqs = 0
+        self.total_residues = 0.0
+        self.covered_residues = 0
+        self.covered_residues_nonnovel = 0
+        self.num_archs = 0
+        self.archs_without_novel = set()
+        self.num_seqs_with_nonempty_domain_arch = 0
+        self.num_seqs_with_nonempty_domain_arch_ignore_novel = 0
+        self.num_seqs_with_nonempty_nonnovel_domain_arch = 0
+        self.nonnovel_sources = complementerset(["Novel"])
+
+    def add_sequence(self, seq):
+        """Adds the residues of the given sequence to the statistics."""
+        self.num_seqs += 1
+        self.total_residues += seq.length
+        self.covered_residues += round(seq.coverage() * seq.length)
+        self.covered_residues_nonnovel += \
+                round(seq.coverage(sources=self.nonnovel_sources) * seq.length)
+
+    def add_family(self, domain_arch, family_length):
+        """Adds a family with the given domain architecture and number of
+        members to the statistics."""
+        self.num_archs += 1
+        arch_without_novel = exclude_novel_domains(domain_arch)
+        if arch_without_novel:
+            self.archs_without_novel.add(arch_without_novel)
+            self.num_seqs_with_nonempty_domain_arch_ignore_novel += \
+                    family_length
+        if domain_arch:
+            self.num_seqs_with_nonempty_domain_arch += family_length
+            if not any(a.startswith("NOVEL") for a in domain_arch):
+                self.num_seqs_with_nonempty_nonnovel_domain_arch += \
+                        family_length
+
+    def write(self, fp):
+        """Writes the statistics into the given file."""
+        num_seqs, total_residues = self.num_seqs, self.total_residues
+        print >>fp, "Domain architectures"
+        print >>fp, "===================="
+        print >>fp, ""
+        print >>fp, "Non-empty: %d" % self.num_archs
+        print >>fp, "Non-empty (when ignoring novel domains): %d" % len(self.archs_without_novel)
+        print >>fp, ""
+        print >>fp, "Sequences"
+        print >>fp, "========="
+        print >>fp, ""
+        print >>fp, "Total: %d" % num_seqs
+        print >>fp, "With at least one domain: %d (%.4f%%)" %\
+                (self.num_seqs_with_nonempty_domain_arch,
+                 100.0 * self.num_seqs_with_nonempty_domain_arch / num_seqs)
+        print >>fp, "With at least one non-novel domain: %d (%.4f%%)" %\
+                (self.num_seqs_with_nonempty_domain_arch_ignore_novel,
+                 100.0 * self.num_seqs_with_nonempty_domain_arch_ignore_novel / num_seqs)
+        print >>fp, "With at least one domain and no novel domains: %d (%.4f%%)" %\
+                (self.num_seqs_with_nonempty_nonnovel_domain_arch,
+                 100.0 * self.num_seqs_with_nonempty_nonnovel_domain_arch / num_seqs)
+        print >>fp, ""
+        print >>fp, "Residues"
+        print >>fp, "========"
+        print >>fp, ""
+        print >>fp, "Total: %d" % total_residues
+        print >>fp, "Covered: %d (%.4f%%)" % (self.covered_residues, 100.0*self.covered_residues/total_residues)
+        print >>fp, "Covered by non-novel: %d (%.4f%%)" % (self.covered_residues_nonnovel, 100.0*self.covered_residues_nonnovel/total_residues)
+
+
 class FindDomainArchitectureApp(CommandLineApp):
     """\
     Usage: %prog [options] interpro_file clustering_file
@@ -52,6 +135,11 @@ class FindDomainArchitectureApp(CommandLineApp):
                 help="use the InterPro parent-child FILE to remap IDs",
                 config_key="file.mapping.interpro_parent_child",
                 default=None)
+        parser.add_option("--interpro-cache", dest="interpro_cache",
+                metavar="FILE",
+                help="cache the parsed InterPro parent-child relationships "
+                     "in FILE to speed up subsequent runs",
+                default=None)
         parser.add_option("--details",
                 dest="details", metavar="FILE",
                 help="print more details about the domain architecture into FILE",
@@ -77,6 +165,19 @@ class FindDomainArchitectureApp(CommandLineApp):
                      "assignments of the same data source. Default: %default",
                 config_key="max_overlap",
                 dest="max_overlap", type=int, default=20)
+        parser.add_option("--sort-buffer-size", metavar="N",
+                help="group the sequences by their domain architectures "
+                     "with an external merge sort that writes the "
+                     "assignments, the sequences and the families into "
+                     "sorted runs of at most N records each. Zero groups "
+                     "them in memory. Default: %default",
+                config_key="sort_buffer_size",
+                dest="sort_buffer_size", type=int, default=0)
+        parser.add_option("--temporary-dir", dest="temporary_dir",
+                help="uses PATH as a temporary directory for the external "
+                     "merge sort. When omitted, the default temporary "
+                     "directory of the system is used",
+                metavar="PATH")
         return parser
 
     def run_real(self):
@@ -89,7 +190,9 @@ class FindDomainArchitectureApp(CommandLineApp):
         if self.options.interpro_parent_child_file:
             self.log.info("Loading InterPro parent-child assignments from %s..." % \
                     self.options.interpro_parent_child_file)
-            self.interpro = InterPro.FromFile(self.options.interpro_parent_child_file)
+            self.interpro = InterPro.FromCachedFile(
+                    self.options.interpro_parent_child_file,
+                    self.options.interpro_cache)
         else:
             self.interpro = InterPro()
 
@@ -101,8 +204,39 @@ class FindDomainArchitectureApp(CommandLineApp):
             self.details_file = None
 
         interpro_file, clustering_file = self.args
-        self.process_interpro_file(interpro_file)
-        self.process_clustering_file(clustering_file)
+        if self.options.sort_buffer_size > 0:
+            stats = self.print_domain_archs_external(interpro_file,
+                                                     clustering_file)
+        else:
+            self.process_interpro_file(interpro_file)
+            self.process_clustering_file(clustering_file)
+            stats = self.print_domain_archs()
+
+        if self.details_file:
+            self.details_file.close()
+
+        if self.options.stats:
+            stats_file = open(self.options.stats, "w")
+            stats.write(stats_file)
+            stats_file.close()
+
+    def format_domain_arch(self, seq, domain_arch):
+        """Returns the domain architecture of the given sequence as a string,
+        the positions of the domains and the names of the domains, as they
+        appear in the output."""
+        if not domain_arch:
+            return "NO_ASSIGNMENT", "NO_ASSIGNMENT", "NO_DESCRIPTION"
+        arch_str_pos = ";".join(assignment.short_repr() \
+                for assignment in seq.assignments)
+        arch_desc = ";".join(self.interpro_names[assignment.domain]
+                for assignment in seq.assignments)
+        return ";".join(domain_arch), arch_str_pos, arch_desc
+
+    def print_domain_archs(self):
+        """Groups the sequences by their domain architectures in memory and
+        prints them, the largest family first. Returns the statistics of the
+        domain architectures in a `DomainArchitectureStats` object if they
+        were requested, ``None`` otherwise."""
         self.sort_by_domain_architecture()
 
         for seqs in self.domain_archs.itervalues():
@@ -112,93 +246,85 @@ class FindDomainArchitectureApp(CommandLineApp):
         self.domain_archs.sort(key=lambda x: len(x[1]), reverse=True)
 
         for domain_arch, members in self.domain_archs:
-            if domain_arch:
-                arch_str = ";".join(domain_arch)
-            else:
-                arch_str = "NO_ASSIGNMENT"
-                arch_str_pos = "NO_ASSIGNMENT"
-                arch_desc = "NO_DESCRIPTION"
-
             family_length = len(members)
             for member in members:
                 seq = self.seqcat[member]
-                if domain_arch:
-                    arch_str_pos = ";".join(assignment.short_repr() \
-                            for assignment in seq.assignments)
-                    arch_desc = ";".join( \
-                            self.interpro_names[assignment.domain]
-                            for assignment in seq.assignments
-                    )
+                arch_str, arch_str_pos, arch_desc = \
+                        self.format_domain_arch(seq, domain_arch)
                 print "%s\t%d\t%s\t%d\t%s\t%s" % (member, seq.length, arch_str, \
                                               family_length, arch_str_pos, \
                                               arch_desc)
 
-        self.details_file.close()
+        if not self.options.stats:
+            return None
 
+        stats = DomainArchitectureStats()
+        for seq in self.seqcat.itervalues():
+            stats.add_sequence(seq)
+        for domain_arch, members in self.domain_archs:
+            stats.add_family(domain_arch, len(members))
+        return stats
+
+    def print_domain_archs_external(self, interpro_file, clustering_file):
+        """Same as `print_domain_archs`, but sorts the records in runs of
+        at most ``--sort-buffer-size`` records on the disk.
+
+        The sequences are built one by one by `iter_sequences_external`, and
+        their output records are sorted by domain architecture with an
+        external merge sort. The merged records are written family by family
+        into a temporary file, then the families are sorted by size the same
+        way and printed from that file. Families of the same size are printed
+        in the order of their domain architectures, and the details file
+        lists the sequences in the order of their IDs.
+        """
+        buffer_size = self.options.sort_buffer_size
+        tmp_dir = self.options.temporary_dir
         if self.options.stats:
-            stats_file = open(self.options.stats, "w")
-
-            total_residues, covered_residues, covered_residues_nonnovel = 0.0, 0, 0
-            nonnovel_sources = complementerset(["Novel"])
-
-            for seq in self.seqcat.itervalues():
-                total_residues += seq.length
-                covered_residues += round(seq.coverage() * seq.length)
-                covered_residues_nonnovel += round(seq.coverage(sources=nonnovel_sources) * seq.length)
-
-            all_archs = set(arch for arch, _ in self.domain_archs)
-            num_archs = len(all_archs)
-            if "" in self.domain_archs:
-                num_archs -= 1
-
-            def exclude_novel_domains(domain_architecture):
-                """Excludes novel domains from a domain architecture and returns
-                the filtered domain architecture as a tuple."""
-                return tuple(a for a in domain_architecture if not a.startswith("NOVEL"))
-
-            archs_without_novel = set(exclude_novel_domains(arch)
-                    for arch in all_archs)
-            archs_without_novel.discard(())
-            num_archs_without_novel = len(archs_without_novel)
-
-            num_seqs_with_nonempty_domain_arch = \
-                    sum(len(value) for key, value in self.domain_archs if key)
-            num_seqs_with_nonempty_domain_arch_ignore_novel = \
-                    sum(len(value) for key, value in self.domain_archs
-                        if exclude_novel_domains(key) in archs_without_novel)
-            num_seqs_with_nonempty_nonnovel_domain_arch = \
-                    sum(len(value) for key, value in self.domain_archs
-                            if key and not any(a.startswith("NOVEL") for a in key))
-
-            with redirected(stdout=stats_file):
-                print "Domain architectures"
-                print "===================="
-                print ""
-                print "Non-empty: %d" % num_archs
-                print "Non-empty (when ignoring novel domains): %d" % num_archs_without_novel
-                print ""
-                print "Sequences"
-                print "========="
-                print ""
-                print "Total: %d" % len(self.seqcat)
-                print "With at least one domain: %d (%.4f%%)" %\
-                        (num_seqs_with_nonempty_domain_arch,
-                         100.0 * num_seqs_with_nonempty_domain_arch / len(self.seqcat))
-                print "With at least one non-novel domain: %d (%.4f%%)" %\
-                        (num_seqs_with_nonempty_domain_arch_ignore_novel,
-                         100.0 * num_seqs_with_nonempty_domain_arch_ignore_novel / len(self.seqcat))
-                print "With at least one domain and no novel domains: %d (%.4f%%)" %\
-                        (num_seqs_with_nonempty_nonnovel_domain_arch,
-                         100.0 * num_seqs_with_nonempty_nonnovel_domain_arch / len(self.seqcat))
-                print ""
-                print "Residues"
-                print "========"
-                print ""
-                print "Total: %d" % total_residues
-                print "Covered: %d (%.4f%%)" % (covered_residues, 100.0*covered_residues/total_residues)
-                print "Covered by non-novel: %d (%.4f%%)" % (covered_residues_nonnovel, 100.0*covered_residues_nonnovel/total_residues)
-            stats_file.close()
-
+            stats = DomainArchitectureStats()
+        else:
+            stats = None
+
+        def records():
+            for seq in self.iter_sequences_external(interpro_file,
+                                                    clustering_file):
+                domain_arch = self.resolve_domain_architecture(seq.name, seq)
+                if stats is not None:
+                    stats.add_sequence(seq)
+                yield (domain_arch, seq.name, seq.length) + \
+                      self.format_domain_arch(seq, domain_arch)
+
+        if tmp_dir and not os.path.isdir(tmp_dir):
+            os.makedirs(tmp_dir)
+        families = TemporaryFile(dir=tmp_dir)
+
+        def family_index():
+            dump = marshal.dump
+            sorted_records = external_sort(records(), buffer_size, tmp_dir)
+            for domain_arch, members in groupby(sorted_records,
+                                                operator.itemgetter(0)):
+                offset, family_length = families.tell(), 0
+                for record in members:
+                    dump(record[1:], families)
+                    family_length += 1
+                if stats is not None:
+                    stats.add_family(domain_arch, family_length)
+                yield -family_length, domain_arch, offset
+
+        try:
+            load = marshal.load
+            for family_length, _, offset in external_sort(family_index(),
+                    buffer_size, tmp_dir):
+                family_length = -family_length
+                families.seek(offset)
+                for _ in xrange(family_length):
+                    member, length, arch_str, arch_str_pos, arch_desc = \
+                            load(families)
+                    print "%s\t%d\t%s\t%d\t%s\t%s" % (member, length, \
+                            arch_str, family_length, arch_str_pos, arch_desc)
+        finally:
+            families.close()
+
+        return stats
 
     def process_interpro_file(self, interpro_file):
         from gfam.scripts.find_unassigned import FindUnassignedApp
@@ -211,8 +337,65 @@ class FindDomainArchitectureApp(CommandLineApp):
             self.seqcat[seq_id] = SequenceWithAssignments(seq_id, \
                                   unassigned_app.seq_ids_to_length[seq_id])
 
-    def process_clustering_file(self, fname):
-        f = open(fname)
+    def iter_sequences_external(self, interpro_file, clustering_file):
+        """Generator that yields the sequences with their InterPro and novel
+        domain assignments one by one, in the order of their IDs, without
+        loading all of them into memory.
+
+        The assignments in the InterPro file are sorted by sequence ID with
+        `external_sort` (keeping their original order within a sequence), so
+        each sequence can be built from a consecutive run of assignments.
+        Only the lengths of the sequences and the novel domains are kept in
+        memory.
+        """
+        from gfam.scripts.find_unassigned import FindUnassignedApp
+        unassigned_app = FindUnassignedApp()
+        unassigned_app.set_sequence_id_regexp(self.options.sequence_id_regexp)
+        unassigned_app.process_sequences_file(self.options.sequences_file)
+        seq_ids_to_length = unassigned_app.seq_ids_to_length
+
+        novel_domains = defaultdict(list)
+        for seq_id, start, end, domain_name in \
+                self.iter_clustering_file(clustering_file):
+            novel_domains[seq_id].append((start, end, domain_name))
+
+        def add_novel_domains(seq):
+            for start, end, domain_name in novel_domains.pop(seq.name, ()):
+                seq.assign_(start, end, domain_name)
+            return seq
+
+        self.log.info("Processing input file: %s" % interpro_file)
+        records = ((assignment.id, index, tuple(assignment))
+                   for index, assignment in
+                   enumerate(AssignmentReader(interpro_file)))
+        records = external_sort(records, self.options.sort_buffer_size,
+                                self.options.temporary_dir)
+        for seq_id, items in groupby(records, operator.itemgetter(0)):
+            seq = None
+            for _, _, fields in items:
+                assignment = Assignment._make(fields)
+                if seq is None:
+                    seq = CompactSequenceWithAssignments(seq_id,
+                                                         assignment.length)
+                if seq.length != assignment.length:
+                    raise ValueError, "different lengths encountered for %s: %d and %d" % (seq.name, seq.length, assignment.length)
+                seq.assign(assignment)
+            seq_ids_to_length.pop(seq_id, None)
+            yield add_novel_domains(seq)
+
+        for seq_id in sorted(seq_ids_to_length):
+            seq = SequenceWithAssignments(seq_id, seq_ids_to_length[seq_id])
+            yield add_novel_domains(seq)
+
+        if novel_domains:
+            raise KeyError(min(novel_domains))
+
+    def iter_clustering_file(self, fname):
+        """Generator that yields the novel domains found in the given
+        clustering file as tuples containing the sequence ID, the starting
+        and ending positions and the name of the novel domain. Clusters
+        smaller than ``--min-size`` are skipped."""
+        f = open_anything(fname)
         idx = 1
         for line in f:
             ids = line.strip().split()
@@ -223,72 +406,84 @@ class FindDomainArchitectureApp(CommandLineApp):
             for id in ids:
                 seq_id, _, limits = id.rpartition(":")
                 start, end = map(int, limits.split("-"))
-                self.seqcat[seq_id].assign_(start, end, domain_name)
+                yield seq_id, start, end, domain_name
         f.close()
 
+    def process_clustering_file(self, fname):
+        for seq_id, start, end, domain_name in self.iter_clustering_file(fname):
+            self.seqcat[seq_id].assign_(start, end, domain_name)
+
     def sort_by_domain_architecture(self):
         self.domain_archs = defaultdict(list)
         for seq_id, seq in self.seqcat.iteritems():
-            assignments = sorted(seq.assignments, key=operator.attrgetter("start"))
-            domains = []
-            if self.details_file:
-                print >>self.details_file, seq_id
-
-            primary_source = set()
-
-            new_assignments = []
+            domain_arch = self.resolve_domain_architecture(seq_id, seq)
+            self.domain_archs[domain_arch].append(seq_id)
+
+    def resolve_domain_architecture(self, seq_id, seq):
+        """Sorts the assignments of the given sequence by their starting
+        positions, resolves their InterPro IDs, prints the details of the
+        sequence into the details file and returns the domain architecture
+        of the sequence as a tuple."""
+        assignments = sorted(seq.assignments, key=operator.attrgetter("start"))
+        domains = []
+        if self.details_file:
+            print >>self.details_file, seq_id
+
+        primary_source = set()
+
+        new_assignments = []
+        for assignment in assignments:
+            new_assignment = assignment.resolve_interpro_ids(self.interpro)
+            if assignment.comment == "1":
+                primary_source.add(assignment.source)
+            domains.append(new_assignment.domain)
+            new_assignments.append(new_assignment)
+
+        if not primary_source:
+            primary_source = None
+        else:
+            primary_source = ", ".join(primary_source)
+
+        if self.details_file:
+            seq2 = SequenceWithAssignments(seq.name, seq.length)
+            seq2.assignments = [assignment for assignment in assignments \
+                                if assignment.source != "Novel"]
+            sources = sorted(set(assignment.source \
+                    for assignment in assignments \
+                    if assignment.source != "Novel"))
+
+            print >>self.details_file, "    Primary assignment source:", primary_source
+            print >>self.details_file, "    Number of data sources used:", len(sources)
+            print >>self.details_file, "    Data sources: %s" % ", ".join(sources)
+            print >>self.details_file, "    Coverage: %.3f" % seq.coverage()
+            print >>self.details_file, "    Coverage w/o novel domains: %.3f" % seq2.coverage()
             for assignment in assignments:
-                new_assignment = assignment.resolve_interpro_ids(self.interpro)
-                if assignment.comment == "1":
-                    primary_source.add(assignment.source)
-                domains.append(new_assignment.domain)
-                new_assignments.append(new_assignment)
-            self.domain_archs[tuple(domains)].append(seq_id)
-
-            if not primary_source:
-                primary_source = None
-            else:
-                primary_source = ", ".join(primary_source)
-
-            if self.details_file:
-                seq2 = SequenceWithAssignments(seq.name, seq.length)
-                seq2.assignments = [assignment for assignment in assignments \
-                                    if assignment.source != "Novel"]
-                sources = sorted(set(assignment.source \
-                        for assignment in assignments \
-                        if assignment.source != "Novel"))
-
-                print >>self.details_file, "    Primary assignment source:", primary_source
-                print >>self.details_file, "    Number of data sources used:", len(sources)
-                print >>self.details_file, "    Data sources: %s" % ", ".join(sources)
-                print >>self.details_file, "    Coverage: %.3f" % seq.coverage()
-                print >>self.details_file, "    Coverage w/o novel domains: %.3f" % seq2.coverage()
-                for assignment in assignments:
-                    attrs = assignment._asdict()
-                    if assignment.comment is None and \
-                       assignment.domain.startswith("NOVEL"):
-                        attrs["comment"] = "novel"
-                    row = "    %(start)4d-%(end)4d: %(domain)s "\
-                          "(%(source)s, stage: %(comment)s)" % attrs
-                    print >>self.details_file, row,
-                    interpro_id = assignment.interpro_id
-                    if not interpro_id and assignment.domain in self.interpro.mapping:
-                        interpro_id = self.interpro.mapping[assignment.domain]
-                    if interpro_id:
-                        anc = self.interpro.tree.get_most_remote_ancestor(interpro_id)
-                        if interpro_id == anc:
-                            print >>self.details_file, "(InterPro ID: %s)" % anc
-                        else:
-                            print >>self.details_file, "(InterPro ID: %s --> %s)" % (interpro_id, anc)
-                        if anc in self.interpro_names:
-                            print >>self.details_file, " "*(row.index(":")+1), self.interpro_names[anc]
+                attrs = assignment._asdict()
+                if assignment.comment is None and \
+                   assignment.domain.startswith("NOVEL"):
+                    attrs["comment"] = "novel"
+                row = "    %(start)4d-%(end)4d: %(domain)s "\
+                      "(%(source)s, stage: %(comment)s)" % attrs
+                print >>self.details_file, row,
+                interpro_id = assignment.interpro_id
+                if not interpro_id and assignment.domain in self.interpro.mapping:
+                    interpro_id = self.interpro.mapping[assignment.domain]
+                if interpro_id:
+                    anc = self.interpro.tree.get_most_remote_ancestor(interpro_id)
+                    if interpro_id == anc:
+                        print >>self.details_file, "(InterPro ID: %s)" % anc
                     else:
-                        print >>self.details_file, ""
-                        if assignment.domain in self.interpro_names:
-                            print >>self.details_file, " "*(row.index(":")+1), self.interpro_names[assignment.domain]
-                print >>self.details_file, ""
-
-            seq.assignments = new_assignments
+                        print >>self.details_file, "(InterPro ID: %s --> %s)" % (interpro_id, anc)
+                    if anc in self.interpro_names:
+                        print >>self.details_file, " "*(row.index(":")+1), self.interpro_names[anc]
+                else:
+                    print >>self.details_file, ""
+                    if assignment.domain in self.interpro_names:
+                        print >>self.details_file, " "*(row.index(":")+1), self.interpro_names[assignment.domain]
+            print >>self.details_file, ""
+
+        seq.assignments = new_assignments
+        return tuple(domains)
 
 if __name__ == "__main__":
     sys.exit(FindDomainArchitectureApp().run())
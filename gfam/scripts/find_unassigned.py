@@ -11,7 +11,8 @@ import sys
 from gfam import fasta
 from gfam.interpro import AssignmentReader
 from gfam.scripts import CommandLineApp
-from gfam.assignment import AssignmentOverlapChecker, SequenceWithAssignments
+from gfam.assignment import AssignmentOverlapChecker, \
+        CompactSequenceWithAssignments
 from gfam.utils import open_anything
 
 __authors__  = "Tamas Nepusz, Alfonso E. Romero"
@@ -102,7 +103,8 @@ class FindUnassignedApp(CommandLineApp):
             try:
                 seq = self.seqcat[assignment.id]
             except KeyError:
-                seq = SequenceWithAssignments(assignment.id, assignment.length)
+                seq = CompactSequenceWithAssignments(assignment.id,
+                                                     assignment.length)
                 self.seqcat[assignment.id] = seq
             if seq.length != assignment.length:
                 raise ValueError, "different lengths encountered for %s: %d and %d" % (seq.name, seq.length, assignment.length)
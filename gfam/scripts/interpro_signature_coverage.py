@@ -34,6 +34,11 @@ class InterProCoverageApp(CommandLineApp):
                 help="use the given InterPro parent-child FILE",
                 config_key="file.mapping.interpro_parent_child",
                 default=None)
+        parser.add_option("--interpro-cache", dest="interpro_cache",
+                metavar="FILE",
+                help="cache the parsed InterPro parent-child relationships "
+                     "in FILE to speed up subsequent runs",
+                default=None)
         return parser
 
     def run_real(self):
@@ -42,7 +47,8 @@ class InterProCoverageApp(CommandLineApp):
             self.parser.error("must specify the InterPro parent-child "
                               "file using -i")
 
-        self.interpro = InterPro.FromFile(self.options.parent_child_file)
+        self.interpro = InterPro.FromCachedFile(self.options.parent_child_file,
+                                                self.options.interpro_cache)
 
         if not self.args:
             self.args = ["-"]
@@ -3,6 +3,7 @@
 import sys
 
 from collections import defaultdict
+from gfam.instrumentation import input_size
 from gfam.scripts import CommandLineApp
 from gfam.utils import open_anything
 
@@ -56,7 +57,9 @@ class JaccardSimilarityApp(CommandLineApp):
     def process_file(self, filename):
         """Processes the input file with the given filename"""
         self.log.info("Processing %s..." % filename)
-        infile = open_anything(filename)
+        progress = self.create_progress_reporter("Reading %s" % filename,
+                total_bytes=input_size(filename))
+        infile = progress.iterate(open_anything(filename), count_bytes=True)
         neis = defaultdict(set)
         for line_no, line in enumerate(infile):
             parts = line.strip().split()
@@ -66,6 +69,7 @@ class JaccardSimilarityApp(CommandLineApp):
                 raise ValueError("line %d contains only a single ID" % line_no)
             neis[parts[0]].add(parts[1])
             neis[parts[1]].add(parts[0])
+        progress.finish()
 
         if self.options.add_loops:
             for k, v in neis.iteritems():
@@ -73,7 +77,10 @@ class JaccardSimilarityApp(CommandLineApp):
 
         all_ids = sorted(neis.keys())
         lens = dict((id, len(neis1)) for id, neis1 in enumerate(neis))
+        progress = self.create_progress_reporter("Calculating similarities",
+                total_records=len(all_ids), check_every=100)
         for id1 in all_ids:
+            progress.update()
             neis1 = neis[id1]
             len1 = float(len(neis1))
             if self.options.only_linked:
@@ -89,6 +96,7 @@ class JaccardSimilarityApp(CommandLineApp):
                 if sim < self.options.min_similarity:
                     continue
                 print "%s\t%s\t%.8f" % (id1, id2, sim)
+        progress.finish()
 
 
 if __name__ == "__main__":
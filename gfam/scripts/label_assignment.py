@@ -7,8 +7,7 @@ import sys
 from collections import defaultdict
 from gfam.go import Tree as GOTree
 from gfam.interpro import InterPro2GOMapping
-from gfam.scripts import CommandLineApp
-from gfam.utils import open_anything
+from gfam.scripts import CommandLineApp, read_domain_architectures
 
 __author__  = "Tamas Nepusz"
 __email__   = "tamas@cs.rhul.ac.uk"
@@ -41,6 +40,16 @@ class LabelAssignmentApp(CommandLineApp):
         super(LabelAssignmentApp, self).__init__(*args, **kwds)
         self.go_tree = None
 
+    def create_parser(self):
+        """Creates the command line parser for this application"""
+        parser = super(LabelAssignmentApp, self).create_parser()
+        parser.add_option("-j", "--jobs", dest="num_jobs", metavar="N",
+                default=1, type=int,
+                config_key="analysis:label_assignment/num_cpu_cores",
+                help="process the unique domain architectures in N parallel "
+                     "processes. Default: %default")
+        return parser
+
     def run_real(self):
         """Runs the label assignment application"""
         if len(self.args) != 3:
@@ -63,15 +72,22 @@ class LabelAssignmentApp(CommandLineApp):
         """Processes the given input file that contains the domain
         architectures."""
 
-        cache = {}
-
         num_no_annotations = 0
         num_no_domains = 0
         total_seqs = 0
 
-        for line in open_anything(input_file):
-            parts = line.strip().split("\t")
-            gene_id, arch = parts[0], tuple(parts[2].split(";"))
+        # First pass: collect the unique domain architectures
+        genes, unique_archs = read_domain_architectures(input_file)
+
+        # Assign labels to the unique architectures
+        if self.options.num_jobs > 1:
+            labels = self.assign_labels_parallel(unique_archs)
+        else:
+            labels = [self.assign_labels(arch) for arch in unique_archs]
+        labels = dict(zip(unique_archs, labels))
+
+        # Second pass: print the results in the order of the input file
+        for gene_id, arch in genes:
             total_seqs += 1
 
             if arch == ("NO_ASSIGNMENT", ):
@@ -79,22 +95,12 @@ class LabelAssignmentApp(CommandLineApp):
                 num_no_annotations += 1
                 continue
 
-            if arch not in cache:
-                all_terms = set()
-                for domain in arch:
-                    all_terms.update(self.go_mapping.get_left(domain, []))
-                for path in self.go_tree.paths_to_root(*list(all_terms)):
-                    all_terms.difference_update(path[1:])
-                all_terms = sorted(all_terms, key =
-                        lambda x: len(self.go_mapping.get_right(x, [])))
-                cache[arch] = all_terms
-
             print gene_id
-            for term in cache[arch]:
+            for term in labels[arch]:
                 print "  %s (%s)" % (term.id, term.name)
             print
 
-            if len(cache[arch]) == 0:
+            if len(labels[arch]) == 0:
                 num_no_annotations += 1
 
         self.log.info("Total number of sequences processed: %d" % total_seqs)
@@ -105,5 +111,35 @@ class LabelAssignmentApp(CommandLineApp):
             self.log.info("%d sequences have no domains at all :(" % num_no_domains)
 
 
+    def assign_labels(self, arch):
+        """Returns the list of GO terms assigned to the given domain
+        architecture, sorted by the number of domains they annotate."""
+        all_terms = set()
+        for domain in arch:
+            all_terms.update(self.go_mapping.get_left(domain, []))
+        for path in self.go_tree.paths_to_root(*list(all_terms)):
+            all_terms.difference_update(path[1:])
+        return sorted(all_terms, key =
+                lambda x: len(self.go_mapping.get_right(x, [])))
+
+    def assign_labels_parallel(self, archs):
+        """Calls `assign_labels` for each of the given domain architectures
+        in parallel processes. The worker processes inherit the GO tree and
+        the mapping from this process, so only the architectures and the IDs
+        of the assigned terms have to be passed between the processes."""
+        def process_chunk(chunk):
+            """Assigns labels to a chunk of architectures in a worker"""
+            return [[term.id for term in self.assign_labels(arch)]
+                    for arch in chunk]
+
+        result = []
+        lookup = self.go_tree.lookup
+        for chunk_result in self.fork_map_chunks(process_chunk, archs,
+                                                 self.options.num_jobs):
+            for term_ids in chunk_result:
+                result.append([lookup(term_id) for term_id in term_ids])
+        return result
+
+
 if __name__ == "__main__":
     sys.exit(LabelAssignmentApp().run())
@@ -21,15 +21,21 @@ import os
 import shutil
 import sys
 import textwrap
+import time
 
 from ConfigParser import ConfigParser
 from cStringIO import StringIO
 from functools import wraps
 from gfam.modula.hash import sha1
 from gfam.modula.module import CalculationModule
+from gfam.bgzf import BlockGzipWriter, index_filename
+from gfam.instrumentation import CountingWriter, format_bytes, \
+                                 format_duration, is_profiling, \
+                                 load_reports, Measurement, print_table, \
+                                 RunReport, summarize_reports
 from gfam.modula.storage import DiskStorageEngine, NotFoundError
 from gfam.scripts import CommandLineApp
-from gfam.utils import redirected
+from gfam.utils import open_anything, redirected
 
 __author__  = "Tamas Nepusz"
 __email__   = "tamas@cs.rhul.ac.uk"
@@ -41,12 +47,29 @@ __all__ = ["GFamMasterScript"]
 class GFamCalculation(CalculationModule):
     """Class representing a GFam calculation step. This is a subclass of
     `modula.CalcuationModule`_ and it assumes that the name of the module
-    refers to a valid Python module in `gfam.scripts`_."""
+    refers to a valid Python module in `gfam.scripts`_.
+
+    If `run_report` is not ``None``, the resource usage of the calculation
+    and the sizes of its input and output files are added to it when the
+    calculation finishes.
+
+    If the name of the module is listed in ``profile_modules`` in the
+    ``@global`` section of the Modula configuration, the calculation is
+    profiled and the profile is saved into the ``_profiles`` subfolder of
+    the storage folder in the format given by ``profile_format``. This is
+    skipped when the master script itself is being profiled, since the
+    profilers cannot be nested.
+    """
+
+    #: The `gfam.instrumentation.RunReport` that collects the measurements
+    #: of the calculations, or ``None`` if no measurements are needed
+    run_report = None
 
     def run(self):
         """Runs the calculation"""
         self.logger.info("Starting module %s" % self.name)
 
+        measurement = Measurement()
         self.prepare()
 
         # Search for the CommandLineApp object in the module
@@ -62,25 +85,43 @@ class GFamCalculation(CalculationModule):
         # Create the application
         app = app[0](logger=self.logger)
         args = ["-c", self.config.get("@global.config_file")]
+        inputs = []
 
         for param, value in self.parameters.iteritems():
             if not param.startswith("switch."):
                 continue
             switch, value = value.split(" ", 1)
-            value = modula.storage_engine.get_filename(value.strip())
-            args.extend([switch, value])
+            value = value.strip()
+            fname = modula.storage_engine.get_filename(value)
+            args.extend([switch, fname])
+            if value != self.name:
+                inputs.append((value, fname))
 
         if "infile" in self.parameters:
             infiles = self.parameters["infile"].split(",")
             for infile in infiles:
-                infile = modula.storage_engine.get_filename(infile.strip())
-                args.append(infile)
+                infile = infile.strip()
+                fname = modula.storage_engine.get_filename(infile)
+                args.append(fname)
+                inputs.append((infile, fname))
 
         if "stdin" in self.parameters:
-            stdin = modula.storage_engine.get_source(self.parameters["stdin"])
+            source = self.parameters["stdin"].strip()
+            stdin = modula.storage_engine.get_source(source)
+            inputs.append((source,
+                           modula.storage_engine.get_filename(source)))
         else:
             stdin = None
 
+        profile_file = self.get_profile_filename()
+        if profile_file is not None:
+            self.logger.info("Profiling module %s, saving profile to %s" %
+                             (self.name, profile_file))
+            args.extend(["--profile", profile_file])
+            if "@global.profile_format" in self.config:
+                args.extend(["--profile-format",
+                             self.config["@global.profile_format"]])
+
         if "use_temporary_dir" in self.parameters:
             value = int(self.parameters["use_temporary_dir"])
             if value:
@@ -88,30 +129,140 @@ class GFamCalculation(CalculationModule):
                 if tmpdir is not None:
                     args.extend(["--temporary-dir", tmpdir])
 
+        if "use_interpro_cache" in self.parameters:
+            value = int(self.parameters["use_interpro_cache"])
+            if value:
+                args.extend(["--interpro-cache",
+                    modula.storage_engine.get_cache_filename(
+                        "interpro_parent_child.cache")])
+
         out_fname = modula.storage_engine.get_filename(self.name)
         stdout = modula.storage_engine.get_result_stream(self, mode="wb")
+        if self.run_report is not None:
+            stdout = CountingWriter(stdout)
+        status = "failed"
         try:
-            with redirected(stdin=stdin, stdout=stdout):
-                retcode = app.run(args)
-            stdout.close()
-            if retcode:
-                raise RuntimeError("non-zero return code from child module")
-        except:
-            # If an error happens, remove the output file and re-raise
-            # the exception
-            stdout.close()
-            os.unlink(out_fname)
-            raise
+            try:
+                with redirected(stdin=stdin, stdout=stdout):
+                    retcode = app.run(args)
+                stdout.close()
+                if retcode:
+                    raise RuntimeError("non-zero return code from child "
+                                       "module")
+                status = "ok"
+            except:
+                # If an error happens, remove the output file and re-raise
+                # the exception
+                stdout.close()
+                os.unlink(out_fname)
+                if os.path.exists(index_filename(out_fname)):
+                    os.unlink(index_filename(out_fname))
+                raise
+        finally:
+            if self.run_report is not None:
+                self.add_to_run_report(measurement, status, inputs,
+                                       out_fname, stdout)
 
         self.logger.info("Finished module %s" % self.name)
 
+    def get_profile_filename(self):
+        """Returns the name of the file where the profile of the calculation
+        should be saved, or ``None`` if the calculation should not be
+        profiled."""
+        key = "@global.profile_modules"
+        if key not in self.config:
+            return None
+        names = [name.strip() for name in self.config[key].split(",")]
+        if self.name not in names:
+            return None
+        if is_profiling():
+            self.logger.warning("Not profiling module %s, the master script "
+                                "is being profiled already" % self.name)
+            return None
+
+        folder = os.path.join(modula.storage_engine.storage_dir, "_profiles")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        if "@global.profile_format" in self.config and \
+                self.config["@global.profile_format"] == "collapsed":
+            ext = "txt"
+        else:
+            ext = "prof"
+        return os.path.join(folder, "%s-%s.%s" % (self.name,
+                            time.strftime("%Y%m%d-%H%M%S"), ext))
+
+    def add_to_run_report(self, measurement, status, inputs, out_fname,
+                          stdout):
+        """Adds the results of the given `gfam.instrumentation.Measurement`
+        to `run_report`, along with the exit status of the calculation,
+        the sizes of the given input files and the size of the output file.
+        `inputs` is a list of pairs containing module or source names and
+        the corresponding file names. `stdout` is the
+        `gfam.instrumentation.CountingWriter` that counted the number of
+        lines written to the output file.
+
+        The number of records in an input file is known only if the input
+        was produced by another calculation in the same run.
+        """
+        def describe(name, fname, records):
+            if os.path.exists(fname):
+                size = os.path.getsize(fname)
+            else:
+                size = None
+            return dict(name=name, file=fname, bytes=size, records=records)
+
+        step = measurement.stop()
+        step["name"] = self.name
+        step["status"] = status
+        step["inputs"] = []
+        for name, fname in inputs:
+            records = None
+            previous = self.run_report.find_step(name)
+            if previous is not None:
+                records = previous["output"]["records"]
+            step["inputs"].append(describe(name, fname, records))
+
+        if stdout.bytes_written or not os.path.exists(out_fname):
+            records = stdout.lines_written
+        else:
+            # The output file was written by an external program
+            records = None
+        step["output"] = describe(self.name, out_fname, records)
+
+        self.run_report.add_step(step)
+
 
 class GFamDiskStorageEngine(DiskStorageEngine):
     """Disk storage engine for GFam that has an empty `store` method.  This is
     because `GFamCalculation` writes directly into the results file and always
     returns ``None``, so there is no need to store the results explicitly.
+
+    If ``compress_work_files`` is true in the ``@global`` section of the
+    Modula configuration, the results of the modules are written as
+    block-compressed gzip files with a block index (see `gfam.bgzf`), except
+    for the modules in `uncompressed_modules`. The names of the compressed
+    result files end in ``.gz``, so `gfam.utils.open_anything` decompresses
+    them transparently.
     """
 
+    #: Modules whose results are never compressed. The result of ``blast_all``
+    #: is written by BLAST itself, and the result of ``seqslicer`` is read by
+    #: ``formatdb``, which does not understand compressed files.
+    uncompressed_modules = frozenset(["blast_all", "seqslicer"])
+
+    def __init__(self, *args, **kwds):
+        super(GFamDiskStorageEngine, self).__init__(*args, **kwds)
+        key = "@global.compress_work_files"
+        self.compress_results = key in self.config and \
+                                self.config.getBoolean(key)
+
+    def _get_module_result_filename(self, module, parameters=None):
+        fname = super(GFamDiskStorageEngine, self).\
+                _get_module_result_filename(module, parameters)
+        if self.is_compressed(module):
+            fname += ".gz"
+        return fname
+
     def get_filename(self, source_or_module):
         """Retrieves the filename corresponding to a data source."""
         try:
@@ -123,6 +274,27 @@ class GFamDiskStorageEngine(DiskStorageEngine):
             raise NotFoundError(source_or_module, source_or_module, ex)
 
 
+    def get_result_stream(self, module, parameters=None, mode="rb"):
+        """Retrieves the result stream of the given module. Compressed
+        results are written with `BlockGzipWriter` and read with
+        `open_anything`."""
+        if not self.is_compressed(module):
+            return super(GFamDiskStorageEngine, self).\
+                    get_result_stream(module, parameters, mode)
+
+        fname = self._get_module_result_filename(module, parameters)
+        if "w" in mode:
+            dirname = os.path.dirname(fname)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            return BlockGzipWriter(fname)
+        return open_anything(fname)
+
+    def is_compressed(self, module):
+        """Returns whether the result of the given module is compressed."""
+        return self.compress_results and \
+               module.name not in self.uncompressed_modules
+
     def store(self, module, result):
         """Empty, does nothing"""
         pass
@@ -155,10 +327,22 @@ class GFamMasterScript(CommandLineApp):
 
         - clean: removes the temporary directory used to store
           intermediate results.
+
+        - profile: summarises the run reports in the work folder and
+          lists the slowest steps of the pipeline.
     """
 
     short_name = "gfam"
 
+    #: Keys in the ``DEFAULT`` section of the configuration file that
+    #: specify which steps should be profiled and how
+    profile_config_keys = ("profile_modules", "profile_format")
+
+    #: Keys in the ``DEFAULT`` section of the configuration file that do not
+    #: affect the results and hence do not invalidate them when changed
+    unhashed_config_keys = profile_config_keys + ("progress_interval",
+                                                  "sort_buffer_size")
+
     def __init__(self, *args, **kwds):
         super(GFamMasterScript, self).__init__(*args, **kwds)
         self.modula = None
@@ -170,6 +354,9 @@ class GFamMasterScript(CommandLineApp):
         parser.add_option("-f", "--force", dest="force", action="store_true",
                 help="force recalculation of results even when gfam thinks "\
                      "everything is up-to-date")
+        parser.add_option("--runs", dest="profile_runs", type=int,
+                metavar="N", help="summarise only the last N run reports "\
+                     "with the profile command")
         return parser
 
     def get_modula_config(self, config):
@@ -190,6 +377,7 @@ class GFamMasterScript(CommandLineApp):
             file.mapping.interpro_parent_child, extract_gene_ids
         infile=file.input.iprscan
         switch.0=-g extract_gene_ids
+        use_interpro_cache=1
 
         [find_unassigned]
         depends=assignment_source_filter, file.input.sequences
@@ -221,6 +409,8 @@ class GFamMasterScript(CommandLineApp):
         [find_domain_arch]
         depends=assignment_source_filter, cca
         infile=assignment_source_filter, cca
+        use_temporary_dir=1
+        use_interpro_cache=1
 
         [label_assignment]
         depends=file.mapping.gene_ontology, file.mapping.interpro2go, find_domain_arch
@@ -238,12 +428,30 @@ class GFamMasterScript(CommandLineApp):
         # Store the name of the config file
         modula_config.set("@global", "config_file", self.options.config_file)
 
+        # Tell the storage engine whether to compress the results
+        if config.has_option("DEFAULT", "compress_work_files"):
+            modula_config.set("@global", "compress_work_files",
+                              config.get("DEFAULT", "compress_work_files"))
+
+        # Tell the calculations which steps to profile
+        for key in self.profile_config_keys:
+            if config.has_option("DEFAULT", key):
+                modula_config.set("@global", key, config.get("DEFAULT", key))
+
         # Store the hash of the configuration as a default parameter for
-        # all the algorithms
+        # all the algorithms. Settings that do not affect the results are
+        # left out from the hash
+        unhashed_settings = {}
+        for key in self.unhashed_config_keys:
+            if config.has_option("DEFAULT", key):
+                unhashed_settings[key] = config.get("DEFAULT", key, raw=True)
+                config.remove_option("DEFAULT", key)
         config_str = StringIO()
         config.write(config_str)
         modula_config.set("DEFAULT", "config_file_hash", \
                 sha1(config_str.getvalue()).hexdigest())
+        for key, value in unhashed_settings.iteritems():
+            config.set("DEFAULT", key, value)
 
         # Set up the module and storage path
         modula_config.set("@paths", "modules", \
@@ -356,9 +564,60 @@ class GFamMasterScript(CommandLineApp):
                     if section == "DEFAULT":
                         seen_keys.add(name)
 
+    @needs_config
+    def do_profile(self):
+        """Summarises the run reports in the work folder and prints the
+        steps of the pipeline ordered by the total time spent in them."""
+        reports = load_reports(self.get_run_report_folder())
+        if self.options.profile_runs:
+            reports = reports[-self.options.profile_runs:]
+        if not reports:
+            self.log.warning("No run reports found in %s" %
+                             self.get_run_report_folder())
+            return
+
+        summary = summarize_reports(reports)
+        total_time = sum(item["total_wall_time"] for item in summary)
+
+        header = ["step", "runs", "failed", "total", "share", "mean",
+                  "max", "CPU", "peak RSS", "output", "records"]
+        rows = []
+        for item in summary:
+            if total_time > 0:
+                share = "%.1f%%" % (100.0 * item["total_wall_time"] /
+                                    total_time)
+            else:
+                share = "-"
+            if item["output_records"] is None:
+                records = "-"
+            else:
+                records = str(item["output_records"])
+            rows.append([item["name"], str(item["runs"]),
+                         str(item["failures"]),
+                         format_duration(item["total_wall_time"]), share,
+                         format_duration(item["mean_wall_time"]),
+                         format_duration(item["max_wall_time"]),
+                         format_duration(item["total_cpu_time"]),
+                         format_bytes(item["peak_rss"]),
+                         format_bytes(item["output_bytes"]), records])
+
+        print "Summary of %d run report(s) in %s:" % \
+                (len(reports), self.get_run_report_folder())
+        print
+        print_table(header, rows)
+
     @needs_config
     def do_run(self):
         """Runs the whole GFam pipeline"""
+        self.start_run_report()
+        try:
+            self.run_pipeline()
+        finally:
+            self.finish_run_report()
+
+    def run_pipeline(self):
+        """Runs all the steps of the GFam pipeline and exports the results
+        into the output folder."""
         # Get the output folder name
         outfolder = os.path.abspath(self.config.get("DEFAULT", "folder.output"))
 
@@ -370,23 +629,62 @@ class GFamMasterScript(CommandLineApp):
         # Run and export the inferred domain architectures
         outfile = os.path.join(outfolder, "domain_architectures.tab")
         self.modula.run("find_domain_arch", force=self.options.force)
-        shutil.copy(self.modula.storage_engine.get_filename("find_domain_arch"),
-                outfile)
+        self.export_result("find_domain_arch", outfile)
         self.log.info("Exported domain architectures to %s." % outfile)
 
         # Run and export the label assignment
         outfile = os.path.join(outfolder, "assigned_labels.txt")
         self.modula.run("label_assignment", force=self.options.force)
-        shutil.copy(self.modula.storage_engine.get_filename("label_assignment"),
-                outfile)
+        self.export_result("label_assignment", outfile)
         self.log.info("Exported label assignment to %s." % outfile)
 
         # Run and export the overrepresentation analysis
         outfile = os.path.join(outfolder, "overrepresentation_analysis.txt")
         self.modula.run("overrep", force=self.options.force)
-        shutil.copy(self.modula.storage_engine.get_filename("overrep"), outfile)
+        self.export_result("overrep", outfile)
         self.log.info("Exported overrepresentation analysis to %s." % outfile)
 
+    def get_run_report_folder(self):
+        """Returns the name of the folder where the run reports are
+        stored."""
+        return os.path.join(self.config.get("DEFAULT", "folder.work"),
+                            "_reports")
+
+    def start_run_report(self):
+        """Creates a new `gfam.instrumentation.RunReport` in the run report
+        folder that will collect the measurements of the calculation steps
+        executed from now on."""
+        fname = "run-%s-%d.json" % (time.strftime("%Y%m%d-%H%M%S"),
+                                    os.getpid())
+        fname = os.path.join(self.get_run_report_folder(), fname)
+        GFamCalculation.run_report = RunReport(fname, " ".join(sys.argv))
+
+    def finish_run_report(self):
+        """Finishes the current run report and saves it if at least one
+        calculation step was executed."""
+        report = GFamCalculation.run_report
+        if report is None:
+            return
+        report.finish()
+        if report.steps:
+            self.log.info("Run report saved to %s." % report.fname)
+        GFamCalculation.run_report = None
+
+    def export_result(self, module_name, outfile):
+        """Copies the result of the given module to the given output file,
+        decompressing it if needed."""
+        infile = self.modula.storage_engine.get_filename(module_name)
+        if not infile.endswith(".gz"):
+            shutil.copy(infile, outfile)
+            return
+
+        source = open_anything(infile)
+        try:
+            with open(outfile, "wb") as target:
+                shutil.copyfileobj(source, target)
+        finally:
+            source.close()
+
 ###########################################################################
 
 CONFIGURATION_FILE_TEMPLATE = """\
@@ -438,6 +736,40 @@ folder.work=work
 # The output folder in which to put the final results
 folder.output=work
 
+# Whether to compress the intermediary files in the working folder. If this
+# is 1, the results of most steps are stored as block-compressed gzip files
+# (along with a block index) that are much smaller than the plain text files.
+# The final results in the output folder are never compressed.
+compress_work_files=0
+
+# When this is larger than zero, find_domain_arch groups the sequences by
+# their domain architectures with an external merge sort in the working
+# folder, writing the assignments, the sequences and the families into
+# sorted runs of at most this many records each. Use this for proteomes
+# whose domain architectures do not fit in memory. Zero groups the sequences
+# in memory.
+sort_buffer_size=0
+
+###########################################################################
+## Profiling                                                             ##
+###########################################################################
+
+# Comma-separated list of the steps of the pipeline to be profiled (e.g.,
+# find_domain_arch, jaccard). The profiles are saved into the _profiles
+# subfolder of the working folder. Changing this setting does not invalidate
+# the intermediary results, so use --force to re-run the steps in question.
+profile_modules=
+
+# The format of the profiles: pstats (cProfile statistics for the pstats
+# module) or collapsed (sampled call stacks that can be turned into a flame
+# graph with flamegraph.pl)
+profile_format=pstats
+
+# Long-running steps log their progress, throughput and estimated remaining
+# time at this interval (in seconds) when GFam is run with -v. Zero turns
+# progress reporting off.
+progress_interval=60
+
 ###########################################################################
 ## External utilities used by GFam                                       ##
 ###########################################################################
@@ -496,7 +828,9 @@ max_overlap=20
 
 # Hint on the number of CPU cores to use during the analysis. Currently
 # the BLAST invocation uses this hint to select the number of threads
-# used by BLAST to speed up calculations.
+# used by BLAST to speed up calculations, and the label assignment and
+# the overrepresentation analysis use it to select the number of worker
+# processes.
 #
 # The default value is 1 since it is not possible to auto-detect the
 # number of CPU cores in a platform independent way. Feel free to raise this
@@ -8,8 +8,7 @@ from collections import defaultdict
 from gfam.go import Tree as GOTree
 from gfam.go.overrepresentation import OverrepresentationAnalyser
 from gfam.interpro import InterPro2GOMapping
-from gfam.scripts import CommandLineApp
-from gfam.utils import open_anything
+from gfam.scripts import CommandLineApp, read_domain_architectures
 
 __author__  = "Tamas Nepusz"
 __email__   = "tamas@cs.rhul.ac.uk"
@@ -61,6 +60,11 @@ class OverrepresentationAnalysisApp(CommandLineApp):
                 config_key="analysis:overrep/min_term_size",
                 help="don't test for overrepresentation of GO terms "
                      "with less than SIZE annotations. Default: %default")
+        parser.add_option("-j", "--jobs", dest="num_jobs", metavar="N",
+                default=1, type=int,
+                config_key="analysis:overrep/num_cpu_cores",
+                help="test the unique domain architectures in N parallel "
+                     "processes. Default: %default")
         return parser
 
     def run_real(self):
@@ -92,15 +96,25 @@ class OverrepresentationAnalysisApp(CommandLineApp):
                 confidence = self.options.confidence,
                 min_count = self.options.min_size,
                 correction = self.options.correction)
-        cache = {}
 
         num_no_annotations = 0
         num_no_domains = 0
         total_seqs = 0
 
-        for line in open_anything(input_file):
-            parts = line.strip().split("\t")
-            gene_id, arch = parts[0], tuple(parts[2].split(";"))
+        # First pass: collect the unique domain architectures
+        genes, unique_archs = read_domain_architectures(input_file)
+
+        # Test all the unique architectures at once
+        self.log.info("Testing %d unique domain architectures..." %
+                      len(unique_archs))
+        if self.options.num_jobs > 1:
+            results = self.test_groups_parallel(overrep, unique_archs)
+        else:
+            results = overrep.test_groups(unique_archs)
+        results = dict(zip(unique_archs, results))
+
+        # Second pass: print the results in the order of the input file
+        for gene_id, arch in genes:
             total_seqs += 1
 
             if arch == ("NO_ASSIGNMENT", ):
@@ -108,18 +122,18 @@ class OverrepresentationAnalysisApp(CommandLineApp):
                 num_no_annotations += 1
                 continue
 
-            if arch not in cache:
-                cache[arch] = overrep.test_group(arch)
-
             print gene_id
-            for term, p_value in cache[arch]:
+            for term, p_value in results[arch]:
                 print "  %.4f: %s (%s)" % (p_value, term.id, term.name)
             print
 
-            if len(cache[arch]) == 0:
+            if len(results[arch]) == 0:
                 num_no_annotations += 1
 
         self.log.info("Total number of sequences processed: %d" % total_seqs)
+        cache = overrep.p_value_cache
+        self.log.info("p-value cache: %d hits, %d misses (hit rate: %.2f%%)"
+                % (cache.hits, cache.misses, 100.0 * cache.hit_rate))
         if num_no_annotations:
             self.log.info("%d sequences have no overrepresented annotations :("
                     % num_no_annotations)
@@ -127,5 +141,32 @@ class OverrepresentationAnalysisApp(CommandLineApp):
             self.log.info("%d sequences have no domains at all :(" % num_no_domains)
 
 
+    def test_groups_parallel(self, overrep, groups):
+        """Tests the given groups with the given `OverrepresentationAnalyser`
+        in parallel processes. The worker processes inherit the analyser
+        (along with the GO tree and the mapping) from this process, so only
+        the groups and the IDs of the overrepresented terms have to be
+        passed between the processes. The hit and miss counts of the p-value
+        caches of the workers are added to the cache of `overrep`."""
+        def test_chunk(chunk):
+            """Tests a chunk of groups in a worker process"""
+            cache = overrep.p_value_cache
+            hits, misses = cache.hits, cache.misses
+            results = [[(term.id, p_value) for term, p_value in result]
+                       for result in overrep.test_groups(chunk)]
+            return results, cache.hits - hits, cache.misses - misses
+
+        results = []
+        lookup = self.go_tree.lookup
+        for chunk_results, hits, misses in self.fork_map_chunks(test_chunk,
+                groups, self.options.num_jobs):
+            for result in chunk_results:
+                results.append([(lookup(term_id), p_value)
+                                for term_id, p_value in result])
+            overrep.p_value_cache.hits += hits
+            overrep.p_value_cache.misses += misses
+        return results
+
+
 if __name__ == "__main__":
     sys.exit(OverrepresentationAnalysisApp().run())
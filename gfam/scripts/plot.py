@@ -5,7 +5,6 @@ statistics of E-value distributions, overlap sizes and domain lengths.
 
 from __future__ import division
 
-import matplotlib
 import os
 import sys
 
@@ -13,7 +12,7 @@ from collections import defaultdict
 from gfam.assignment import Assignment, AssignmentOverlapChecker
 from gfam.interpro import AssignmentReader
 from gfam.scripts import CommandLineApp
-from gfam.utils import Histogram, open_anything
+from gfam.utils import ArrayHistogram, open_anything
 from math import ceil, log10
 from textwrap import TextWrapper
 
@@ -86,6 +85,109 @@ def match(fragment, names):
     raise ValueError("multiple matches for fragment: %s" % fragment)
 
 
+class HistogramAccumulator(object):
+    """Collects histograms of a measure derived from individual assignments,
+    one histogram for each assignment source.
+
+    `func` is called for each assignment fed to `add()`; its return value is
+    added to the histogram of the source of the assignment unless it is
+    ``None``. `bin_size` is the bin size of the histograms.
+
+    Values are collected in per-source buffers first and they are added to
+    `ArrayHistogram` instances in bulk whenever a buffer reaches
+    `buffer_size` items or when the histograms are requested.
+    """
+
+    #: Number of values buffered per source before they are added to the
+    #: histogram of the source
+    buffer_size = 65536
+
+    def __init__(self, func, bin_size=1):
+        self.func = func
+        self.bin_size = bin_size
+        self.buffers = defaultdict(list)
+        self._histograms = {}
+
+    def add(self, assignment):
+        """Adds the given assignment to the appropriate histogram"""
+        value = self.func(assignment)
+        if value is not None:
+            self.add_value(assignment.source, value)
+
+    def add_value(self, source, value):
+        """Adds the given value to the histogram of the given source"""
+        buf = self.buffers[source]
+        buf.append(value)
+        if len(buf) >= self.buffer_size:
+            self.flush(source)
+
+    def flush(self, source):
+        """Adds the buffered values of the given source to its histogram"""
+        buf = self.buffers.pop(source, None)
+        if not buf:
+            return
+        try:
+            histogram = self._histograms[source]
+        except KeyError:
+            histogram = ArrayHistogram(self.bin_size)
+            self._histograms[source] = histogram
+        histogram.add_many(buf)
+
+    @property
+    def histograms(self):
+        """Returns a dict mapping assignment sources to their histograms"""
+        for source in self.buffers.keys():
+            self.flush(source)
+        return self._histograms
+
+
+class OverlapAccumulator(HistogramAccumulator):
+    """Collects histograms of the overlap sizes between assignments of the
+    same sequence and the same source, one histogram for each source.
+
+    Assignments must be fed to `add()` grouped by sequence IDs, just like
+    they appear in an InterPro file. Overlaps longer than 99 residues are
+    counted as 99. An overlap that is at least as long as the assignment
+    that comes later in the input is skipped because it is likely to be
+    a duplicate entry.
+    """
+
+    def __init__(self, bin_size=5):
+        super(OverlapAccumulator, self).__init__(None, bin_size)
+        self.same_seq_assignments = defaultdict(list)
+        self.prev_id = None
+
+    def add(self, assignment):
+        """Adds the given assignment to the assignments of the current
+        sequence. The overlaps are calculated when the next sequence
+        starts or when the histograms are requested."""
+        if assignment.id != self.prev_id:
+            self.process_sequence()
+            self.prev_id = assignment.id
+        self.same_seq_assignments[assignment.source].append(assignment)
+
+    @property
+    def histograms(self):
+        """Returns a dict mapping assignment sources to their histograms"""
+        self.process_sequence()
+        return super(OverlapAccumulator, self).histograms
+
+    def process_sequence(self):
+        """Adds the overlaps between the assignments of the current
+        sequence to the appropriate histograms"""
+        overlapping_pairs = AssignmentOverlapChecker.overlapping_pairs
+        for source, assignments in self.same_seq_assignments.iteritems():
+            if len(assignments) < 2:
+                continue
+            for _, later, overlap in overlapping_pairs(assignments):
+                # If the overlap size equals the domain size,
+                # we skip it -- it is likely to be a duplicate entry
+                if overlap >= assignments[later].get_assigned_length():
+                    continue
+                self.add_value(source, min(overlap, 99))
+        self.same_seq_assignments.clear()
+
+
 class PlotApp(CommandLineApp):
     """\
     Usage: %prog [options] figure_name [figure_name] ...
@@ -94,6 +196,10 @@ class PlotApp(CommandLineApp):
     input data. figure_name specifies the name of the figure to be plotted.
     For a list of supported figures, use "list" as the figure name.  """
 
+    def __init__(self, *args, **kwds):
+        super(PlotApp, self).__init__(*args, **kwds)
+        self._pyplot = None
+
     def create_parser(self):
         """Creates the parser that parses the command line options"""
         parser = super(PlotApp, self).create_parser()
@@ -129,7 +235,7 @@ class PlotApp(CommandLineApp):
         assignment, and their return values will be stored and sorted
         in histograms. The return value will be a dict that maps
         the function names to sub-dicts, each sub-dict mapping assignment
-        sources to `Histogram` instances.
+        sources to `ArrayHistogram` instances.
 
         This may sound too abstract so far, so here's an example. Let
         us assume that `funcs` is a dict with two keys: ``evalue``
@@ -144,16 +250,11 @@ class PlotApp(CommandLineApp):
 
         `bin_size` is the bin size of the histogram.
         """
-        result = defaultdict(lambda: defaultdict(
-            lambda: Histogram(bin_size)
-        ))
-        for assignment in self.get_assignment_reader():
-            for name, func in funcs.iteritems():
-                value = func(assignment)
-                if value is None:
-                    continue
-                result[name][assignment.source].add(value)
-        return result
+        accumulators = dict((name, HistogramAccumulator(func, bin_size)) \
+                            for name, func in funcs.iteritems())
+        self.scan_assignments(accumulators.values())
+        return dict((name, accumulator.histograms) \
+                    for name, accumulator in accumulators.iteritems())
 
     def get_ascii_art_from_histograms(self, histograms):
         """Given a dict mapping assignment source names to `Histogram`
@@ -176,6 +277,15 @@ class PlotApp(CommandLineApp):
             self.parser.error("must specify assignment file, use -a")
         return AssignmentReader(self.options.assignment_file)
 
+    def get_accumulator(self, name):
+        """Returns a new accumulator object for the figure with the given
+        name, or ``None`` if the figure does not need the assignments.
+        Accumulators are created by the ``accumulate_<name>`` methods."""
+        method = getattr(self, "accumulate_%s" % name, None)
+        if method is None:
+            return None
+        return method()
+
     def get_available_figures(self):
         """Returns the list of available figures"""
         return sorted((method[5:], func) \
@@ -268,8 +378,43 @@ class PlotApp(CommandLineApp):
     def get_empty_figure(self, figsize=(12, 8), dpi=96):
         """Returns an empty Matplotlib `Figure` with the given size
         and DPI."""
-        from matplotlib import pyplot
-        return pyplot.figure(figsize=figsize, dpi=dpi)
+        return self.get_pyplot().figure(figsize=figsize, dpi=dpi)
+
+    def get_pyplot(self):
+        """Returns Matplotlib's ``pyplot`` module.
+
+        Matplotlib is imported here and not at the top of the module
+        because importing it is slow; this way, the script starts up
+        quickly and text mode and ``plot list`` work even when Matplotlib
+        is not installed. When the figures are saved to a file, the
+        ``agg`` backend is selected before ``pyplot`` is imported for the
+        first time.
+        """
+        if self._pyplot is None:
+            import matplotlib
+            if self.options.output:
+                matplotlib.use("agg")
+                matplotlib.rcParams["axes.labelsize"] = "smaller"
+                matplotlib.rcParams["xtick.labelsize"] = "smaller"
+                matplotlib.rcParams["ytick.labelsize"] = "smaller"
+            from matplotlib import pyplot
+            self._pyplot = pyplot
+        return self._pyplot
+
+    def scan_assignments(self, accumulators):
+        """Reads the assignment file given in the command line once and
+        feeds each assignment to all the given accumulators."""
+        adders = [accumulator.add for accumulator in accumulators]
+        if not adders:
+            return
+        if len(adders) == 1:
+            adder = adders[0]
+            for assignment in self.get_assignment_reader():
+                adder(assignment)
+            return
+        for assignment in self.get_assignment_reader():
+            for adder in adders:
+                adder(assignment)
 
     def run_real(self):
         """Runs the plotting application"""
@@ -287,25 +432,34 @@ class PlotApp(CommandLineApp):
                 output_ext = output_ext[1:].lower()
             if output_ext == "txt":
                 self.options.text_mode = True
-            else:
-                matplotlib.use("agg")
-                matplotlib.rcParams["axes.labelsize"] = "smaller"
-                matplotlib.rcParams["xtick.labelsize"] = "smaller"
-                matplotlib.rcParams["ytick.labelsize"] = "smaller"
         else:
             output_ext = None
 
         available_figures = self.get_available_figures()
         figure_names = [name for name, _ in available_figures]
+        method_names = []
         for arg in self.args:
             try:
-                method_name = match(arg, figure_names)
+                method_names.append(match(arg, figure_names))
             except ValueError as ex:
                 self.log.warning(ex)
-                continue
 
+        # Collect the data for all the requested figures in a single pass
+        # over the assignment file
+        accumulators = {}
+        for method_name in method_names:
+            if method_name not in accumulators:
+                accumulators[method_name] = self.get_accumulator(method_name)
+        self.scan_assignments([accumulator for accumulator \
+                               in accumulators.itervalues() if accumulator])
+
+        for method_name in method_names:
             method = getattr(self, "plot_%s" % method_name)
-            figure = method()
+            accumulator = accumulators[method_name]
+            if accumulator is None:
+                figure = method()
+            else:
+                figure = method(accumulator)
             if figure is None:
                 # No results, just continue
                 continue
@@ -324,8 +478,7 @@ class PlotApp(CommandLineApp):
                 if self.options.output:
                     figure.savefig(self.options.output)
                 else:
-                    from matplotlib import pyplot
-                    pyplot.show()
+                    self.get_pyplot().show()
 
     def plot_list(self):
         """Lists the names of the available figures"""
@@ -336,10 +489,8 @@ class PlotApp(CommandLineApp):
                 wrapper.initial_indent = ("%-20s " % method).ljust(22)
                 print wrapper.fill(func.figure_name)
 
-    @figure_name("Distribution of log E-values, sorted by data sources")
-    def plot_evalue_distribution(self):
-        """Plots the distribution of E-values for domains from each one
-        of the data sources"""
+    def accumulate_evalue_distribution(self):
+        """Returns an accumulator for `plot_evalue_distribution()`"""
 
         def trimmed_log_evalue(assignment):
             if assignment.evalue is None:
@@ -348,9 +499,18 @@ class PlotApp(CommandLineApp):
                 return -20
             return log10(assignment.evalue)
 
-        histograms = self.calculate_histograms_from_assignments(
-            {"log_evalue": trimmed_log_evalue}
-        )["log_evalue"]
+        return HistogramAccumulator(trimmed_log_evalue)
+
+    @figure_name("Distribution of log E-values, sorted by data sources")
+    def plot_evalue_distribution(self, accumulator=None):
+        """Plots the distribution of E-values for domains from each one
+        of the data sources. `accumulator` is the result of
+        `accumulate_evalue_distribution()` after a pass over the
+        assignments; if it is ``None``, the assignments are read here."""
+        if accumulator is None:
+            accumulator = self.accumulate_evalue_distribution()
+            self.scan_assignments([accumulator])
+        histograms = accumulator.histograms
 
         if self.options.text_mode:
             return self.get_ascii_art_from_histograms(histograms)
@@ -358,56 +518,53 @@ class PlotApp(CommandLineApp):
             return self.get_barplot_from_histograms(histograms,
                     xlabel="log(E-value)", xlim=(-20, 5))
 
-    @figure_name("Distribution of domain lengths, sorted by data sources")
-    def plot_length_distribution(self):
-        """Plots the distribution of domain lengths from each one
-        of the data sources"""
+    #: Domain lengths longer than this are counted in the last bin of
+    #: `plot_length_distribution()`
+    max_domain_length = 600
 
-        max_length = 600
+    def accumulate_length_distribution(self):
+        """Returns an accumulator for `plot_length_distribution()`"""
+        max_length = self.max_domain_length
 
         def trimmed_length(assignment):
             length = assignment.get_assigned_length()
             return min(length, max_length-1)
 
-        histograms = self.calculate_histograms_from_assignments(
-            {"length": trimmed_length},
-            bin_size=int(max_length / 25)
-        )["length"]
+        return HistogramAccumulator(trimmed_length,
+                                    bin_size=int(max_length / 25))
+
+    @figure_name("Distribution of domain lengths, sorted by data sources")
+    def plot_length_distribution(self, accumulator=None):
+        """Plots the distribution of domain lengths from each one
+        of the data sources. `accumulator` is the result of
+        `accumulate_length_distribution()` after a pass over the
+        assignments; if it is ``None``, the assignments are read here."""
+        if accumulator is None:
+            accumulator = self.accumulate_length_distribution()
+            self.scan_assignments([accumulator])
+        histograms = accumulator.histograms
+
         if self.options.text_mode:
             return self.get_ascii_art_from_histograms(histograms)
         else:
             return self.get_barplot_from_histograms(histograms,
-                    xlabel="Domain length", xlim=(0, max_length))
+                    xlabel="Domain length", xlim=(0, self.max_domain_length))
+
+    def accumulate_overlap_distribution(self):
+        """Returns an accumulator for `plot_overlap_distribution()`"""
+        return OverlapAccumulator(5)
 
     @figure_name("Distribution of overlap lengths, sorted by data sources")
-    def plot_overlap_distribution(self):
+    def plot_overlap_distribution(self, accumulator=None):
         """Plots the distribution of overlaps between domain assignments
-        of the same data source, for each of the data sources."""
-        histograms = defaultdict(lambda: Histogram(5))
-        get_overlap_size = AssignmentOverlapChecker.get_overlap_size
-
-        same_seq_assignments, prev_id = [], None
-        for assignment in self.get_assignment_reader():
-            if assignment.id == prev_id:
-                # Calculate overlap with all the previous
-                # assignments
-                for other in same_seq_assignments:
-                    # We care only about assignments from the same source
-                    if assignment.source != other.source:
-                        continue
-                    overlap = get_overlap_size(assignment, other)
-                    # If the overlap size equals the domain size,
-                    # we skip it -- it is likely to be a duplicate entry
-                    if overlap >= assignment.get_assigned_length():
-                        continue
-                    if overlap > 99:
-                        overlap = 99
-                    if overlap:
-                        histograms[assignment.source].add(overlap)
-                same_seq_assignments.append(assignment)
-            else:
-                prev_id = assignment.id
-                same_seq_assignments = [assignment]
+        of the same data source, for each of the data sources.
+        `accumulator` is the result of `accumulate_overlap_distribution()`
+        after a pass over the assignments; if it is ``None``, the
+        assignments are read here."""
+        if accumulator is None:
+            accumulator = self.accumulate_overlap_distribution()
+            self.scan_assignments([accumulator])
+        histograms = accumulator.histograms
 
         if self.options.text_mode:
             return self.get_ascii_art_from_histograms(histograms)
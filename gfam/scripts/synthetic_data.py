@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import sys
+
+from gfam.scripts import CommandLineApp
+from gfam.synthetic import SyntheticDataset
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+class SyntheticDataApp(CommandLineApp):
+    """\
+    Usage: %prog [options] output_dir
+
+    Generates a synthetic GFam input dataset (a FASTA proteome, an IPRScan
+    output file, the InterPro hierarchy, InterPro names, a Gene Ontology
+    and an interpro2go mapping) in the data subfolder of the given folder,
+    and a configuration file named gfam.cfg that uses them. The generated
+    files depend only on the options, so the same dataset can be
+    regenerated anywhere from the same seed.
+    """
+
+    short_name = "synthetic_data"
+
+    def create_parser(self):
+        """Creates the command line parser for this application"""
+        parser = super(SyntheticDataApp, self).create_parser()
+        parser.add_option("-n", "--num-sequences", dest="num_sequences",
+                type=int, default=10000, metavar="N",
+                help="generate N sequences (default: %default)")
+        parser.add_option("-s", "--seed", dest="seed", type=int, default=42,
+                help="random seed (default: %default)")
+        parser.add_option("--novel-fraction", dest="novel_fraction",
+                type=float, default=0.15, metavar="FRACTION",
+                help="fraction of sequences containing a domain from a "
+                     "novel family (default: %default)")
+        parser.add_option("-z", "--compress", dest="compress",
+                action="store_true", default=False,
+                help="compress the FASTA and IPRScan files with gzip")
+        parser.add_option("--set", dest="overrides", action="append",
+                default=[], metavar="KEY=VALUE",
+                help="set the given key in the generated configuration "
+                     "file. May be given multiple times.")
+        return parser
+
+    def run_real(self):
+        """Runs the application"""
+        if len(self.args) != 1:
+            self.error("exactly one output folder must be given")
+
+        overrides = []
+        for item in self.options.overrides:
+            if "=" not in item:
+                self.error("invalid --set argument: %s" % item)
+            overrides.append(tuple(item.split("=", 1)))
+
+        dataset = SyntheticDataset(self.options.num_sequences,
+                                   seed=self.options.seed,
+                                   novel_fraction=self.options.novel_fraction)
+        self.log.info("Generating %d sequences into %s..." %
+                      (self.options.num_sequences, self.args[0]))
+        try:
+            files = dataset.generate(self.args[0],
+                                     compress=self.options.compress,
+                                     overrides=overrides)
+        except KeyError, ex:
+            self.error("no such configuration key: %s" % ex.args[0])
+        self.log.info("Configuration file written to %s." % files["config"])
+
+
+if __name__ == "__main__":
+    sys.exit(SyntheticDataApp().run())
@@ -0,0 +1,509 @@
+"""Generator of synthetic input data for GFam.
+
+The real inputs of GFam (a proteome annotated by InterProScan, the InterPro
+hierarchy and the Gene Ontology) are large and usually cannot be shared
+freely, which makes it hard to benchmark GFam at scale. `SyntheticDataset`
+generates a complete set of input files of any size that resembles the real
+data closely enough to exercise every step of the pipeline:
+
+- proteins are built from domain architectures whose popularity follows a
+  long-tailed distribution, so there are a few huge families and many small
+  ones;
+- each domain is reported by several data sources with slightly different
+  boundaries and source-specific E-values, so the overlap resolution and the
+  E-value filters have work to do;
+- some proteins contain regions that are not covered by any known domain
+  but are shared (with mutations) within novel families, so
+  ``find_unassigned``, BLAST and the clustering steps find new domains;
+- low-complexity regions are reported by ``Seg`` and ``Coil``.
+
+The generated files are fully determined by the parameters of the dataset
+and the random seed.
+
+Usage example::
+
+    dataset = SyntheticDataset(num_sequences=10000, seed=42)
+    files = dataset.generate("synthetic")
+    print files["config"]
+"""
+
+from __future__ import with_statement
+
+__author__  = "Tamas Nepusz"
+__email__   = "tamas@cs.rhul.ac.uk"
+__copyright__ = "Copyright (c) 2010, Tamas Nepusz"
+__license__ = "GPL"
+
+__all__ = ["fill_config_template", "SOURCES", "SyntheticDataset"]
+
+import gzip
+import os
+import random
+import re
+import zlib
+
+from bisect import bisect_right
+
+#: The data sources that report domains, as tuples containing the name of
+#: the source, the format of its signature IDs, the probability that it
+#: reports a given domain occurrence and the range of the decimal exponent
+#: of its E-values (``None`` if the source reports no E-values)
+SOURCES = [
+    ("HMMPfam",     "PF%05d",           0.85, (-60, -1)),
+    ("superfamily", "SSF%05d",          0.60, (-50, -2)),
+    ("Gene3D",      "G3DSA:3.40.%d.10", 0.55, (-50, -2)),
+    ("HMMPanther",  "PTHR%05d",         0.40, (-120, -5)),
+    ("HMMSmart",    "SM%05d",           0.30, (-40, -1)),
+    ("ProfileScan", "PS5%04d",          0.20, None),
+    ("FPrintScan",  "PR%05d",           0.10, (-30, -3)),
+    ("PatternScan", "PS0%04d",          0.10, None),
+    ("HMMTigr",     "TIGR%05d",         0.05, (-80, -5)),
+    ("HMMPIR",      "PIRSF%06d",        0.05, (-100, -5)),
+    ("BlastProDom", "PD%06d",           0.05, (-40, -2)),
+]
+
+#: Amino acids and their approximate relative frequencies in UniProt
+_AMINO_ACIDS = [("A", 83), ("R", 55), ("N", 41), ("D", 55), ("C", 14),
+                ("Q", 39), ("E", 67), ("G", 71), ("H", 23), ("I", 59),
+                ("L", 97), ("K", 58), ("M", 24), ("F", 39), ("P", 47),
+                ("S", 66), ("T", 53), ("W", 11), ("Y", 29), ("V", 69)]
+
+#: Number of domains in an architecture and their relative frequencies
+_ARCHITECTURE_SIZES = [(1, 45), (2, 30), (3, 15), (4, 7), (5, 3)]
+
+#: The root terms of the three Gene Ontology namespaces
+_GO_ROOTS = [("GO:0008150", "biological_process"),
+             ("GO:0003674", "molecular_function"),
+             ("GO:0005575", "cellular_component")]
+
+
+def _cumulative(weights):
+    """Returns the cumulative sums of the given weights for
+    `_weighted_choice`."""
+    result, total = [], 0
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+
+def _weighted_choice(rng, items, cumulative_weights):
+    """Chooses an item randomly with probabilities proportional to the
+    weights whose cumulative sums are given."""
+    value = rng.random() * cumulative_weights[-1]
+    return items[bisect_right(cumulative_weights, value)]
+
+
+def _skewed_index(rng, num_items, skew):
+    """Chooses an index between zero and `num_items`-1 such that smaller
+    indices are much more likely; the larger the `skew`, the longer the
+    tail of the distribution."""
+    return int(num_items * rng.random() ** skew)
+
+
+def fill_config_template(template, values):
+    """Replaces the values of the given keys in a configuration file template
+    such as `gfam.scripts.master.CONFIGURATION_FILE_TEMPLATE`. `values` is a
+    list of key-value pairs; only the first occurrence of each key is
+    replaced, and the comments of the template are kept intact.
+
+    Raises `KeyError` if a key does not occur in the template.
+    """
+    for key, value in values:
+        regexp = re.compile(r"^%s=.*$" % re.escape(key), re.MULTILINE)
+        replacement = "%s=%s" % (key, value)
+        template, count = regexp.subn(lambda match: replacement, template, 1)
+        if not count:
+            raise KeyError(key)
+    return template
+
+
+class SyntheticDataset(object):
+    """A synthetic GFam input dataset of a given size.
+
+    The dataset is described by a model consisting of domain types (each
+    of them with a template sequence, an optional InterPro entry and a
+    signature in each data source), domain architectures and novel domain
+    families. The model is built in the constructor; the input files are
+    generated from the model by the ``write_*`` methods or all at once by
+    `generate()`.
+    """
+
+    def __init__(self, num_sequences=10000, seed=42, novel_fraction=0.15,
+                 num_go_terms=300, id_format="SYN%07d"):
+        """Creates a synthetic dataset with the given number of sequences.
+
+        `seed` is the random seed that determines the generated files.
+        `novel_fraction` is the fraction of proteins that contain a region
+        from a novel domain family. `num_go_terms` is the number of terms in
+        the generated Gene Ontology. `id_format` is the format of the
+        sequence IDs.
+        """
+        self.num_sequences = num_sequences
+        self.seed = seed
+        self.novel_fraction = novel_fraction
+        self.num_go_terms = max(num_go_terms, len(_GO_ROOTS))
+        self.id_format = id_format
+
+        self.num_domains = max(20, num_sequences // 10)
+        self.num_architectures = max(10, num_sequences // 20)
+        self.num_novel_families = max(5, num_sequences // 50)
+
+        self._build_model()
+
+    def _random_residues(self, rng, length):
+        """Returns a random string of amino acids with the given length,
+        taken from the residue pool."""
+        start = rng.randrange(len(self._pool) - length)
+        return self._pool[start:start+length]
+
+    def _mutate(self, rng, template, rate=0.2, chunk_size=8):
+        """Returns a mutated copy of the given template sequence in which
+        roughly a `rate` fraction of the residues are replaced in chunks of
+        `chunk_size` residues."""
+        chunks = []
+        for start in xrange(0, len(template), chunk_size):
+            chunk = template[start:start+chunk_size]
+            if rng.random() < rate:
+                chunk = self._random_residues(rng, len(chunk))
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def _build_model(self):
+        """Builds the model of the dataset: the residue pool, the Gene
+        Ontology, the domain types, the InterPro hierarchy, the domain
+        architectures and the novel families."""
+        rng = random.Random(self.seed)
+
+        # Residue pool from which all the sequences are taken
+        letters = [letter for letter, _ in _AMINO_ACIDS]
+        cumulative = _cumulative([weight for _, weight in _AMINO_ACIDS])
+        self._pool = "".join([_weighted_choice(rng, letters, cumulative)
+                              for _ in xrange(1 << 18)])
+
+        # Gene Ontology: each term has one or two parents in its namespace
+        self.go_terms = []
+        for go_id, namespace in _GO_ROOTS:
+            self.go_terms.append((go_id, namespace, namespace, []))
+        for index in xrange(self.num_go_terms - len(_GO_ROOTS)):
+            root = rng.randrange(len(_GO_ROOTS))
+            candidates = [term for term in self.go_terms
+                          if term[2] == _GO_ROOTS[root][1]]
+            parents = set([rng.choice(candidates)[0]
+                           for _ in xrange(rng.randint(1, 2))])
+            self.go_terms.append(("GO:%07d" % (1000001 + index),
+                                  "synthetic %s %d" % (_GO_ROOTS[root][1].
+                                  split("_")[-1], index + 1),
+                                  _GO_ROOTS[root][1], sorted(parents)))
+        go_names = dict((term[0], term[1]) for term in self.go_terms)
+
+        # Domain types. Three quarters of them are integrated into an
+        # InterPro entry, the others have signatures only
+        self.domains = []
+        for index in xrange(self.num_domains):
+            if rng.random() < 0.75:
+                interpro_id = "IPR%06d" % (index + 1)
+            else:
+                interpro_id = None
+            signatures = [id_format % (index + 1)
+                          for _, id_format, _, _ in SOURCES]
+            length = rng.randint(40, 250)
+            go_ids = []
+            if interpro_id is not None and rng.random() < 0.6:
+                go_ids = sorted(set([self.go_terms[_skewed_index(rng,
+                                     len(self.go_terms), 2)][0]
+                                     for _ in xrange(rng.randint(1, 3))]))
+            self.domains.append(dict(interpro_id=interpro_id,
+                                     name="Synthetic domain %d" % (index + 1),
+                                     signatures=signatures,
+                                     template=self._random_residues(rng,
+                                                                    length),
+                                     go_ids=go_ids))
+        for domain in self.domains:
+            if domain["go_ids"]:
+                domain["go_text"] = ", ".join(["%s (%s)" %
+                        (go_names[go_id], go_id) for go_id in domain["go_ids"]])
+            else:
+                domain["go_text"] = "NULL"
+
+        # InterPro hierarchy: about a third of the entries are children of
+        # another entry, up to three levels deep
+        self.interpro_parents = {}
+        depths = {}
+        integrated = [domain["interpro_id"] for domain in self.domains
+                      if domain["interpro_id"] is not None]
+        for index, interpro_id in enumerate(integrated):
+            depths[interpro_id] = 0
+            if index == 0 or rng.random() >= 0.33:
+                continue
+            parent = integrated[rng.randrange(index)]
+            if depths[parent] < 2:
+                self.interpro_parents[interpro_id] = parent
+                depths[interpro_id] = depths[parent] + 1
+
+        # Domain architectures
+        sizes = [size for size, _ in _ARCHITECTURE_SIZES]
+        cumulative = _cumulative([weight for _, weight in _ARCHITECTURE_SIZES])
+        self.architectures = []
+        for _ in xrange(self.num_architectures):
+            size = _weighted_choice(rng, sizes, cumulative)
+            self.architectures.append([_skewed_index(rng, self.num_domains, 2)
+                                       for _ in xrange(size)])
+
+        # Novel domain families
+        self.novel_families = [self._random_residues(rng, rng.randint(80, 300))
+                               for _ in xrange(self.num_novel_families)]
+
+    def proteins(self):
+        """Generates the proteins of the dataset. Yields tuples containing
+        the ID of the protein, its sequence and its domain assignments.
+        Each assignment is a tuple containing the index of the domain type
+        or ``None`` for low-complexity regions, the name of the source, the
+        signature ID, the start and end positions and the E-value (or
+        ``None``)."""
+        rng = random.Random(self.seed + 1)
+        sources = [(name, probability, evalue_range)
+                   for name, _, probability, evalue_range in SOURCES]
+
+        for index in xrange(self.num_sequences):
+            # Decide what the protein is made of; a few percent of the
+            # proteins have no known domains at all
+            if rng.random() < 0.05:
+                architecture = []
+            else:
+                architecture = self.architectures[_skewed_index(rng,
+                    self.num_architectures, 2.5)]
+            parts = [(domain_index, self._mutate(rng,
+                      self.domains[domain_index]["template"], 0.1))
+                     for domain_index in architecture]
+            if not parts or rng.random() < self.novel_fraction:
+                family = self.novel_families[_skewed_index(rng,
+                    self.num_novel_families, 2)]
+                parts.insert(rng.randint(0, len(parts)),
+                             (None, self._mutate(rng, family)))
+
+            # Build the sequence with random linkers between the parts
+            chunks, positions, length = [], [], 0
+            for domain_index, residues in parts:
+                linker = self._random_residues(rng, rng.randint(5, 60))
+                chunks.append(linker)
+                length += len(linker)
+                if domain_index is not None:
+                    positions.append((domain_index, length + 1,
+                                      length + len(residues)))
+                chunks.append(residues)
+                length += len(residues)
+            linker = self._random_residues(rng, rng.randint(0, 60))
+            chunks.append(linker)
+            sequence = "".join(chunks)
+            length = len(sequence)
+
+            # Domain assignments with slightly different boundaries
+            assignments = []
+            for domain_index, start, end in positions:
+                signatures = self.domains[domain_index]["signatures"]
+                for source_index, (source, probability, evalue_range) in \
+                        enumerate(sources):
+                    if rng.random() >= probability:
+                        continue
+                    hit_start = max(1, start + rng.randint(-10, 10))
+                    hit_end = min(length, end + rng.randint(-10, 10))
+                    if evalue_range is None:
+                        evalue = None
+                    else:
+                        evalue = 10 ** rng.uniform(*evalue_range)
+                    assignments.append((domain_index, source,
+                                        signatures[source_index],
+                                        hit_start, hit_end, evalue))
+
+            # Low-complexity regions
+            for source, domain, probability, min_length, max_length in \
+                    (("Seg", "seg", 0.4, 10, 40), ("Coil", "coil", 0.15,
+                                                   20, 60)):
+                while rng.random() < probability:
+                    start = rng.randint(1, max(1, length - max_length))
+                    end = min(length, start + rng.randint(min_length,
+                                                          max_length))
+                    assignments.append((None, source, domain, start, end,
+                                        None))
+                    probability /= 2.0
+
+            yield self.id_format % (index + 1), sequence, assignments
+
+    def write_proteome(self, sequences_file, iprscan_file):
+        """Writes the sequences of the proteins in FASTA format to
+        `sequences_file` and their domain assignments in the format of the
+        raw IPRScan output to `iprscan_file`. Both arguments must be
+        file-like objects."""
+        domains = self.domains
+        for seq_id, sequence, assignments in self.proteins():
+            sequences_file.write(">%s\n" % seq_id)
+            for start in xrange(0, len(sequence), 60):
+                sequences_file.write(sequence[start:start+60])
+                sequences_file.write("\n")
+
+            checksum = "%016X" % (zlib.crc32(sequence) & 0xffffffff)
+            length = str(len(sequence))
+            lines = []
+            for domain_index, source, signature, start, end, evalue in \
+                    assignments:
+                if domain_index is None:
+                    interpro_id, interpro_name, go_text = "NULL", "NULL", \
+                                                          "NULL"
+                    description = signature
+                else:
+                    domain = domains[domain_index]
+                    interpro_id = domain["interpro_id"] or "NULL"
+                    if interpro_id == "NULL":
+                        interpro_name, go_text = "NULL", "NULL"
+                    else:
+                        interpro_name = domain["name"]
+                        go_text = domain["go_text"]
+                    description = "%s signature" % domain["name"]
+                if evalue is None:
+                    evalue = "NA"
+                else:
+                    evalue = "%.1e" % evalue
+                lines.append("\t".join([seq_id, checksum, length, source,
+                    signature, description, str(start), str(end), evalue,
+                    "T", "01-Jan-2010", interpro_id, interpro_name,
+                    go_text]))
+            if lines:
+                lines.append("")
+                iprscan_file.write("\n".join(lines))
+
+    def write_parent_child_tree(self, fp):
+        """Writes the InterPro hierarchy to the given file-like object in
+        the format of ``ParentChildTreeFile.txt``. Only the entries that
+        have a parent or a child are listed, like in the real file."""
+        children = {}
+        for child, parent in self.interpro_parents.iteritems():
+            children.setdefault(parent, []).append(child)
+        names = dict((domain["interpro_id"], domain["name"])
+                     for domain in self.domains)
+
+        def write_subtree(interpro_id, depth):
+            fp.write("%s%s::%s::\n" % ("--" * depth, interpro_id,
+                                       names[interpro_id]))
+            for child in sorted(children.get(interpro_id, [])):
+                write_subtree(child, depth + 1)
+
+        for interpro_id in sorted(children):
+            if interpro_id not in self.interpro_parents:
+                write_subtree(interpro_id, 0)
+
+    def write_interpro2go(self, fp):
+        """Writes the Gene Ontology annotations of the InterPro entries to
+        the given file-like object in the format of ``interpro2go``."""
+        go_names = dict((term[0], term[1]) for term in self.go_terms)
+        fp.write("!version date: 2010/01/01\n")
+        fp.write("!description: Synthetic mapping of InterPro entries "
+                 "to GO\n")
+        for domain in self.domains:
+            for go_id in domain["go_ids"]:
+                fp.write("InterPro:%s %s > GO:%s ; %s\n" %
+                         (domain["interpro_id"], domain["name"],
+                          go_names[go_id], go_id))
+
+    def write_gene_ontology(self, fp):
+        """Writes the Gene Ontology to the given file-like object in OBO
+        format. Like the real Gene Ontology, the file ends with a
+        ``[Typedef]`` stanza; note that `gfam.go.obo.Parser` does not
+        yield the last stanza of a file."""
+        fp.write("format-version: 1.2\n")
+        fp.write("default-namespace: gene_ontology\n")
+        for go_id, name, namespace, parents in self.go_terms:
+            fp.write("\n[Term]\nid: %s\nname: %s\nnamespace: %s\n" %
+                     (go_id, name, namespace))
+            for parent in parents:
+                fp.write("is_a: %s\n" % parent)
+        fp.write("\n[Typedef]\nid: part_of\nname: part of\n")
+
+    def write_names(self, fp):
+        """Writes the names of the InterPro entries and the signatures to
+        the given file-like object in the format produced by
+        ``download_names.py``."""
+        for domain in self.domains:
+            if domain["interpro_id"] is not None:
+                fp.write("%s\t%s\n" % (domain["interpro_id"], domain["name"]))
+            for signature in domain["signatures"]:
+                fp.write("%s\t%s signature\n" % (signature, domain["name"]))
+
+    def format_config(self, files, overrides=()):
+        """Returns the contents of a GFam configuration file that uses the
+        given input files. `files` is a dict that maps configuration keys to
+        file names; `overrides` is a list of further key-value pairs to be
+        set in the configuration file."""
+        from gfam.scripts.master import CONFIGURATION_FILE_TEMPLATE
+
+        values = sorted(files.iteritems())
+        values.extend(overrides)
+        return fill_config_template(CONFIGURATION_FILE_TEMPLATE, values)
+
+    def generate(self, dirname, compress=False, overrides=()):
+        """Generates all the input files of the dataset in the ``data``
+        subfolder of the given folder, and a configuration file named
+        ``gfam.cfg`` in the folder itself that refers to the input files and
+        uses the ``work`` and ``output`` subfolders for the intermediate and
+        final results. If `compress` is ``True``, the FASTA and the IPRScan
+        files are compressed with gzip. `overrides` is a list of further
+        key-value pairs to be set in the configuration file.
+
+        Returns a dict that maps the configuration keys of the generated
+        files to their names, plus the name of the configuration file with
+        the key ``config``.
+        """
+        dirname = os.path.abspath(dirname)
+        datadir = os.path.join(dirname, "data")
+
+        suffix = compress and ".gz" or ""
+        files = {
+            "file.input.sequences": "proteome.fa" + suffix,
+            "file.input.iprscan": "iprscan.tsv" + suffix,
+            "file.mapping.gene_ontology": "gene_ontology.obo",
+            "file.mapping.interpro2go": "interpro2go",
+            "file.mapping.interpro2name": "names.dat.gz",
+            "file.mapping.interpro_parent_child": "ParentChildTreeFile.txt",
+        }
+        for key, fname in files.items():
+            files[key] = os.path.join(datadir, fname)
+
+        # Fill the configuration template first to catch invalid overrides
+        # before generating the data
+        values = dict(files)
+        values["folder.work"] = os.path.join(dirname, "work")
+        values["folder.output"] = os.path.join(dirname, "output")
+        config = self.format_config(values, overrides)
+
+        if not os.path.isdir(datadir):
+            os.makedirs(datadir)
+
+        def open_output(fname):
+            if fname.endswith(".gz"):
+                return gzip.GzipFile(fname, "wb")
+            return open(fname, "w")
+
+        sequences_file = open_output(files["file.input.sequences"])
+        iprscan_file = open_output(files["file.input.iprscan"])
+        try:
+            self.write_proteome(sequences_file, iprscan_file)
+        finally:
+            sequences_file.close()
+            iprscan_file.close()
+
+        for key, method in [
+                ("file.mapping.gene_ontology", self.write_gene_ontology),
+                ("file.mapping.interpro2go", self.write_interpro2go),
+                ("file.mapping.interpro2name", self.write_names),
+                ("file.mapping.interpro_parent_child",
+                 self.write_parent_child_tree)]:
+            fp = open_output(files[key])
+            try:
+                method(fp)
+            finally:
+                fp.close()
+
+        files["config"] = os.path.join(dirname, "gfam.cfg")
+        with open(files["config"], "w") as fp:
+            fp.write(config)
+        return files
@@ -5,8 +5,10 @@ __email__   = "tamas@cs.rhul.ac.uk"
 __copyright__ = "Copyright (c) 2010, Tamas Nepusz"
 __license__ = "GPL"
 
-__all__ = ["bidict", "complementerset", "Histogram",
-           "open_anything", "redirected", "RunningMean",
+__all__ = ["ArrayHistogram", "BackgroundDecompressor", "bidict",
+           "compactbidict", "complementerset", "external_sort", "fork_map",
+           "Histogram",
+           "LRUCache", "open_anything", "redirected", "RunningMean",
            "search_file", "temporary_dir", "UniqueIdGenerator"]
 
 try:
@@ -19,14 +21,213 @@ try:
 except ImportError:
     pass
 
+import errno
+import heapq
+import marshal
 import os
 import platform
+import signal
 import sys
 
+from array import array
+from bisect import bisect_left
 from contextlib import contextmanager
-from math import ceil
+from itertools import imap
+from math import ceil, floor
 from shutil import rmtree
-from tempfile import mkdtemp
+from tempfile import mkdtemp, mkstemp
+
+try:
+    import zlib
+except ImportError:
+    pass
+
+def _decompress_to_file(fname, decompressor_factory, block_size, outfile):
+    """Reads the compressed file with the given name in blocks of size
+    `block_size`, decompresses them with decompressors returned by
+    `decompressor_factory` and writes the decompressed data to `outfile`.
+    This is executed in the background process of `BackgroundDecompressor`.
+    """
+    infile = open(fname, "rb")
+    try:
+        decompressor, ended = decompressor_factory(), True
+        while True:
+            chunk = infile.read(block_size)
+            if not chunk:
+                break
+            while chunk:
+                try:
+                    outfile.write(decompressor.decompress(chunk))
+                except EOFError:
+                    # bz2 raises EOFError when the stream has already ended;
+                    # the chunk belongs to the next stream
+                    decompressor = decompressor_factory()
+                    continue
+                ended, chunk = False, decompressor.unused_data
+                if chunk:
+                    # The file consists of multiple compressed streams (e.g.,
+                    # concatenated gzip members). Gzip files may also be
+                    # padded with zeros at the end.
+                    ended = True
+                    if not chunk.strip("\x00"):
+                        break
+                    decompressor = decompressor_factory()
+    finally:
+        infile.close()
+
+    if not ended:
+        # Neither decompressor tells whether the end of the stream was
+        # reached, but both of them refuse any extra data after it
+        try:
+            decompressor.decompress("\x00")
+            ended = bool(decompressor.unused_data)
+        except EOFError:
+            ended = True
+        except Exception:
+            pass
+        if not ended:
+            raise IOError("unexpected end of compressed file")
+
+
+class BackgroundDecompressor(object):
+    """Read-only file-like object that decompresses a ``.gz`` or ``.bz2``
+    file in a background process.
+
+    The background process is forked from the current one; it reads the
+    compressed file in large blocks, decompresses them and writes the
+    decompressed data into a pipe. The pipe is bounded, so the background
+    process never gets much ahead of the reader. Decompression therefore
+    runs in parallel with the parsing of the lines in the main process, and
+    the lines are read from an ordinary file object, which is considerably
+    faster than the line iteration of ``gzip.GzipFile``. Files consisting of
+    multiple compressed streams (e.g., concatenated gzip members) are also
+    supported.
+
+    The object supports line iteration, `readline`, `readlines` and `read`,
+    but it cannot seek. `IOError` is raised at the end of the file if the
+    background process failed. `open_anything` uses this class to open
+    compressed files for reading on platforms that support ``os.fork``.
+    """
+
+    #: Whether the file is closed. This is ``True`` until the constructor
+    #: has started the background process.
+    closed = True
+
+    #: Decompressor factories for the supported file extensions
+    decompressors = {
+        ".bz2": lambda: bz2.BZ2Decompressor(),
+        ".gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    }
+
+    def __init__(self, fname, block_size=262144, buffer_size=1048576):
+        """Opens the given compressed file for reading. The compression
+        method is determined from the extension of the file name.
+        `block_size` is the number of compressed bytes read at once by the
+        background process, `buffer_size` is the size of the read buffer
+        of the pipe in the current process."""
+        ext = os.path.splitext(fname)[1]
+        if ext not in self.decompressors:
+            raise ValueError("unsupported compressed file: %s" % fname)
+
+        # Fail early and in the current process if the file does not exist
+        open(fname, "rb").close()
+
+        self.name = fname
+        self.mode = "rb"
+
+        read_fd, write_fd = os.pipe()
+        self._pid = os.fork()
+        if self._pid == 0:
+            # This is the background process. It must never return to the
+            # caller, hence the catch-all except clause and os._exit()
+            status = 1
+            try:
+                try:
+                    os.close(read_fd)
+                    outfile = os.fdopen(write_fd, "wb", 0)
+                    _decompress_to_file(fname, self.decompressors[ext],
+                                        block_size, outfile)
+                    outfile.close()
+                    status = 0
+                except IOError, ex:
+                    if ex.errno != errno.EPIPE:
+                        sys.stderr.write("cannot decompress %s: %s\n" %
+                                         (fname, ex))
+                except:
+                    sys.stderr.write("cannot decompress %s: %s\n" %
+                                     (fname, sys.exc_info()[1]))
+            finally:
+                os._exit(status)
+
+        os.close(write_fd)
+        self._fp = os.fdopen(read_fd, "rb", buffer_size)
+        self.closed = False
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for line in self._fp:
+            yield line
+        self._wait()
+
+    def _wait(self):
+        """Waits for the background process to terminate after the end of
+        the file was reached. Raises `IOError` if the background process
+        failed."""
+        if self._pid is None:
+            return
+        pid, self._pid = self._pid, None
+        if os.waitpid(pid, 0)[1]:
+            raise IOError("cannot decompress %s" % self.name)
+
+    def close(self):
+        """Closes the file and terminates the background process if it is
+        still running."""
+        if self.closed:
+            return
+        self.closed = True
+        self._fp.close()
+        if self._pid is not None:
+            pid, self._pid = self._pid, None
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+    def read(self, size=-1):
+        """Reads at most `size` bytes from the file or everything until the
+        end of the file if `size` is negative."""
+        data = self._fp.read(size)
+        if size < 0 or len(data) < size:
+            self._wait()
+        return data
+
+    def readline(self, size=-1):
+        """Reads the next line from the file, including the trailing
+        newline character. Returns an empty string at the end of the file.
+        If `size` is not negative, at most `size` bytes are returned."""
+        line = self._fp.readline(size)
+        if not line and size != 0:
+            self._wait()
+        return line
+
+    def readlines(self, sizehint=None):
+        """Reads all the remaining lines from the file and returns them
+        in a list."""
+        # pylint: disable-msg=W0613
+        # W0613: unused argument
+        lines = self._fp.readlines()
+        self._wait()
+        return lines
+
 
 class bidict(object):
     """Bidirectional many-to-many mapping.
@@ -151,6 +352,277 @@ class bidict(object):
         return self.right.iteritems()
 
 
+class compactbidict(object):
+    """Read-only bidirectional many-to-many mapping with a small memory
+    footprint.
+
+    This class stores the same relationships as `bidict`, but the items on
+    both sides are replaced by dense integer indices and the adjacency lists
+    are stored in compressed sparse row (CSR) format in typed arrays, one
+    for each direction. Therefore, each pair costs only a few bytes per
+    direction instead of a hash table entry in two Python sets.
+
+    `left` and `right` behave like read-only dictionaries that map items to
+    read-only set-like views of the items on the other side. The views
+    support ``len()`` (in constant time), iteration and membership tests,
+    so a `compactbidict` can be used in place of a `bidict` wherever the
+    mapping is only queried and not modified.
+
+    Instances can be constructed from a `bidict`, from a dict that maps left
+    items to iterables of right items or from an iterable that yields
+    pairs of a left item and an iterable of right items. Left items listed
+    with no right items are kept as left items with an empty set.
+
+    Example::
+
+        >>> bd = compactbidict({"foo": ["bar", "baz"], "frob": ["baz"]})
+        >>> sorted(bd.get_left("foo"))
+        ['bar', 'baz']
+        >>> sorted(bd.get_right("baz"))
+        ['foo', 'frob']
+        >>> len(bd.right["bar"])
+        1
+        >>> "frob" in bd.get_right("bar")
+        False
+        >>> bd.len_left()
+        2
+        >>> bd.len_right()
+        2
+    """
+
+    def __init__(self, items=None):
+        object.__init__(self)
+
+        if items is None:
+            items = ()
+        elif isinstance(items, (bidict, compactbidict)):
+            items = items.iteritems_left()
+        elif isinstance(items, dict):
+            items = items.iteritems()
+
+        left_items, right_items = [], []
+        left_index, right_index = {}, {}
+        left_indptr, left_indices = array("l", [0]), array("l")
+
+        for left_item, right_items_of_left in items:
+            if left_item in left_index:
+                raise ValueError("duplicate left item: %r" % (left_item, ))
+            left_index[left_item] = len(left_items)
+            left_items.append(left_item)
+
+            row = set()
+            for right_item in right_items_of_left:
+                try:
+                    row.add(right_index[right_item])
+                except KeyError:
+                    right_index[right_item] = len(right_items)
+                    row.add(len(right_items))
+                    right_items.append(right_item)
+            left_indices.extend(sorted(row))
+            left_indptr.append(len(left_indices))
+
+        # Build the right adjacency lists by a counting sort of the pairs
+        # on the right indices. Rows of the left arrays are visited in
+        # increasing order, so the right adjacency lists end up sorted
+        right_indptr = array("l", [0] * (len(right_items) + 1))
+        for right_idx in left_indices:
+            right_indptr[right_idx + 1] += 1
+        for right_idx in xrange(len(right_items)):
+            right_indptr[right_idx + 1] += right_indptr[right_idx]
+        right_indices = array("l", [0] * len(left_indices))
+        next_slot = array("l", right_indptr)
+        for left_idx in xrange(len(left_items)):
+            for pos in xrange(left_indptr[left_idx], left_indptr[left_idx+1]):
+                right_idx = left_indices[pos]
+                right_indices[next_slot[right_idx]] = left_idx
+                next_slot[right_idx] += 1
+
+        self.left = _CSRMapping(left_items, left_index, left_indptr,
+                                left_indices, right_items, right_index)
+        self.right = _CSRMapping(right_items, right_index, right_indptr,
+                                 right_indices, left_items, left_index)
+
+    def get_left(self, v1, default=None):
+        """Returns the items associated to `v1` when `v1` is looked up from the
+        left dictionary. `default` will be returned if `v1` is not in the left
+        dictionary."""
+        return self.left.get(v1, default)
+
+    def get_right(self, v1, default=None):
+        """Returns the items associated to `v1` when `v1` is looked up from the
+        right dictionary. `default` will be returned if `v2` is not in the right
+        dictionary."""
+        return self.right.get(v1, default)
+
+    def len_left(self):
+        """Returns the number of unique left items"""
+        return len(self.left)
+
+    def len_right(self):
+        """Returns the number of unique right items"""
+        return len(self.right)
+
+    def iteritems_left(self):
+        """Iterates over the left dictionary"""
+        return self.left.iteritems()
+
+    def iteritems_right(self):
+        """Iterates over the right dictionary"""
+        return self.right.iteritems()
+
+
+class _CSRMapping(object):
+    """One direction of a `compactbidict`.
+
+    Maps the items of one side of the relationship to `_CSRRow` views.
+    The row of the item with index ``i`` contains the indices of the
+    associated items of the other side in ``indices[indptr[i]:indptr[i+1]]``
+    in increasing order.
+    """
+
+    __slots__ = ("items", "index", "indptr", "indices",
+                 "other_items", "other_index")
+
+    def __init__(self, items, index, indptr, indices, other_items,
+                 other_index):
+        self.items = items
+        self.index = index
+        self.indptr = indptr
+        self.indices = indices
+        self.other_items = other_items
+        self.other_index = other_index
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def __getitem__(self, item):
+        return self.row(self.index[item])
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, item, default=None):
+        """Returns the row of `item` or `default` if `item` is not known."""
+        try:
+            idx = self.index[item]
+        except KeyError:
+            return default
+        return self.row(idx)
+
+    def iteritems(self):
+        """Iterates over the item-row pairs"""
+        for idx, item in enumerate(self.items):
+            yield item, self.row(idx)
+
+    def iterkeys(self):
+        """Iterates over the items"""
+        return iter(self.items)
+
+    def itervalues(self):
+        """Iterates over the rows"""
+        for idx in xrange(len(self.items)):
+            yield self.row(idx)
+
+    def keys(self):
+        """Returns the list of items"""
+        return list(self.items)
+
+    def row(self, idx):
+        """Returns the row corresponding to the item with the given index."""
+        return _CSRRow(self, self.indptr[idx], self.indptr[idx+1])
+
+
+class _CSRRow(object):
+    """Read-only set-like view of a row of a `_CSRMapping`."""
+
+    __slots__ = ("mapping", "start", "end")
+
+    def __init__(self, mapping, start, end):
+        self.mapping = mapping
+        self.start = start
+        self.end = end
+
+    def __contains__(self, item):
+        try:
+            idx = self.mapping.other_index[item]
+        except (KeyError, TypeError):
+            return False
+        pos = bisect_left(self.mapping.indices, idx, self.start, self.end)
+        return pos < self.end and self.mapping.indices[pos] == idx
+
+    def __eq__(self, other):
+        if isinstance(other, (_CSRRow, set, frozenset)):
+            return len(self) == len(other) and all(item in other \
+                    for item in self)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __iter__(self):
+        return imap(self.mapping.other_items.__getitem__,
+                    self.mapping.indices[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+
+#: The function being mapped by `fork_map` in the worker processes
+_forked_func = None
+
+def _call_forked_func(item):
+    """Calls the function registered by `fork_map` on the given item. This
+    is executed in the worker processes of `fork_map`."""
+    return _forked_func(item)
+
+def fork_map(func, items, processes=None, chunksize=1):
+    """Calls `func` on each element of `items` in a pool of worker processes
+    and returns the results in a list, in the same order as the items.
+
+    Unlike ``multiprocessing.Pool.map``, `func` does not have to be picklable
+    because the worker processes are forked after `func` has been registered,
+    so they inherit `func` and everything it refers to (e.g., large data
+    structures loaded by the parent process) from the parent. Only the items
+    and the results are sent between the processes.
+
+    `processes` is the number of worker processes to use; ``None`` means the
+    number of CPU cores. `chunksize` is passed on to
+    ``multiprocessing.Pool.map``. If `processes` is 1, if the platform cannot
+    fork or if the ``multiprocessing`` module is not available, the items
+    are processed in the current process.
+    """
+    global _forked_func
+
+    items = list(items)
+    if processes == 1 or len(items) < 2 or not hasattr(os, "fork"):
+        return map(func, items)
+
+    try:
+        import multiprocessing
+    except ImportError:
+        return map(func, items)
+
+    _forked_func = func
+    try:
+        pool = multiprocessing.Pool(processes)
+        try:
+            return pool.map(_call_forked_func, items, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _forked_func = None
+
+
 class Histogram(object):
     """Generic histogram class for real numbers
     
@@ -347,6 +819,269 @@ class Histogram(object):
     def __str__(self):
         return self.to_string()
 
+class ArrayHistogram(Histogram):
+    """Histogram class for real numbers that keeps its bins in an array
+
+    The bins are aligned to the integer multiples of the bin width, so
+    the bin of a number depends only on the number and not on the order
+    in which the numbers were added. The counts are stored in a NumPy
+    array if NumPy is available, and `add_many()` then calculates the
+    bin indices of all the numbers at once and counts them with
+    ``numpy.bincount``. Partial histograms with the same bin width can
+    be combined with `merge()`.
+
+    Example:
+
+        >>> h = ArrayHistogram(5)
+        >>> h << [2,3,2,7,8,5,5,0,7,9]
+        >>> print h
+        N = 10, mean +- sd: 4.8000 +- 2.9740
+        [ 0,  5): **** (4)
+        [ 5, 10): ****** (6)
+        >>> h.merge(ArrayHistogram(5, [-1, 12]))
+        >>> print h.to_string(show_bars=False)
+        N = 12, mean +- sd: 4.9167 +- 3.8720
+        [-5,  0): 1
+        [ 0,  5): 4
+        [ 5, 10): 6
+        [10, 15): 1
+    """
+
+    def __init__(self, bin_width = 1, data = None):
+        """Initializes the histogram with the given data set.
+
+        :param bin_width: the bin width of the histogram.
+        :param data: the data set to be used. Must contain real numbers.
+        """
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self._numpy = numpy
+        self._offset = None
+        super(ArrayHistogram, self).__init__(bin_width, data)
+
+    def _extend(self, first, last):
+        """Ensures that the bins with indices from `first` to `last`
+        (inclusive) exist. Bin ``i`` covers the half-open interval from
+        ``i * bin_width`` to ``(i+1) * bin_width``."""
+        numpy = self._numpy
+        if self._offset is None:
+            self._offset = first
+            if numpy is None:
+                self._bins = [0] * (last-first+1)
+            else:
+                self._bins = numpy.zeros(last-first+1, dtype=int)
+        else:
+            before = max(self._offset-first, 0)
+            after = max(last-self._offset-len(self._bins)+1, 0)
+            if not before and not after:
+                return
+            if numpy is None:
+                self._bins = [0]*before + self._bins + [0]*after
+            else:
+                self._bins = numpy.concatenate((
+                    numpy.zeros(before, dtype=int), self._bins,
+                    numpy.zeros(after, dtype=int)))
+            self._offset -= before
+        self._min = self._offset * self._bin_width
+        self._max = self._min + len(self._bins) * self._bin_width
+
+    def add(self, num, repeat=1):
+        """Adds a single number to the histogram.
+
+        :param num: the number to be added
+        :param repeat: number of repeated additions
+        """
+        num = float(num)
+        binidx = int(floor(num / self._bin_width))
+        self._extend(binidx, binidx)
+        self._bins[binidx-self._offset] += repeat
+        self._running_mean.add(num, repeat)
+
+    def add_many(self, data):
+        """Adds a single number or the elements of an iterable to the
+        histogram.
+
+        :param data: an iterable containing the data to be added
+        """
+        numpy = self._numpy
+        if numpy is None:
+            return super(ArrayHistogram, self).add_many(data)
+
+        if isinstance(data, numpy.ndarray):
+            values = data.astype(float).ravel()
+        else:
+            try:
+                values = numpy.fromiter(data, dtype=float)
+            except TypeError:
+                values = numpy.array([data], dtype=float)
+        if not len(values):
+            return
+
+        indices = numpy.floor(values / self._bin_width).astype(int)
+        self._extend(int(indices.min()), int(indices.max()))
+        self._bins += numpy.bincount(indices - self._offset,
+                                     minlength=len(self._bins))
+        if len(values) > 1:
+            sd = values.std(ddof=1)
+        else:
+            sd = 0.0
+        self._running_mean.merge(RunningMean(len(values), values.mean(), sd))
+    __lshift__ = add_many
+
+    def bins(self):
+        """Generator returning the bins of the histogram in increasing
+        order
+        
+        Returns a tuple with the following elements: left bound, right
+        bound, number of elements in the bin"""
+        for left, right, elem in super(ArrayHistogram, self).bins():
+            yield left, right, int(elem)
+
+    def clear(self):
+        """Clears the collected data"""
+        super(ArrayHistogram, self).clear()
+        self._offset = None
+
+    def merge(self, other):
+        """Adds the counts and the statistics of another histogram with the
+        same bin width to this histogram. `other` may also be an ordinary
+        `Histogram`; its bins are assumed to be aligned to the integer
+        multiples of the bin width."""
+        if other.bin_width != self.bin_width:
+            raise ValueError("bin widths differ: %r and %r" % \
+                             (self.bin_width, other.bin_width))
+        if not other.n:
+            return
+
+        bins = [(int(floor(left / self._bin_width + 0.5)), count) \
+                for left, _, count in other.bins()]
+        self._extend(bins[0][0], bins[-1][0])
+        if self._numpy is not None and isinstance(other, ArrayHistogram):
+            start = bins[0][0] - self._offset
+            self._bins[start:start+len(bins)] += other._bins
+        else:
+            for binidx, count in bins:
+                self._bins[binidx-self._offset] += count
+        self._running_mean.merge(other._running_mean)
+
+
+class LRUCache(object):
+    """Dictionary-like cache of bounded size that discards the least recently
+    used items first when it is full.
+
+    The cache also counts the number of successful and unsuccessful lookups,
+    which can be used to judge how effective the cache is.
+
+    Example::
+
+        >>> cache = LRUCache(2)
+        >>> cache["A"] = 1
+        >>> cache["B"] = 2
+        >>> cache["A"]
+        1
+        >>> cache["C"] = 3         # this discards "B"
+        >>> "B" in cache
+        False
+        >>> cache.get("B", 42)
+        42
+        >>> cache.hits, cache.misses
+        (1, 1)
+        >>> cache.hit_rate
+        0.5
+    """
+
+    def __init__(self, max_size=65536):
+        """Creates a new cache that holds at most `max_size` items."""
+        if max_size < 1:
+            raise ValueError("max_size must be positive")
+        self.max_size = int(max_size)
+        self.hits, self.misses = 0, 0
+        self._data = {}
+        # Sentinel of the circular doubly linked list that keeps the
+        # entries in the order of their last use (most recent first).
+        # Each entry is a list: [previous, next, key, value]
+        self._root = []
+        self.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        """Retrieves the item corresponding to `key` and marks it as the most
+        recently used one. Raises `KeyError` and counts a miss if there is no
+        such key in the cache."""
+        try:
+            entry = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._move_to_front(entry)
+        return entry[3]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        """Stores `value` in the cache with the given `key`, discarding the
+        least recently used item if the cache is full."""
+        try:
+            entry = self._data[key]
+        except KeyError:
+            pass
+        else:
+            entry[3] = value
+            self._move_to_front(entry)
+            return
+
+        root = self._root
+        if len(self._data) >= self.max_size:
+            oldest = root[0]
+            oldest[0][1], root[0] = root, oldest[0]
+            del self._data[oldest[2]]
+
+        first = root[1]
+        entry = [root, first, key, value]
+        first[0] = root[1] = entry
+        self._data[key] = entry
+
+    def _move_to_front(self, entry):
+        """Moves the given linked list entry to the front of the list."""
+        root = self._root
+        if root[1] is entry:
+            return
+        prev, next = entry[0], entry[1]
+        prev[1], next[0] = next, prev
+        first = root[1]
+        entry[0], entry[1] = root, first
+        first[0] = root[1] = entry
+
+    def clear(self):
+        """Removes all the items from the cache. Hit and miss counts are
+        kept intact."""
+        self._data.clear()
+        self._root[:] = [self._root, self._root, None, None]
+
+    def get(self, key, default=None):
+        """Returns the item corresponding to `key` or `default` if the key
+        is not in the cache. Lookups are counted as hits or misses."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    @property
+    def hit_rate(self):
+        """Returns the fraction of lookups that were successful so far, or
+        zero if there were no lookups yet."""
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / float(total)
+
+
 def open_anything(fname, *args, **kwds):
     """Opens the given file. The file may be given as a file object
     or a filename. If the filename ends in ``.bz2`` or ``.gz``, it will
@@ -354,6 +1089,10 @@ def open_anything(fname, *args, **kwds):
     with ``http://``, ``https://`` or ``ftp://`` and there is no
     other argument given, the remote URL will be opened for reading.
     A single dash in place of the filename means the standard input.
+
+    Compressed files opened for reading are decompressed in a background
+    process by `BackgroundDecompressor` if the platform supports
+    ``os.fork``.
     """
     if isinstance(fname, file):
         infile = fname
@@ -363,6 +1102,10 @@ def open_anything(fname, *args, **kwds):
          fname.startswith("https://")) and not kwds and not args:
         import urllib2
         infile = urllib2.urlopen(fname)
+    elif (fname[-4:] == ".bz2" or fname[-3:] == ".gz") and \
+            hasattr(os, "fork") and not kwds and \
+            args in ((), ("r", ), ("rb", )):
+        infile = BackgroundDecompressor(fname)
     elif fname[-4:] == ".bz2":
         infile = bz2.BZ2File(fname, *args, **kwds)
     elif fname[-3:] == ".gz":
@@ -476,6 +1219,28 @@ class RunningMean(object):
             self.add(value)
         return self._mean, self._sd
 
+    def merge(self, other):
+        """RunningMean.merge(other)
+
+        Merges the elements seen by another `RunningMean` instance into
+        the elements from which we calculate the mean and the standard
+        deviation, as if they were added one by one. This uses the
+        pairwise update formula of Chan, Golub and LeVeque.
+
+        @param other: the other running mean calculator
+        @return: the new mean and standard deviation as a tuple"""
+        n1, n2 = self._nitems, other._nitems
+        if not n2:
+            return self._mean, self._sd
+        nitems = n1 + n2
+        delta = other._mean - self._mean
+        self._mean += delta * n2 / nitems
+        self._sqdiff += other._sqdiff + delta * delta * n1 * n2 / nitems
+        self._nitems = nitems
+        if self._nitems > 1:
+            self._sd = (self._sqdiff / (self._nitems-1)) ** 0.5
+        return self._mean, self._sd
+
     @property
     def result(self):
         """Returns the current mean and standard deviation as a tuple"""
@@ -565,6 +1330,111 @@ def temporary_dir(*args, **kwds):
         rmtree(name)
 
 
+def _write_run(items, dirname):
+    """Writes the given items into a new file in the given folder with
+    `marshal` and returns the name of the file. The file is closed when
+    the function returns."""
+    fd, fname = mkstemp(dir=dirname)
+    run = os.fdopen(fd, "wb")
+    try:
+        dump = marshal.dump
+        for item in items:
+            dump(item, run)
+    finally:
+        run.close()
+    return fname
+
+
+def _read_run(fname):
+    """Yields the items written into the given file by `_write_run`. The
+    file is open only while the items are being read."""
+    run = open(fname, "rb")
+    try:
+        load = marshal.load
+        while True:
+            try:
+                yield load(run)
+            except EOFError:
+                return
+    finally:
+        run.close()
+
+
+def external_sort(items, buffer_size=100000, dir=None, merge_width=32):
+    """Generator that yields the items of the given iterable in sorted order
+    while keeping at most `buffer_size` of them in memory.
+
+    The items are sorted in runs of `buffer_size` items, and each sorted run
+    is written into a file in a temporary folder created in `dir` (or in the
+    default temporary directory of the system if `dir` is ``None``). The runs
+    are merged with `heapq.merge` in batches of at most `merge_width` runs,
+    repeatedly, until at most `merge_width` runs remain; these are merged
+    while the result is being consumed. The run files are closed while they
+    are not being merged, so the generator never keeps more than
+    `merge_width` + 1 files open. If there is only one run, it is sorted in
+    memory. The items must be serializable with `marshal`; tuples of
+    strings and numbers are fine. The temporary folder is removed when the
+    generator is exhausted or closed.
+
+    Example::
+
+        >>> list(external_sort([3, 1, 2, 5, 4], buffer_size=2))
+        [1, 2, 3, 4, 5]
+        >>> items = range(1000, 0, -1)
+        >>> list(external_sort(items, buffer_size=3, merge_width=2)) == \\
+        ...     sorted(items)
+        True
+    """
+    if merge_width < 2:
+        raise ValueError("merge_width must be at least 2")
+
+    runs, buffer, tmp_dir, readers = [], [], None, []
+    try:
+        for item in items:
+            buffer.append(item)
+            if len(buffer) >= buffer_size:
+                if tmp_dir is None:
+                    if dir is not None and not os.path.isdir(dir):
+                        os.makedirs(dir)
+                    tmp_dir = mkdtemp(dir=dir)
+                buffer.sort()
+                runs.append(_write_run(buffer, tmp_dir))
+                buffer = []
+
+        if not runs:
+            buffer.sort()
+            for item in buffer:
+                yield item
+            return
+
+        if buffer:
+            buffer.sort()
+            runs.append(_write_run(buffer, tmp_dir))
+        buffer = None
+
+        while len(runs) > merge_width:
+            merged_runs = []
+            for start in xrange(0, len(runs), merge_width):
+                batch = runs[start:start+merge_width]
+                if len(batch) > 1:
+                    merged = heapq.merge(*[_read_run(run) for run in batch])
+                    merged_runs.append(_write_run(merged, tmp_dir))
+                    for run in batch:
+                        os.unlink(run)
+                else:
+                    merged_runs.extend(batch)
+            runs = merged_runs
+
+        readers = [_read_run(run) for run in runs]
+        for item in heapq.merge(*readers):
+            yield item
+    finally:
+        for reader in readers:
+            reader.close()
+        if tmp_dir is not None:
+            rmtree(tmp_dir)
+
+
 class UniqueIdGenerator(object):
     """A dictionary-like class that can be used to assign unique integer IDs to
     names.